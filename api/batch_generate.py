@@ -0,0 +1,77 @@
+import os
+from flask import request
+from flask_restful import Resource
+from config import Config
+from utils.common_utils import validate_json
+from utils.batch_utils import run_batch
+from utils.job_utils import dispatch_job, is_async_request, request_deadline
+
+
+class BatchGenerate(Resource):
+    def post(self):
+        """
+        Run many generations in parallel across worker processes.
+        Expects JSON payload with:
+        - items (list): Generate payloads, same shape as /code/generate
+          (context, instruction, code_template, directory, model, options).
+        - directory (str, optional): Directory receiving the combined archive.
+        - sync (bool, optional): Wait for the result instead of returning a job id (also `?sync=1`).
+        - deadline (float, optional): Seconds after which the batch is cancelled (also `?deadline=`).
+        Returns:
+            dict: The job id, or with `sync` the per item results and the combined archive.
+        """
+
+        try:
+            payload = request.get_json()
+
+            # Validate required fields
+            is_valid, data = validate_json(payload, ["items"])
+            if not is_valid:
+                raise ValueError(data)
+
+            items = data["items"]
+            if not isinstance(items, list) or not items:
+                raise ValueError("'items' must be a non-empty list")
+            if len(items) > Config.BATCH_MAX_ITEMS:
+                raise ValueError(f"At most {Config.BATCH_MAX_ITEMS} items are allowed per batch")
+
+            # Validate every item the same way /code/generate does
+            batch_items = []
+            for index, item in enumerate(items):
+                if not isinstance(item, dict):
+                    raise ValueError(f"Item {index}: Invalid JSON payload")
+
+                is_valid, item_data = validate_json(item, ["context", "instruction"])
+                if not is_valid:
+                    raise ValueError(f"Item {index}: {item_data}")
+
+                batch_items.append(
+                    {
+                        "model_name": item_data.get("model", Config.MODEL),
+                        "context": item_data.get("context", ""),
+                        "instruction": item_data.get("instruction", ""),
+                        "code_template": item_data.get("code_template", ""),
+                        "directory": os.path.abspath(
+                            item_data.get("directory", os.getcwd())
+                        ),
+                        "options": item_data.get("options", {}),
+                    }
+                )
+
+            # The batch itself runs as one job that fans out to the process pool
+            return dispatch_job(
+                "code/batch",
+                run_batch,
+                batch_items,
+                directory=data.get("directory", os.getcwd()),
+                run_async=is_async_request(request, data),
+                deadline=request_deadline(request, data),
+                payload=data,
+            )
+
+        except ValueError as e:
+            return {"ValueError": str(e)}, 400
+
+        except Exception as e:
+            print(f"Error in BatchGenerate: {str(e)}")
+            return {"error": str(e), "status": "error"}, 500
@@ -2,13 +2,9 @@ import os
 from flask import request
 from flask_restful import Resource
 from config import Config
-from utils.common_utils import (
-    validate_json,
-    setup_directory,
-    build_instruction,
-    create_zip_file,
-)
-from utils.aider_utils import create_coder, execute_instruction
+from utils.common_utils import validate_json
+from utils.generation_utils import coalesce_key, is_cached, run_generation
+from utils.job_utils import dispatch_job, is_async_request, is_stream_request, request_deadline
 
 
 class CodeAssistant(Resource):
@@ -21,11 +17,13 @@ class CodeAssistant(Resource):
         - directory (str, optional): Directory to operate in.
         - model (str, optional): Model name to use.
         - options (dict, optional): Additional options like auto_commits, dirty_commits, dry_run.
+        - sync (bool, optional): Wait for the result instead of returning a job id (also `?sync=1`).
+        - stream (bool, optional): Stream the output as Server-Sent Events (also `?stream=1`).
+        - deadline (float, optional): Seconds after which the job is cancelled (also `?deadline=`).
         Returns:
-            dict: Response containing execution result, status, and output directory info.
+            dict: The job id, or with `sync` the execution result, status and output directory info.
         """
 
-        original_dir = None
         try:
             payload = request.get_json()
 
@@ -48,56 +46,31 @@ class CodeAssistant(Resource):
             model_name = data.get("model", Config.MODEL)
             options = data.get("options", {})
 
-            # Change to specified directory if provided
-            original_dir = os.getcwd()
-            base_output_dir = setup_directory(directory, original_dir)
-
-            # Configure Aider options
-            auto_commits = options.get("auto_commits", False)
-            dirty_commits = options.get("dirty_commits", False)
-            dry_run = options.get("dry_run", False)
-
-            # Get list of existing directories before execution
-            existing_dirs = set()
-            if os.path.exists(base_output_dir):
-                existing_dirs = set(os.listdir(base_output_dir))
-
-            # Create model and coder instances
-            coder = create_coder(
+            # Run the generation on the job worker pool
+            return dispatch_job(
+                "code/prompt",
+                run_generation,
                 model_name=model_name,
+                instruction=instruction,
+                directory=directory,
+                options=options,
                 files=files,
-                auto_commits=auto_commits,
-                dirty_commits=dirty_commits,
-                dry_run=dry_run,
-            )
-
-            # Build complete instruction
-            full_instruction = build_instruction(
-                None, instruction, None, base_output_dir
+                run_async=is_async_request(request, data),
+                stream=is_stream_request(request, data),
+                deadline=request_deadline(request, data),
+                payload=data,
+                admit=model_name,
+                coalesce_key=coalesce_key(
+                    model_name, directory, instruction=instruction, files=files, options=options
+                ),
+                cached=lambda: is_cached(
+                    model_name, directory, instruction=instruction, files=files, options=options
+                ),
             )
 
-            # Execute the instruction
-            result = execute_instruction(coder, full_instruction)
-
-            # Create zip file of the new output directory
-            output_dir = create_zip_file(base_output_dir, existing_dirs)
-
-            return {
-                "response": result,
-                "status": 201,
-                "directory": directory,
-                "files_processed": [os.path.basename(f) for f in files],
-                "model_used": model_name,
-                "output_directory": output_dir,
-            }
-
         except ValueError as e:
             return {"ValueError": str(e)}, 400
 
         except Exception as e:
             print(f"Error in CodeAssistant: {str(e)}")
             return {"error": str(e), "status": "error"}, 500
-        finally:
-            # Return to original directory
-            if original_dir:
-                os.chdir(original_dir)
@@ -1,13 +1,18 @@
 import os
 import json
-import tempfile
 from flask import request
 from flask_restful import Resource
-from werkzeug.utils import secure_filename
-from aider.coders import Coder, ArchitectCoder
-from aider.models import Model
-from aider.io import InputOutput
+from werkzeug.exceptions import RequestEntityTooLarge
 from config import Config
+from utils.file_store_utils import FileTooLarge, file_store, parse_file_ids, store_uploads
+from utils.generation_utils import coalesce_key, is_cached, run_generation
+from utils.job_utils import (
+    dispatch_job,
+    is_async_request,
+    is_stream_request,
+    recoverable,
+    request_deadline,
+)
 
 
 class FileCodeAssistant(Resource):
@@ -15,15 +20,24 @@ class FileCodeAssistant(Resource):
         """
         The `post` function handles file uploads, processes the uploaded files using Aider, and returns
         the result along with relevant information.
+        Files uploaded before (here or to /files) can be referenced with `file_ids` instead.
+        Pass `base_job_id` to update the output of an earlier job with only the change,
+        and `deadline` (seconds) to cancel the job when it runs longer.
+        Returns a job id right away unless `sync=true` (form field or query parameter) asks to
+        wait for the result, `stream=true` sends the output as Server-Sent Events.
         """
-        original_dir = None
-        temp_files = []
+        file_ids = []
         try:
             # Handle file uploads
             uploaded_files = request.files.getlist("files")
             instruction = request.form.get("instruction", "")
             directory = request.form.get("directory", os.getcwd())
             model_name = request.form.get("model", Config.MODEL)
+            base_job_id = request.form.get("base_job_id") or None
+            try:
+                deadline = request_deadline(request, request.form)
+            except ValueError as e:
+                return {"ValueError": str(e)}, 400
             # aider_mode_prefix = request.form.get('aider_mode_prefix', '/architect') # Always use /architect for now
 
             # Handle options parameter - it might be a JSON string
@@ -36,139 +50,127 @@ class FileCodeAssistant(Resource):
             except json.JSONDecodeError:
                 options = {}
 
+            # Files uploaded earlier are referenced by id instead of being sent again
+            requested_ids = parse_file_ids(request.form.get("file_ids"))
+
             # Validate required fields
-            if not uploaded_files:
-                return {"error": "At least one file must be uploaded"}, 400
+            if not uploaded_files and not requested_ids:
+                return {"error": "At least one file must be uploaded or referenced by file_ids"}, 400
 
-            # Create temporary files for Aider to read
-            original_dir = os.getcwd()
+            # Stream the uploads into the shared store, identical content is kept once
+            stored = store_uploads(uploaded_files)
+            file_ids = parse_file_ids(requested_ids + [f["file_id"] for f in stored])
 
-            # Ensure directory exists and change to it
-            try:
-                if directory and directory != os.getcwd():
-                    abs_directory = os.path.abspath(directory)
-                    os.makedirs(abs_directory, exist_ok=True)
-                    os.chdir(abs_directory)
-                    print(f"Changed to directory: {abs_directory}")
-            except Exception as e:
-                return {"error": f"Failed to change directory: {str(e)}"}, 400
-
-            # Create temporary files for Aider reference only
-            for file in uploaded_files:
-                if file.filename:
-                    # Create temporary file
-                    temp_file = tempfile.NamedTemporaryFile(
-                        mode="w+b",
-                        suffix=f"_{secure_filename(file.filename)}",
-                        delete=False,
-                    )
-                    file.save(temp_file.name)
-                    temp_files.append(temp_file.name)
-                    print(f"Created temporary reference file: {temp_file.name}")
-
-            if not temp_files:
-                if original_dir:
-                    os.chdir(original_dir)
+            if not file_ids:
                 return {"error": "No files were successfully processed"}, 400
 
-            # Configure Aider options with safe defaults
-            auto_commits = options.get("auto_commits", False)
-            dirty_commits = options.get("dirty_commits", False)
-            dry_run = options.get("dry_run", False)
-
-            # Create InputOutput for non-interactive mode with all confirmations disabled
-            io = InputOutput(yes=True, pretty=False)
-
-            # Create output directory and specify clear instructions
-            output_dir = os.path.join(os.getcwd(), "output")
-            os.makedirs(output_dir, exist_ok=True)
-
-            # Create model and coder instances
+            # Keep the files from being evicted until the job is over
             try:
-                model = Model(model=model_name)
-
-                # if aider_mode_prefix in ['/architect', 'architect']:
-                coder = ArchitectCoder.create(
-                    main_model=model,
-                    io=io,
-                    fnames=[],  # No files to edit
-                    read_only_fnames=temp_files,  # Reference files only
-                    auto_commits=auto_commits,
-                    dirty_commits=dirty_commits,
-                    dry_run=dry_run,
-                )
-                # else:
-                #     coder = Coder.create(
-                #         main_model=model,
-                #         fnames=[],  # No files to edit
-                #         read_only_fnames=temp_files,  # Reference files only
-                #         io=io,
-                #         auto_commits=auto_commits,
-                #         dirty_commits=dirty_commits,
-                #         dry_run=dry_run,
-                #     )
-            except Exception as e:
-                # Clean up temp files
-                for temp_file in temp_files:
-                    try:
-                        os.unlink(temp_file)
-                    except:
-                        pass
-                if original_dir:
-                    os.chdir(original_dir)
-                return {"error": f"Failed to initialize model/coder: {str(e)}"}, 500
+                reference_files = file_store.acquire(file_ids)
+            except KeyError as e:
+                file_ids = []
+                return {"error": f"File not found: {e.args[0]}", "status": "error"}, 404
 
             # If no instruction provided, set a default one
             if not instruction:
                 instruction = "Please analyze the uploaded specification files and implement the requirements."
 
-            # Modify instruction to specify output location and prevent file modification
-            instruction += f"\n\nIMPORTANT: Create all new implementation files in a new folder with meaningful name related to the implementation inside the 'output' directory: {output_dir}."
-
-            # Execute the instruction
-            try:
-                result = coder.run(instruction)
-                print(f"Coder execution completed successfully")
-            except Exception as e:
-                if original_dir:
-                    os.chdir(original_dir)
-                return {"error": f"Failed to execute coder: {str(e)}"}, 500
-            finally:
-                # Clean up temporary files
-                for temp_file in temp_files:
-                    try:
-                        os.unlink(temp_file)
-                        print(f"Cleaned up temporary file: {temp_file}")
-                    except Exception as e:
-                        print(f"Failed to clean up {temp_file}: {e}")
-
-            # Return to original directory
-            if original_dir:
-                os.chdir(original_dir)
-
-            return {
-                "response": result,
-                "status": "success",
-                "directory": directory,
-                "files_processed": [os.path.basename(f) for f in temp_files],
-                "model_used": model_name,
-                "output_directory": output_dir,
-            }
+            # Run the generation on the job worker pool, the job releases the files from here
+            attached = []
+            response = dispatch_job(
+                "code/files",
+                run_with_reference_files,
+                file_ids,
+                reference_files,
+                model_name=model_name,
+                instruction=instruction,
+                directory=directory,
+                options=options,
+                base_job_id=base_job_id,
+                run_async=is_async_request(request, request.form),
+                stream=is_stream_request(request, request.form),
+                deadline=deadline,
+                payload={
+                    "instruction": instruction,
+                    "directory": directory,
+                    "model": model_name,
+                    "options": options,
+                    "files": [os.path.basename(f) for f in reference_files],
+                    "file_ids": file_ids,
+                    "base_job_id": base_job_id,
+                },
+                admit=model_name,
+                coalesce_key=coalesce_key(
+                    model_name,
+                    directory,
+                    instruction=instruction,
+                    files=reference_files,
+                    options=options,
+                    base_job_id=base_job_id,
+                ),
+                cached=lambda: is_cached(
+                    model_name,
+                    directory,
+                    instruction=instruction,
+                    files=reference_files,
+                    options=options,
+                    base_job_id=base_job_id,
+                ),
+                on_attach=lambda: attached.append(True),
+            )
+
+            # Release the files here when no job of this request runs: the request was
+            # rejected by admission control, or attached to an identical in-flight job
+            if attached or (isinstance(response, tuple) and response[1] == 429):
+                file_store.release(file_ids)
+            file_ids = []
+            return response
+
+        except (FileTooLarge, RequestEntityTooLarge) as e:
+            file_store.release(file_ids)
+            return {"error": str(e), "status": "error"}, 413
+
+        except ValueError as e:
+            file_store.release(file_ids)
+            return {"ValueError": str(e)}, 400
 
         except Exception as e:
-            # Clean up temporary files on error
-            for temp_file in temp_files:
-                try:
-                    os.unlink(temp_file)
-                except:
-                    pass
-
-            # Ensure we return to original directory on any error
-            if original_dir and os.path.exists(original_dir):
-                try:
-                    os.chdir(original_dir)
-                except:
-                    pass  # If we can't change back, at least don't crash
+            file_store.release(file_ids)
 
             print(f"Error in FileCodeAssistant: {str(e)}")
             return {"error": str(e), "status": "error"}, 500
+
+
+# Take the stored files again for a job that runs again after a restart
+def reacquire_reference_files(args, kwargs):
+    """
+    Keep the reference files of a recovered job from eviction, as the request did.
+    Args:
+        args (list): Stored positional arguments, file ids first.
+        kwargs (dict): Stored keyword arguments.
+    Returns:
+        tuple: (args, kwargs) with the current paths of the files.
+    Raises:
+        KeyError: One of the files is no longer in the store.
+    """
+    file_ids = args[0]
+    return [file_ids, file_store.acquire(file_ids), *args[2:]], kwargs
+
+
+# Job entry point for generations based on uploaded reference files
+@recoverable(resume=reacquire_reference_files)
+def run_with_reference_files(file_ids, reference_files, **kwargs):
+    """
+    Run a generation with stored files as read-only references
+    and release them for eviction once the run is over.
+    Args:
+        file_ids (list): Ids of the files in the file store.
+        reference_files (list): Paths of the stored files.
+        **kwargs: Arguments forwarded to run_generation.
+    Returns:
+        dict: Response of run_generation.
+    """
+    try:
+        return run_generation(files=reference_files, **kwargs)
+    finally:
+        file_store.release(file_ids)
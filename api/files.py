@@ -0,0 +1,44 @@
+from flask import request
+from flask_restful import Resource
+from werkzeug.exceptions import RequestEntityTooLarge
+from utils.file_store_utils import FileTooLarge, file_store, store_uploads
+
+
+class FileUpload(Resource):
+    def post(self):
+        """
+        Store uploaded reference files without running a generation.
+        The returned file ids can be passed as `file_ids` to /code/files,
+        so the same files do not have to be uploaded again.
+        Returns:
+            dict: Metadata and id of every stored file.
+        """
+        try:
+            uploaded_files = request.files.getlist("files")
+            if not uploaded_files:
+                return {"error": "At least one file must be uploaded"}, 400
+
+            return {"files": store_uploads(uploaded_files), "status": "success"}, 201
+
+        except (FileTooLarge, RequestEntityTooLarge) as e:
+            return {"error": str(e), "status": "error"}, 413
+
+        except Exception as e:
+            print(f"Error in FileUpload: {str(e)}")
+            return {"error": str(e), "status": "error"}, 500
+
+
+class FileInfo(Resource):
+    def get(self, file_id):
+        """
+        Return the metadata of a stored reference file.
+        Args:
+            file_id (str): The file id returned by an upload.
+        Returns:
+            dict: File id, name, size and creation time.
+        """
+        meta = file_store.get(file_id)
+        if meta is None:
+            return {"error": f"File not found: {file_id}", "status": "error"}, 404
+
+        return meta
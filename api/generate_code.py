@@ -2,23 +2,21 @@ import os
 from flask import request
 from flask_restful import Resource
 from config import Config
-from utils.common_utils import (
-    build_instruction,
-    setup_directory,
-    create_zip_file,
-    validate_json,
-    upload_to_cloud,
-)
-from utils.aider_utils import create_coder, execute_instruction
+from utils.common_utils import validate_json
+from utils.generation_utils import coalesce_key, is_cached, run_generation
+from utils.job_utils import dispatch_job, is_async_request, is_stream_request, request_deadline
 
 
 class GenerateCode(Resource):
     def post(self):
         """
         Generate code based on provided context and instructions.
+        Returns a job id right away unless `sync: true` (or `?sync=1`) asks to wait for the
+        result, `stream: true` (or `?stream=1`) sends the output as Server-Sent Events.
+        Pass `base_job_id` to update the output of an earlier job with only the change,
+        and `deadline` (seconds) to cancel the job when it runs longer.
         """
 
-        original_dir = None
         try:
             payload = request.get_json()
 
@@ -41,66 +39,59 @@ class GenerateCode(Resource):
             directory = data.get("directory", os.getcwd())
             model_name = data.get("model", Config.MODEL)
             options = data.get("options", {})
+            base_job_id = data.get("base_job_id")
 
-            # Configure Aider options with safe defaults
-            auto_commits = options.get("auto_commits", False)
-            dirty_commits = options.get("dirty_commits", False)
-            dry_run = options.get("dry_run", False)
-
-            # Change to specified directory if provided
-            original_dir = os.getcwd()
-            base_output_dir = setup_directory(directory, original_dir)
-
-            # Get list of existing directories before execution
-            existing_dirs = set()
-            if os.path.exists(base_output_dir):
-                existing_dirs = set(os.listdir(base_output_dir))
-
-            # Create model and coder instances
-            coder = create_coder(
+            # Run the generation on the job worker pool
+            return dispatch_job(
+                "code/generate",
+                run_generation,
                 model_name=model_name,
-                auto_commits=auto_commits,
-                dirty_commits=dirty_commits,
-                dry_run=dry_run,
+                context=context,
+                instruction=instruction,
+                code_template=code_template,
+                directory=directory,
+                options=options,
+                base_job_id=base_job_id,
+                run_async=is_async_request(request, data),
+                stream=is_stream_request(request, data),
+                deadline=request_deadline(request, data),
+                payload=data,
+                admit=model_name,
+                coalesce_key=coalesce_key(
+                    model_name,
+                    directory,
+                    context=context,
+                    instruction=instruction,
+                    code_template=code_template,
+                    options=options,
+                    base_job_id=base_job_id,
+                ),
+                cached=lambda: is_cached(
+                    model_name,
+                    directory,
+                    context=context,
+                    instruction=instruction,
+                    code_template=code_template,
+                    options=options,
+                    base_job_id=base_job_id,
+                ),
             )
 
-            # Build complete instruction
-            full_instruction = build_instruction(
-                context, instruction, code_template, base_output_dir
-            )
-
-            # Execute the instruction
-            result = execute_instruction(coder, full_instruction)
-
-            # Create zip file of the new output directory
-            output_dir = create_zip_file(base_output_dir, existing_dirs)
-
-            return {
-                "response": result,
-                "status": 201,
-                "directory": directory,
-                "files_processed": [],
-                "model_used": model_name,
-                "output_directory": output_dir,
-            }
-
         except ValueError as e:
             return {"ValueError": str(e)}, 400
 
         except Exception as e:
             print(f"Error in GenerateCode: {str(e)}")
             return {"error": str(e), "status": "error"}, 500
-        finally:
-            # Return to original directory
-            if original_dir:
-                os.chdir(original_dir)
 
     # Functional Code Generation Methods
     def generate_code(
-        self, context, instruction, code_template="", directory=None, options=None
+        self, context, instruction, code_template="", directory=None, options=None, base_job_id=None
     ):
         """
         Function to Generate code based on provided context and instructions.
+        Runs as a job of the shared job manager, like the endpoints, so it takes a worker,
+        goes through admission control and attaches to an identical in-flight job.
 
         Args:
             context (str): The context or existing code to consider.
@@ -108,12 +99,14 @@ class GenerateCode(Resource):
             code_template (str, optional): A template to guide code generation. Defaults to ''.
             directory (str, optional): The working directory for code generation. Defaults to None.
             options (dict, optional): Additional options like auto_commits, dirty_commits, dry_run. Defaults to None.
+            base_job_id (str, optional): Earlier job whose output is updated, only the changed files
+                are zipped and uploaded. Defaults to None.
 
         Returns:
-            dict: A dictionary containing the response, status, directory, files processed and output directory.
+            dict: A dictionary containing the response, status, directory, files processed and output directory,
+            or a (response body, http status) tuple when the job failed.
         """
 
-        original_dir = None
         try:
             if context is None and instruction is None:
                 raise ValueError("'context' or 'instruction' is required")
@@ -135,118 +128,45 @@ class GenerateCode(Resource):
                 options.setdefault("dirty_commits", False)
                 options.setdefault("dry_run", False)
 
-            # Change to specified directory if provided
-            original_dir = os.getcwd()
-            base_output_dir = setup_directory(directory, original_dir)
-
-            # Get list of existing directories before execution
-            existing_dirs = set()
-            if os.path.exists(base_output_dir):
-                existing_dirs = set(os.listdir(base_output_dir))
-
-            # Create model and coder instances
-            coder = create_coder(
+            # Build the instruction from the raw instruction only and upload the result
+            response = dispatch_job(
+                "direct",
+                run_generation,
                 model_name=model_name,
-                auto_commits=options["auto_commits"],
-                dirty_commits=options["dirty_commits"],
-                dry_run=options["dry_run"],
+                context=instruction,
+                directory=directory,
+                options=options,
+                require_output=True,
+                upload=True,
+                base_job_id=base_job_id,
+                run_async=False,
+                # Record what the model is sent, incremental runs diff against the base job's payload
+                payload={
+                    "context": instruction,
+                    "directory": directory,
+                    "options": options,
+                    "base_job_id": base_job_id,
+                },
+                admit=model_name,
+                coalesce_key=coalesce_key(
+                    model_name,
+                    directory,
+                    context=instruction,
+                    options=options,
+                    base_job_id=base_job_id,
+                ),
+                cached=lambda: is_cached(
+                    model_name,
+                    directory,
+                    context=instruction,
+                    options=options,
+                    base_job_id=base_job_id,
+                ),
             )
 
-            # temp_instruction = """
-            # # Aider Instructions for Python Implementation
-
-            # ## Generated Instruction
-            # Generate a Python implementation for the torque sensor transfer function analysis using the provided code template. Ensure to fill in the placeholders with appropriate logic for sensor specifications, error calculations, and performance assessments. Specifically, replace the following placeholders with relevant values:
-            # - {{SENSOR_TYPE}}: e.g., "Torque Sensor"
-            # - {{APPLICATION_NAME}}: e.g., "Torque Measurement"
-            # - {{INPUT_PHYSICAL_QUANTITY}}: e.g., "Torque"
-            # - {{OUTPUT_TYPES}}: e.g., ["Voltage", "Current"]
-            # - {{SYSTEMATIC_ERROR_1}}: e.g., "Non-linearity"
-            # - {{ERROR_1_DESCRIPTION}}: e.g., "Deviation from the ideal output"
-            # - {{NONLINEARITY_SPEC}}: e.g., 0.01
-            # - {{HYSTERESIS_SPEC}}: e.g., 0.005
-            # - {{TEMP_DRIFT_SPEC}}: e.g., 0.002
-            # - {{REPEATABILITY_SPEC}}: e.g., 0.001
-            # - {{NOISE_SPEC}}: e.g., 0.0005
-            # - {{CALIBRATION_METADATA}}: e.g., "Calibration performed on 2023-01-01"
-            # - {{PARAMETER_INITIALIZATION_LOGIC}}: Logic to initialize parameters based on sensor specs
-            # - {{OUTPUT_UNIT}}: e.g., "Nm"
-            # - {{SENSITIVITY_UNIT}}: e.g., "V/Nm"
-            # - {{INPUT_UNIT}}: e.g., "Nm"
-            # - {{LINEAR_SENSITIVITY_CALCULATION}}: Logic for calculating linear sensitivity
-            # - {{NOMINAL_OUTPUT_VALUE}}: e.g., 5.0
-            # - {{ZERO_INPUT_OUTPUT}}: e.g., 0.0
-            # - {{NONLINEAR_FITTING_METHOD}}: Logic for fitting non-linear models
-            # - {{OFFSET_CALCULATION}}: Logic for calculating offset
-            # - {{DEFAULT_OFFSET_VALUE}}: e.g., 0.0
-            # - {{ADDITIONAL_SYSTEMATIC_ERRORS}}: Any extra systematic errors
-            # - {{ADDITIONAL_RANDOM_ERRORS}}: Any extra random errors
-            # - {{ADDITIONAL_SYSTEMATIC_CALCULATIONS}}: Additional calculations for systematic errors
-            # - {{ADDITIONAL_RANDOM_ERROR_COMPONENTS}}: Additional components for random errors
-            # - {{ADDITIONAL_RANDOM_ERROR_STD}}: Additional standard deviations for random errors
-            # - {{ACCURACY_SPEC}}: e.g., "±0.1%"
-            # - {{RESPONSE_TIME_SPEC}}: e.g., "50 ms"
-            # - {{DRIFT_SPEC}}: e.g., "0.01 Nm per year"
-            # - {{NOISE_LEVEL_SPEC}}: e.g., "0.0005 Nm"
-            # - {{ADDITIONAL_PERFORMANCE_METRICS}}: Any extra performance metrics
-            # - {{ACCURACY_ASSESSMENT_LOGIC}}: Logic for assessing accuracy
-            # - {{RESPONSE_TIME_LOGIC}}: Logic for assessing response time
-
-            # ## Implementation Steps
-            # 1. Define the SensorSpecifications and ErrorParameters dataclasses to encapsulate sensor details and error characteristics.
-            # 2. Implement the MathUtils class with methods for polynomial fitting, interpolation, filtering, and error calculations.
-            # 3. Create the TransferFunctionAnalyzer class to handle the transfer function analysis, including methods for calculating ideal outputs, systematic errors, and measured outputs.
-            # 4. In the TransferFunctionAnalyzer, initialize parameters based on sensor specifications and calibration data.
-            # 5. Implement methods to calculate systematic errors and generate random errors based on defined error parameters.
-            # 6. Create a PerformanceAnalyzer class to assess the sensor's performance against specified metrics.
-            # 7. Implement methods in PerformanceAnalyzer to evaluate accuracy and response time based on test inputs and reference outputs.
-            # 8. Use logging to track the initialization and calculations throughout the analysis process.
-
-            # ## Required Libraries
-            # numpy, matplotlib, typing, dataclasses, logging
-
-            # ## Input Variables
-            # nominal_torque: float, temperature: float, time: float
-
-            # ## Output Variables
-            # frequency_output: float, voltage_output: float
-            # """
-
-            # Build complete instruction
-            # full_instruction = build_instruction(
-            #     context, instruction, code_template, base_output_dir
-            # )
-            full_instruction = build_instruction(
-                instruction, None, None, base_output_dir
-            )
-
-            # Execute the instruction
-            result = execute_instruction(coder, full_instruction)
-
-            # Create zip file of the new output directory
-            zip_result = create_zip_file(base_output_dir, existing_dirs)
-
-            output_dir = zip_result.get("output_dir")
-            zipFile = zip_result.get("zipfile")
-            zipName = zip_result.get("zip_path")
-            zipStatus = zip_result.get("status", False)
-
-            # Return error if zip creation failed
-            if not zipStatus:
-                raise ValueError("No new files were generated, zip file not created.")
-
-            # Upload zip file to cloud storage
-            if zipFile and zipName:
-                upload_to_cloud(zipFile, zipName)
-
-            return {
-                "response": result,
-                "status": 201,
-                "directory": directory,
-                "files_processed": [],
-                "model_used": model_name,
-                "output_directory": output_dir,
-            }
+            # Rejections also carry a Retry-After header, callers only get the body and status
+            body, http_status = response[0], response[1]
+            return body if http_status == 200 else (body, http_status)
 
         except ValueError as e:
             return {"ValueError": str(e)}, 400
@@ -254,7 +174,3 @@ class GenerateCode(Resource):
         except Exception as e:
             print(f"Error in GenerateCode: {str(e)}")
             return {"error": str(e), "status": "error"}, 500
-        finally:
-            # Return to original directory
-            if original_dir:
-                os.chdir(original_dir)
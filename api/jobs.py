@@ -0,0 +1,77 @@
+import os
+from flask import send_file
+from flask_restful import Resource
+from utils.job_utils import job_manager
+
+# Seconds a cancel request waits for the job to stop before answering
+CANCEL_WAIT = 10
+
+
+class JobStatus(Resource):
+    def get(self, job_id):
+        """
+        Return the status of a generation job and its result once finished.
+        Args:
+            job_id (str): The job id returned by an asynchronous POST.
+        Returns:
+            dict: Job status, timings and result.
+        """
+        job = job_manager.get(job_id)
+        if job is None:
+            return {"error": f"Job not found: {job_id}", "status": "error"}, 404
+
+        return job.to_dict()
+
+    def delete(self, job_id):
+        """
+        Cancel a queued or running generation job. The job stops at its next model
+        call, streamed chunk or file write, and its partial output is removed.
+        Args:
+            job_id (str): The job id returned by the generation endpoint.
+        Returns:
+            dict: The job, 200 once it has stopped, 202 while it is still stopping or when
+            another worker process runs it and the request was recorded in the job store.
+        """
+        job = job_manager.get(job_id)
+        if job is None:
+            return {"error": f"Job not found: {job_id}", "status": "error"}, 404
+        if job.done:
+            return {"error": f"Job already {job.status}: {job_id}", "status": "error"}, 409
+
+        job, local = job_manager.cancel(job_id)
+        if job is None:
+            return {"error": f"Job already finished: {job_id}", "status": "error"}, 409
+
+        # A job of another worker process stops once its owner sees the request
+        if not local:
+            return job.to_dict(), 202
+
+        job.wait(CANCEL_WAIT)
+        return job.to_dict(), 200 if job.done else 202
+
+
+class JobArchive(Resource):
+    def get(self, job_id):
+        """
+        Download the zip file produced by a finished generation job.
+        The file is streamed from disk in chunks.
+        Args:
+            job_id (str): The job id returned by the generation endpoint.
+        Returns:
+            flask.Response: The zip file, or an error when the job has no archive.
+        """
+        job = job_manager.get(job_id)
+        if job is None:
+            return {"error": f"Job not found: {job_id}", "status": "error"}, 404
+
+        zip_path = (job.result or {}).get("zip_path")
+        if not job.done or not zip_path or not os.path.exists(zip_path):
+            return {"error": f"No archive available for job: {job_id}", "status": "error"}, 404
+
+        return send_file(
+            zip_path,
+            mimetype="application/zip",
+            as_attachment=True,
+            download_name=os.path.basename(zip_path),
+            conditional=True,
+        )
@@ -1,21 +1,65 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 from flask_restful import Api
 from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from api.code_assistant import CodeAssistant
 from api.file_code_assistant import FileCodeAssistant
 from api.generate_code import GenerateCode
+from api.batch_generate import BatchGenerate
+from api.jobs import JobStatus, JobArchive
+from api.files import FileUpload, FileInfo
+from config import Config
+from utils.admission_utils import admission_controller
+from utils.aider_utils import coder_pool
+from utils.cache_utils import result_cache
+from utils.file_store_utils import file_store
+from utils.job_utils import job_manager
+from utils.metrics_utils import render_metrics, start_gauge_refresh, update_queue_metrics
+from utils.retention_utils import retention_manager
+from utils.upload_utils import cloud_uploader
+from utils.warmup_utils import warm_up
 
 # Load environment variables
 load_dotenv(override=True)
 
 app = Flask(__name__)
+# Uploads beyond this size are refused before they are read
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_REQUEST_BYTES
 api = Api(app)
 
 # Add the code assistant endpoint
 api.add_resource(CodeAssistant, '/code/prompt')
 api.add_resource(FileCodeAssistant, '/code/files')
 api.add_resource(GenerateCode, '/code/generate')
+api.add_resource(BatchGenerate, '/code/batch')
+api.add_resource(JobStatus, '/jobs/<string:job_id>')
+api.add_resource(JobArchive, '/jobs/<string:job_id>/archive')
+api.add_resource(FileUpload, '/files')
+api.add_resource(FileInfo, '/files/<string:file_id>')
+
+
+# Start the background threads of this process
+def start_background_services():
+    # Import aider and load the configured models in the background, /health answers meanwhile
+    warm_up.start()
+
+    # Remove old job outputs in the background
+    retention_manager.start()
+
+    # Requeue or fail the jobs an earlier process left unfinished
+    job_manager.recover()
+
+    # Under gunicorn, keep this worker's share of the queue gauges current between scrapes
+    start_gauge_refresh(refresh_queue_metrics, Config.METRICS_REFRESH_INTERVAL)
+
+
+# Set the queue gauges of this process
+def refresh_queue_metrics():
+    update_queue_metrics(
+        job_manager.stats(), admission_controller.stats(), cloud_uploader.stats()
+    )
+
 
 @app.route('/')
 def home():
@@ -24,9 +68,18 @@ def home():
         "version": "1.0.0",
         "endpoints": {
             "/health": "GET - Health check",
+            "/ready": "GET - Readiness, 200 once warm-up has finished",
+            "/stats": "GET - Job and coder pool statistics",
+            "/metrics": "GET - Prometheus metrics",
+            "/storage": "GET - Disk usage of job outputs, result cache and file store",
             "/code/prompt": "POST - Execute Aider code generation using /code prompt",
             "/code/files": "POST - Upload files and execute Aider code generation using /architect prompt",
-            "/code/generate": "POST - Generate code by providing : Context, Instruction, Code Template"
+            "/files": "POST - Upload reference files once and get file ids for /code/files",
+            "/files/<file_id>": "GET - Metadata of a stored reference file",
+            "/code/generate": "POST - Generate code by providing : Context, Instruction, Code Template",
+            "/code/batch": "POST - Run a list of /code/generate payloads in parallel",
+            "/jobs/<job_id>": "GET - Status and result of a generation job, DELETE - Cancel it",
+            "/jobs/<job_id>/archive": "GET - Download the zip file of a finished job"
         }
     })
 
@@ -34,8 +87,41 @@ def home():
 def health():
     return jsonify({"status": "healthy"})
 
+@app.route('/ready')
+def ready():
+    return jsonify(warm_up.status()), 200 if warm_up.ready else 503
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        "jobs": job_manager.stats(),
+        "admission": admission_controller.stats(),
+        "coder_pool": coder_pool.stats(),
+        "result_cache": result_cache.stats(),
+        "file_store": file_store.stats(),
+        "uploads": cloud_uploader.stats(),
+    })
+
+@app.route('/storage')
+def storage():
+    return jsonify({
+        "outputs": retention_manager.usage(),
+        "result_cache": result_cache.stats(),
+        "file_store": file_store.stats(),
+    })
+
+@app.route('/metrics')
+def metrics():
+    refresh_queue_metrics()
+    return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
 
 if __name__ == '__main__':
-    port = app.config['FLASK_PORT']
-    debug = app.config['FLASK_DEBUG']
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    # Not on import: threads do not survive a fork, gunicorn starts them in each worker
+    # (post_fork in gunicorn.conf.py), and spawned batch processes import this module too
+    start_background_services()
+
+    # Development server, use `gunicorn -c gunicorn.conf.py` in production
+    port = Config.FLASK_PORT
+    debug = Config.FLASK_DEBUG
+    app.run(host=Config.SERVER_HOST, port=port, debug=debug, threaded=True)
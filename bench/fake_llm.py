@@ -0,0 +1,181 @@
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Output folder named in the OUTPUT GUIDELINES of the instruction (see build_instruction)
+OUTPUT_DIR_PATTERN = re.compile(r"`([^`\n]*output[^`\n]*)`")
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI compatible /chat/completions endpoint returning a canned reply that
+    writes files in aider's `whole` edit format. The reply is sent after
+    `latency` seconds, streamed at `token_rate` tokens per second.
+    Like provider prompt caching, a system prompt seen before is reported as
+    cached input tokens.
+    """
+
+    seen_prefixes = set()
+    seen_lock = threading.Lock()
+
+    latency = 0.5
+    token_rate = 200.0
+    files = 3
+    file_lines = 40
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        reply = self.build_reply(body["messages"])
+        time.sleep(self.latency)
+
+        usage = self.usage(body["messages"], reply)
+        if body.get("stream"):
+            self.stream_reply(reply, usage)
+        else:
+            self.send_json(
+                {
+                    "id": "fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": reply},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+    def build_reply(self, messages):
+        # The last output folder mentioned in the conversation is the job's own
+        text = "\n".join(_message_text(m) for m in messages)
+        folders = OUTPUT_DIR_PATTERN.findall(text)
+        output_dir = folders[-1] if folders else "output"
+
+        parts = []
+        for index in range(self.files):
+            lines = "\n".join(
+                f"    print('line {line} of module {index}')" for line in range(self.file_lines)
+            )
+            parts.append(
+                f"{output_dir}/bench_project/module_{index}.py\n"
+                f"```python\ndef main():\n{lines}\n```\n"
+            )
+        return "\n".join(parts)
+
+    def stream_reply(self, reply, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        # About 4 characters per token
+        chunk_size = 16
+        delay = chunk_size / 4 / self.token_rate if self.token_rate > 0 else 0
+        for start in range(0, len(reply), chunk_size):
+            self.send_chunk({"content": reply[start:start + chunk_size]}, None)
+            if delay:
+                time.sleep(delay)
+
+        self.send_chunk({}, "stop", usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def send_chunk(self, delta, finish_reason, usage=None):
+        chunk = {
+            "id": "fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage:
+            chunk["usage"] = usage
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def send_json(self, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def usage(self, messages, reply):
+        prompt_tokens = sum(len(_message_text(m)) for m in messages) // 4
+        completion_tokens = len(reply) // 4
+
+        prefix = _message_text(messages[0]) if messages else ""
+        with self.seen_lock:
+            cached_tokens = len(prefix) // 4 if prefix in self.seen_prefixes else 0
+            self.seen_prefixes.add(prefix)
+
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+
+def _message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content)
+
+
+# Start the fake model server on a background thread
+def start_fake_llm(host="127.0.0.1", port=0, latency=0.5, token_rate=200.0, files=3, file_lines=40):
+    """
+    Start the fake model server in the current process.
+    Args:
+        host (str): Interface to listen on.
+        port (int): Port to listen on, 0 picks a free one.
+        latency (float): Seconds before the first token of every reply.
+        token_rate (float): Streamed tokens per second, 0 sends everything at once.
+        files (int): Files written by every reply.
+        file_lines (int): Lines per written file.
+    Returns:
+        ThreadingHTTPServer: The running server, its port is `server.server_address[1]`.
+    """
+    handler = type(
+        "ConfiguredFakeLLMHandler",
+        (FakeLLMHandler,),
+        {"latency": latency, "token_rate": token_rate, "files": files, "file_lines": file_lines},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI compatible model stub for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Streamed tokens per second")
+    parser.add_argument("--files", type=int, default=3, help="Files written by every reply")
+    parser.add_argument("--file-lines", type=int, default=40, help="Lines per written file")
+    args = parser.parse_args()
+
+    server = start_fake_llm(
+        args.host, args.port, args.latency, args.token_rate, args.files, args.file_lines
+    )
+    print(f"Fake LLM listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
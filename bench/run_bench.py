@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import socket
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_llm import start_fake_llm  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("/code/prompt", "/code/files", "/code/generate")
+FAKE_MODEL = "openai/bench-fake"
+
+# Metrics compared against a baseline, and whether higher values are better
+COMPARED_METRICS = {"throughput": True, "p95": False, "rss_mb": False}
+
+
+# Utility method to find a free local port
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Utility method to start the API server pointed at the fake model
+def start_server(port, llm_port, workers, work_dir):
+    """
+    Start the API server in a subprocess, with the result cache disabled so
+    every request reaches the fake model, and its stores inside the work directory.
+    Args:
+        port (int): Port of the API server.
+        llm_port (int): Port of the fake model server.
+        workers (int): Job workers of the server.
+        work_dir (str): Directory holding the generated output.
+    Returns:
+        subprocess.Popen: The server process, ready to serve requests.
+    """
+    env = dict(
+        os.environ,
+        OPENAI_API_BASE=f"http://127.0.0.1:{llm_port}/v1",
+        OPENAI_API_KEY="bench",
+        DEFAULT_MODEL=FAKE_MODEL,
+        JOB_WORKERS=str(workers),
+        ADMISSION_MODEL_CONCURRENCY=str(workers),
+        ADMISSION_MAX_QUEUE="100000",
+        RESULT_CACHE_ENABLED="false",
+        # Keep the job store, uploads and cache of the run out of the repository's .cache
+        JOB_STORE_PATH=os.path.join(work_dir, "jobs.sqlite3"),
+        FILE_STORE_DIR=os.path.join(work_dir, "files"),
+        RESULT_CACHE_DIR=os.path.join(work_dir, "results"),
+        FLASK_DEBUG="false",
+    )
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from app import app, start_background_services; start_background_services(); "
+            f"app.run(host='127.0.0.1', port={port}, threaded=True)",
+        ],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=open(os.path.join(work_dir, "server.log"), "w"),
+        stderr=subprocess.STDOUT,
+    )
+
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited, see {work_dir}/server.log")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError("Server did not start within 120 seconds")
+
+
+# Utility method to read the memory use of a process
+def read_rss_mb(pid):
+    """
+    Read the current and peak resident set size of a process from /proc.
+    Args:
+        pid (int): The process id.
+    Returns:
+        tuple: (current RSS in MB, peak RSS in MB), None where unavailable.
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+# Utility method to send one generation request
+def send_request(base_url, endpoint, work_dir):
+    """
+    Send one request with a unique instruction, so no two requests are identical.
+    Returns:
+        tuple: (latency in seconds, http status)
+    """
+    nonce = uuid.uuid4().hex[:8]
+    instruction = f"Create a small Python project that prints hello ({nonce})"
+    options = {"no_cache": True}
+    # Wait for the result, latency covers the whole generation
+    url = f"{base_url}{endpoint}?sync=1"
+    started = time.perf_counter()
+
+    if endpoint == "/code/files":
+        response = requests.post(
+            url,
+            files={"files": ("SPEC.md", f"# Spec {nonce}\nPrint hello from every module.\n")},
+            data={
+                "instruction": instruction,
+                "directory": work_dir,
+                "model": FAKE_MODEL,
+                "options": json.dumps(options),
+            },
+            timeout=600,
+        )
+    else:
+        payload = {
+            "instruction": instruction,
+            "directory": work_dir,
+            "model": FAKE_MODEL,
+            "options": options,
+        }
+        if endpoint == "/code/generate":
+            payload["context"] = "Benchmark project"
+        response = requests.post(url, json=payload, timeout=600)
+
+    return time.perf_counter() - started, response.status_code
+
+
+# Utility method to compute a percentile
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+# Run one endpoint at one concurrency level
+def run_level(base_url, endpoint, concurrency, requests_per_level, work_dir, pid):
+    """
+    Drive an endpoint with `concurrency` parallel clients.
+    Returns:
+        dict: Throughput, latency percentiles, error count and server RSS.
+    """
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(
+            executor.map(
+                lambda _: send_request(base_url, endpoint, work_dir),
+                range(requests_per_level),
+            )
+        )
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, status in results if status == 200]
+    rss, peak_rss = read_rss_mb(pid)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(latencies),
+        "throughput": round(len(latencies) / elapsed, 3),
+        "p50": _round(percentile(latencies, 50)),
+        "p95": _round(percentile(latencies, 95)),
+        "p99": _round(percentile(latencies, 99)),
+        "rss_mb": _round(rss, 1),
+        "peak_rss_mb": _round(peak_rss, 1),
+    }
+
+
+def _round(value, digits=3):
+    return round(value, digits) if value is not None else None
+
+
+# Compare results against a saved baseline
+def compare(results, baseline, tolerance):
+    """
+    Find the results that regressed by more than `tolerance` against the baseline.
+    Args:
+        results (list): Results of this run.
+        baseline (list): Results of the baseline run.
+        tolerance (float): Allowed relative regression, e.g. 0.2 for 20%.
+    Returns:
+        list: Human readable regression messages, empty when nothing regressed.
+    """
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline}
+    regressions = []
+
+    for result in results:
+        base = previous.get((result["endpoint"], result["concurrency"]))
+        if not base:
+            continue
+
+        if result["errors"] > base["errors"]:
+            regressions.append(
+                f"{result['endpoint']} x{result['concurrency']}: errors {base['errors']} -> {result['errors']}"
+            )
+
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (
+                not higher_is_better and change > tolerance
+            ):
+                regressions.append(
+                    f"{result['endpoint']} x{result['concurrency']}: {metric} {old} -> {new} ({change:+.0%})"
+                )
+
+    return regressions
+
+
+def print_table(results):
+    header = f"{'endpoint':<16}{'conc':>5}{'reqs':>6}{'err':>5}{'req/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['endpoint']:<16}{r['concurrency']:>5}{r['requests']:>6}{r['errors']:>5}"
+            f"{r['throughput']:>9}{r['p50'] or '-':>8}{r['p95'] or '-':>8}{r['p99'] or '-':>8}"
+            f"{r['rss_mb'] or '-':>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the generation endpoints against a local fake model."
+    )
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma separated endpoints to drive")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per level (default: 4 x concurrency)")
+    parser.add_argument("--workers", type=int, default=8, help="JOB_WORKERS of the server")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake model seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Fake model tokens per second")
+    parser.add_argument("--files", type=int, default=3, help="Files written by every fake reply")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this results file and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default: 0.2)")
+    args = parser.parse_args()
+
+    llm = start_fake_llm(latency=args.latency, token_rate=args.token_rate, files=args.files)
+    work_dir = tempfile.mkdtemp(prefix="aider-bench-")
+    port = free_port()
+    server = start_server(port, llm.server_address[1], args.workers, work_dir)
+    print(f"Server pid {server.pid} on port {port}, output in {work_dir}")
+
+    results = []
+    try:
+        for endpoint in args.endpoints.split(","):
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                result = run_level(
+                    f"http://127.0.0.1:{port}",
+                    endpoint,
+                    concurrency,
+                    args.requests or 4 * concurrency,
+                    work_dir,
+                    server.pid,
+                )
+                results.append(result)
+                print(
+                    f"{endpoint} x{concurrency}: {result['throughput']} req/s, "
+                    f"p95 {result['p95']}s, {result['errors']} errors"
+                )
+    finally:
+        server.terminate()
+        server.wait()
+        llm.shutdown()
+
+    print()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "settings": {
+                        "workers": args.workers,
+                        "latency": args.latency,
+                        "token_rate": args.token_rate,
+                        "files": args.files,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -8,6 +9,109 @@ class Config:
     FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     MODEL = os.getenv('DEFAULT_MODEL', 'claude-3-5-sonnet-20241022')
 
+    # Production server (gunicorn.conf.py), SERVER_WORKERS processes with SERVER_THREADS threads each
+    SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', os.cpu_count() or 1))
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 8))
+    SERVER_PRELOAD = os.getenv('SERVER_PRELOAD', 'True').lower() == 'true'
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', 1000))
+    SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', 100))
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 600))
+    SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', 120))
+    SERVER_KEEPALIVE = int(os.getenv('SERVER_KEEPALIVE', 0))
+
+    # gunicorn workers write their metrics to files in this folder, /metrics merges them,
+    # and refresh their queue gauges every METRICS_REFRESH_INTERVAL seconds
+    METRICS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', os.path.join('.cache', 'metrics'))
+    METRICS_REFRESH_INTERVAL = float(os.getenv('METRICS_REFRESH_INTERVAL', 5))
+
+    # Job worker pool
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+    JOB_HISTORY_LIMIT = int(os.getenv('JOB_HISTORY_LIMIT', 1000))
+    # Seconds after which a job is cancelled as timed out, unless the request sets a deadline (0 = none)
+    JOB_DEADLINE = float(os.getenv('JOB_DEADLINE', 0))
+
+    # Durable job store (SQLite in WAL mode). On startup, jobs left queued or running by a
+    # process that is gone are queued again ('requeue', up to JOB_MAX_ATTEMPTS runs) or failed ('fail')
+    JOB_STORE_ENABLED = os.getenv('JOB_STORE_ENABLED', 'True').lower() == 'true'
+    JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', os.path.join('.cache', 'jobs.sqlite3'))
+    JOB_RECOVERY = os.getenv('JOB_RECOVERY', 'requeue').lower()
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 2))
+
+    # Warm coder pool
+    CODER_POOL_SIZE = int(os.getenv('CODER_POOL_SIZE', JOB_WORKERS))
+
+    # Identical requests attach to the in-flight job instead of starting their own
+    COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'True').lower() == 'true'
+
+    # Editor phase of architect runs: EDITOR_MODEL edits instead of the architect model's
+    # own editor, PARALLEL_EDITOR_ENABLED runs one editor per file of the plan on EDITOR_WORKERS threads
+    EDITOR_MODEL = os.getenv('EDITOR_MODEL') or None
+    PARALLEL_EDITOR_ENABLED = os.getenv('PARALLEL_EDITOR_ENABLED', 'False').lower() == 'true'
+    EDITOR_WORKERS = int(os.getenv('EDITOR_WORKERS', 8))
+
+    # Hedged execution: when the model has not answered after HEDGE_DELAY seconds,
+    # also run the request on HEDGE_MODEL and keep the first result (unset disables hedging)
+    HEDGE_MODEL = os.getenv('HEDGE_MODEL') or None
+    HEDGE_DELAY = float(os.getenv('HEDGE_DELAY', 30))
+
+    # Result cache for identical generation requests
+    RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'True').lower() == 'true'
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join('.cache', 'results'))
+    RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+    RESULT_CACHE_MAX_AGE = int(os.getenv('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600))
+
+    # Content-addressed store of uploaded reference files, evicted least recently used first
+    FILE_STORE_DIR = os.getenv('FILE_STORE_DIR', os.path.join('.cache', 'files'))
+    FILE_STORE_MAX_BYTES = int(os.getenv('FILE_STORE_MAX_BYTES', 1024 * 1024 * 1024))
+    FILE_STORE_MAX_FILE_BYTES = int(os.getenv('FILE_STORE_MAX_FILE_BYTES', 20 * 1024 * 1024))
+    MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', 100 * 1024 * 1024))
+
+    # Retention of job outputs under <directory>/output, swept in the background
+    RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'True').lower() == 'true'
+    RETENTION_MAX_AGE = int(os.getenv('RETENTION_MAX_AGE', 7 * 24 * 3600))
+    RETENTION_MAX_BYTES = int(os.getenv('RETENTION_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+    RETENTION_MIN_AGE = int(os.getenv('RETENTION_MIN_AGE', 3600))
+    RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 600))
+
+    # Background uploads to the backend
+    BACKEND_URL = os.getenv('BACKEND_URL')
+    UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+    UPLOAD_MAX_RETRIES = int(os.getenv('UPLOAD_MAX_RETRIES', 3))
+    UPLOAD_BACKOFF = float(os.getenv('UPLOAD_BACKOFF', 1.0))
+    UPLOAD_CONNECT_TIMEOUT = float(os.getenv('UPLOAD_CONNECT_TIMEOUT', 10))
+    UPLOAD_READ_TIMEOUT = float(os.getenv('UPLOAD_READ_TIMEOUT', 120))
+    UPLOAD_VERIFY_TLS = os.getenv('UPLOAD_VERIFY_TLS', 'False').lower() == 'true'
+
+    # Batch generation process pool, BATCH_MODEL_LIMITS is a JSON object {"model": cap}
+    BATCH_PROCESSES = int(os.getenv('BATCH_PROCESSES', os.cpu_count() or 2))
+    BATCH_MODEL_CONCURRENCY = int(os.getenv('BATCH_MODEL_CONCURRENCY', 4))
+    BATCH_MODEL_LIMITS = json.loads(os.getenv('BATCH_MODEL_LIMITS', '{}'))
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+
+    # Per-model admission control of each server process (gunicorn worker), 0 disables a per-minute budget
+    # ADMISSION_MODEL_LIMITS is a JSON object {"model": {"concurrency": 2, "rpm": 50, "tpm": 40000, "max_queue": 8}}
+    ADMISSION_MODEL_CONCURRENCY = int(os.getenv('ADMISSION_MODEL_CONCURRENCY', JOB_WORKERS))
+    ADMISSION_RPM = float(os.getenv('ADMISSION_RPM', 0))
+    ADMISSION_TPM = float(os.getenv('ADMISSION_TPM', 0))
+    ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 16))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 300))
+    ADMISSION_OUTPUT_TOKENS = int(os.getenv('ADMISSION_OUTPUT_TOKENS', 4096))
+    ADMISSION_MODEL_LIMITS = json.loads(os.getenv('ADMISSION_MODEL_LIMITS', '{}'))
+
+    # Relevance-based selection of reference file chunks, per request with options.context_selection
+    CONTEXT_SELECTION_ENABLED = os.getenv('CONTEXT_SELECTION_ENABLED', 'False').lower() == 'true'
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 8000))
+    CONTEXT_CHUNK_TOKENS = int(os.getenv('CONTEXT_CHUNK_TOKENS', 300))
+
+    # Mark the stable prompt prefix for provider prompt caching (Anthropic cache_control and similar)
+    PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'True').lower() == 'true'
+
+    # Background warm-up at startup, WARMUP_MODELS is a comma separated list
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'True').lower() == 'true'
+    WARMUP_MODELS = [m.strip() for m in os.getenv('WARMUP_MODELS', MODEL).split(',') if m.strip()]
+    WARMUP_CODERS = int(os.getenv('WARMUP_CODERS', 1))
+
 class DevelopmentConfig(Config):
     DEBUG = True
     
@@ -1,7 +1,14 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from api.generate_code import GenerateCode
 
+
 # Function to generate code based on context, instruction, and template
-def generate():   
+def generate():
     context = "You are to generate a small Python utility project."
     instruction = "Create a few Python files under src/ and tests/ that print hello."
     code_template = "src/main.py, src/utils/helpers.py, tests/test_helpers.py"
@@ -11,7 +18,164 @@ def generate():
         print("\nCode generation response: \n", response)
     except Exception as e:
         print(f"Error generating code: {str(e)}")
-        
+
+
+# Function to read generation requests from a JSONL file
+def load_requests(input_path):
+    """
+    Read generation requests, one JSON object per line.
+    Each request uses `context`, `instruction`, `code_template`, `directory` and `options`;
+    backlog style entries with `title` and `body` are accepted as context and instruction.
+    Args:
+        input_path (str): Path of the JSONL file.
+    Returns:
+        list: (request id, request dict) tuples in file order.
+    """
+    requests = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            item = json.loads(line)
+            request_id = str(
+                item.get("request_id") or item.get("id") or f"line-{line_number}"
+            )
+            requests.append(
+                (
+                    request_id,
+                    {
+                        "context": item.get("context") or item.get("title"),
+                        "instruction": item.get("instruction") or item.get("body"),
+                        "code_template": item.get("code_template", ""),
+                        "directory": item.get("directory"),
+                        "options": item.get("options"),
+                    },
+                )
+            )
+
+    return requests
+
+
+# Function to read the ids already finished by a previous run
+def load_checkpoint(output_path, retry_failed=False):
+    """
+    Collect the request ids present in an existing results file.
+    Args:
+        output_path (str): Path of the results JSONL file.
+        retry_failed (bool): Treat failed requests as not finished.
+    Returns:
+        set: Ids of the requests that do not need to run again.
+    """
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A run interrupted mid-write leaves a partial last line
+                continue
+            if retry_failed and result.get("http_status") != 200:
+                continue
+            finished.add(result["request_id"])
+
+    return finished
+
+
+# Function to run a single generation request and time it
+def run_request(request_id, item):
+    """
+    Run one request through GenerateCode.generate_code.
+    Args:
+        request_id (str): Id of the request.
+        item (dict): Request fields.
+    Returns:
+        dict: The result line, with timings.
+    """
+    started_at = time.time()
+    try:
+        response = GenerateCode().generate_code(
+            item["context"],
+            item["instruction"],
+            item["code_template"],
+            directory=item["directory"],
+            options=item["options"],
+        )
+        body, http_status = response if isinstance(response, tuple) else (response, 200)
+    except Exception as e:
+        body, http_status = {"error": str(e), "status": "error"}, 500
+
+    finished_at = time.time()
+    return {
+        "request_id": request_id,
+        "http_status": http_status,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "duration_s": round(finished_at - started_at, 3),
+        "result": body,
+    }
+
+
+# Function to run a JSONL file of requests with checkpointing
+def generate_bulk(input_path, output_path, parallel=1, retry_failed=False):
+    """
+    Run every request of a JSONL file and append one result line per request.
+    The results file doubles as the checkpoint: requests already in it are skipped,
+    so an interrupted run resumes where it stopped.
+    Args:
+        input_path (str): Path of the requests JSONL file.
+        output_path (str): Path of the results JSONL file.
+        parallel (int): Number of requests running at the same time.
+        retry_failed (bool): Run requests again whose previous result failed.
+    Returns:
+        dict: Counts of total, skipped, succeeded and failed requests.
+    """
+    requests = load_requests(input_path)
+    finished = load_checkpoint(output_path, retry_failed)
+    todo = [(rid, item) for rid, item in requests if rid not in finished]
+    print(f"{len(requests)} requests, {len(requests) - len(todo)} already done, running {len(todo)}")
+
+    summary = {"total": len(requests), "skipped": len(requests) - len(todo), "succeeded": 0, "failed": 0}
+    lock = threading.Lock()
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(
+        max_workers=parallel
+    ) as executor:
+        futures = [executor.submit(run_request, rid, item) for rid, item in todo]
+
+        for future in as_completed(futures):
+            result = future.result()
+
+            # Write and sync each result as it finishes, this is the checkpoint
+            with lock:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+
+            status = "succeeded" if result["http_status"] == 200 else "failed"
+            summary[status] += 1
+            print(f"[{result['request_id']}] {status} in {result['duration_s']}s")
+
+    print(f"Done: {summary}")
+    return summary
+
 
 if __name__ == "__main__":
-    generate()
+    parser = argparse.ArgumentParser(
+        description="Generate code for one sample request, or for every request of a JSONL file."
+    )
+    parser.add_argument("--input", help="JSONL file with one generation request per line")
+    parser.add_argument("--output", help="Results JSONL file, also used to resume (default: <input>.results.jsonl)")
+    parser.add_argument("--parallel", type=int, default=1, help="Number of requests running at the same time")
+    parser.add_argument("--retry-failed", action="store_true", help="Run failed requests of a previous run again")
+    args = parser.parse_args()
+
+    if args.input:
+        output_path = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+        generate_bulk(args.input, output_path, max(1, args.parallel), args.retry_failed)
+    else:
+        generate()
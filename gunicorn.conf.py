@@ -0,0 +1,87 @@
+"""
+Production server configuration, run with:
+
+    gunicorn -c gunicorn.conf.py
+
+Every worker process serves requests on SERVER_THREADS threads. With
+SERVER_PRELOAD the master imports the app, aider and the configured models
+once before forking, so workers start warm and share those pages. Background
+threads (warm-up of coders, retention) are started in each worker after the
+fork. On SIGTERM, and when a worker is recycled after SERVER_MAX_REQUESTS, the
+worker stops accepting requests and waits up to SERVER_GRACEFUL_TIMEOUT for
+running requests, jobs and uploads to finish.
+
+Metrics use prometheus_client's multiprocess mode: every worker writes its
+samples to METRICS_MULTIPROC_DIR and /metrics on any worker reports all of
+them. Admission control, the coder pool and request coalescing stay per worker.
+"""
+import os
+import glob
+import time
+from config import Config
+
+wsgi_app = "app:app"
+bind = f"{Config.SERVER_HOST}:{Config.FLASK_PORT}"
+
+worker_class = "gthread"
+workers = Config.SERVER_WORKERS
+threads = Config.SERVER_THREADS
+preload_app = Config.SERVER_PRELOAD
+
+# Recycle workers to bound memory growth, jitter keeps them from restarting together
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+
+# Generations run for minutes, give them time to finish on shutdown
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+timeout = Config.SERVER_TIMEOUT
+
+# An idle keep-alive connection holds a draining gthread worker until graceful_timeout
+keepalive = Config.SERVER_KEEPALIVE
+
+accesslog = "-"
+
+# Must be set before prometheus_client is imported, which happens when the app is loaded
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.abspath(Config.METRICS_MULTIPROC_DIR)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def on_starting(server):
+    # Samples of an earlier run would be added to this one
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.unlink(path)
+
+    # The app is already imported here when preloading, load aider and the models once
+    if preload_app:
+        from utils.warmup_utils import warm_up
+
+        warm_up.preload()
+
+
+def post_fork(server, worker):
+    # Threads do not survive the fork, each worker starts its own
+    from app import start_background_services
+
+    start_background_services()
+
+
+def child_exit(server, worker):
+    # Drop the gauges of the worker, its counters and histograms keep counting
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Requests are drained by gunicorn, jobs and uploads run on our own threads
+    from utils.job_utils import job_manager
+    from utils.upload_utils import cloud_uploader
+
+    started = time.time()
+    unfinished_jobs = job_manager.drain(graceful_timeout)
+    unfinished_uploads = cloud_uploader.drain(max(0, graceful_timeout - (time.time() - started)))
+    if unfinished_jobs or unfinished_uploads:
+        server.log.warning(
+            f"Worker {worker.pid} exiting with {unfinished_jobs} jobs and "
+            f"{unfinished_uploads} uploads unfinished"
+        )
@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+from api.generate_code import GenerateCode
+from utils.incremental_utils import prepare_incremental
+from utils.job_utils import Job
+
+
+class GenerateChainTest(unittest.TestCase):
+    """
+    Chaining GenerateCode.generate_code runs with base_job_id: the change is
+    worked out against what the base job sent to the model.
+    """
+
+    def submit(self, instruction, base_job_id=None):
+        # Capture the job generate_code submits instead of running it
+        with mock.patch("api.generate_code.dispatch_job", return_value=({}, 200)) as dispatch:
+            GenerateCode().generate_code(
+                "Python utility project", instruction, "src/main.py", base_job_id=base_job_id
+            )
+        return dispatch.call_args.kwargs
+
+    def prepare(self, base_job, request):
+        with mock.patch("utils.incremental_utils.job_manager") as manager:
+            manager.get.return_value = base_job
+            return prepare_incremental(
+                base_job.id,
+                [],
+                request.get("context"),
+                request.get("instruction"),
+                request.get("code_template"),
+            )
+
+    def test_changed_instruction_is_sent_as_diff(self):
+        base_job = Job("direct", self.submit("Create src/main.py printing hello")["payload"])
+        request = self.submit("Create src/main.py printing goodbye", base_job_id=base_job.id)
+
+        incremental = self.prepare(base_job, request)
+
+        self.assertTrue(incremental["base_request_known"])
+        self.assertIn("## CONTEXT CHANGES", incremental["change"])
+        self.assertIn("+Create src/main.py printing goodbye", incremental["change"])
+        self.assertNotIn("INSTRUCTION", incremental["change"])
+        self.assertNotIn("CODE TEMPLATE", incremental["change"])
+        self.assertNotIn("Python utility project", incremental["change"])
+
+    def test_unchanged_instruction_is_refused(self):
+        base_job = Job("direct", self.submit("Create src/main.py printing hello")["payload"])
+        request = self.submit("Create src/main.py printing hello", base_job_id=base_job.id)
+
+        with self.assertRaises(ValueError):
+            self.prepare(base_job, request)
+
+
+if __name__ == "__main__":
+    unittest.main()
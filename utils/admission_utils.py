@@ -0,0 +1,389 @@
+import os
+import math
+import time
+import threading
+from config import Config
+from utils.context_utils import GenerationCancelled, ProviderRateLimited
+from utils.file_store_utils import file_store
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a model is over its limits and its admission queue is full,
+    or a queued job waited longer than the queue timeout.
+    """
+
+    def __init__(self, model_name, retry_after, reason):
+        super().__init__(f"Model '{model_name}' is over capacity: {reason}")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Per-minute budget refilled continuously. A budget of 0 means unlimited.
+    Not thread safe, callers hold the lock of the owning ModelGate.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def wait_time(self, amount):
+        """
+        Seconds until `amount` can be taken, 0 if it can be taken now.
+        Requests larger than the whole budget only wait for a full bucket.
+        """
+        if self.capacity <= 0:
+            return 0.0
+
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def take(self, amount):
+        if self.capacity > 0:
+            self.tokens -= min(amount, self.capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.capacity / 60.0,
+        )
+        self.updated_at = now
+
+
+class ModelGate:
+    """
+    Concurrency slots, request and token budgets and queue bound of one model.
+    """
+
+    def __init__(self, model_name, concurrency, rpm, tpm, max_queue):
+        self.model_name = model_name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.running = 0
+        self.queued = 0
+        self.avg_run_time = None
+        self.stats = {"admitted": 0, "rejected": 0, "timed_out": 0}
+        self.condition = threading.Condition()
+
+    def wait_time(self, tokens):
+        # Seconds until a job needing `tokens` could start, 0 if it can start now
+        if self.running >= self.concurrency:
+            return None
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def retry_after(self, tokens):
+        # Rough time until the queue drained enough to admit one more job
+        budget_wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        run_wait = (self.avg_run_time or 1.0) * (self.queued + 1) / self.concurrency
+        return max(1, math.ceil(max(budget_wait, run_wait)))
+
+
+class AdmissionTicket:
+    """
+    A job's place in the admission queue of a model.
+    acquire() blocks until the job may call the model, release() frees its slot.
+    """
+
+    def __init__(self, gate, tokens, timeout):
+        self.gate = gate
+        self.tokens = tokens
+        self.timeout = timeout
+        self.state = "queued"
+        self.started_at = None
+        self.created_at = time.monotonic()
+
+    def acquire(self, poll=None):
+        """
+        Wait for a concurrency slot and enough request and token budget.
+        Args:
+            poll (callable, optional): Called about every second while waiting, it may
+                withdraw the ticket, see Job.poll_cancel.
+        Raises:
+            AdmissionRejected: The job waited longer than the queue timeout.
+            GenerationCancelled: The job was withdrawn from the queue.
+        """
+        gate = self.gate
+        # The queue timeout counts from admit(), the ticket may be acquired later
+        deadline = self.created_at + self.timeout
+
+        with gate.condition:
+            if self.state != "queued" and self.state != "withdrawn":
+                return
+
+            while True:
+                if self.state == "withdrawn":
+                    raise GenerationCancelled("Generation cancelled while waiting for admission")
+
+                wait = gate.wait_time(self.tokens)
+                if wait == 0:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._expire()
+
+                # Slots are signalled on release, budgets refill over time
+                timeout = remaining if wait is None else min(wait, remaining)
+                if poll is not None:
+                    gate.condition.wait(min(timeout, 1))
+                    poll()
+                else:
+                    gate.condition.wait(timeout)
+
+            self._start()
+
+    def try_acquire(self):
+        """
+        Take a concurrency slot and the budgets if the job may call the model now,
+        for callers that cannot block, see BatchRunner.run.
+        Returns:
+            bool: True once the ticket is running, False while it still has to wait.
+        Raises:
+            AdmissionRejected: The job waited longer than the queue timeout.
+        """
+        gate = self.gate
+        with gate.condition:
+            if self.state != "queued":
+                return self.state == "running"
+
+            if gate.wait_time(self.tokens) == 0:
+                self._start()
+                return True
+
+            if time.monotonic() >= self.created_at + self.timeout:
+                self._expire()
+            return False
+
+    def release(self):
+        """
+        Free the slot of a running job, or leave the queue if it never started.
+        Safe to call more than once.
+        """
+        gate = self.gate
+        with gate.condition:
+            if self.state == "running":
+                gate.running -= 1
+                run_time = time.monotonic() - self.started_at
+                gate.avg_run_time = (
+                    run_time
+                    if gate.avg_run_time is None
+                    else 0.8 * gate.avg_run_time + 0.2 * run_time
+                )
+            elif self.state == "queued":
+                gate.queued -= 1
+
+            self.state = "closed"
+            gate.condition.notify_all()
+
+    def withdraw(self):
+        """
+        Leave the queue when the job is cancelled while it waits, acquire() then raises.
+        A running job keeps its slot until release().
+        """
+        gate = self.gate
+        with gate.condition:
+            if self.state == "queued":
+                gate.queued -= 1
+                self.state = "withdrawn"
+                gate.condition.notify_all()
+
+    def _start(self):
+        # Callers hold the gate's condition
+        gate = self.gate
+        gate.requests.take(1)
+        gate.tokens.take(self.tokens)
+        gate.queued -= 1
+        gate.running += 1
+        self.state = "running"
+        self.started_at = time.monotonic()
+
+    def _expire(self):
+        # Callers hold the gate's condition
+        gate = self.gate
+        gate.queued -= 1
+        gate.stats["timed_out"] += 1
+        self.state = "closed"
+        raise AdmissionRejected(
+            gate.model_name,
+            gate.retry_after(self.tokens),
+            f"queued for more than {self.timeout:g}s",
+        )
+
+
+class AdmissionController:
+    """
+    Per-model admission control in front of the coders. Each model gets a
+    concurrency limit, requests-per-minute and tokens-per-minute budgets and a
+    bounded queue; requests beyond the queue bound are rejected right away.
+    """
+
+    def __init__(self, concurrency=None, rpm=None, tpm=None, max_queue=None,
+                 queue_timeout=None, model_limits=None):
+        self.concurrency = concurrency or Config.ADMISSION_MODEL_CONCURRENCY
+        self.rpm = rpm if rpm is not None else Config.ADMISSION_RPM
+        self.tpm = tpm if tpm is not None else Config.ADMISSION_TPM
+        self.max_queue = max_queue if max_queue is not None else Config.ADMISSION_MAX_QUEUE
+        self.queue_timeout = queue_timeout or Config.ADMISSION_QUEUE_TIMEOUT
+        self.model_limits = model_limits or Config.ADMISSION_MODEL_LIMITS
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    def admit(self, model_name, tokens=0, timeout=None):
+        """
+        Reserve a place in the model's queue.
+        Args:
+            model_name (str): The name of the model.
+            tokens (int): Estimated tokens the job will use.
+            timeout (float, optional): Seconds the ticket may wait in the queue.
+                Defaults to the controller's queue timeout, 0 only admits a job that can start now.
+        Returns:
+            AdmissionTicket: Ticket to acquire before calling the model.
+        Raises:
+            AdmissionRejected: The model's queue is full.
+            ValueError: The model's concurrency limit is below 1.
+        """
+        gate = self._gate(model_name)
+        with gate.condition:
+            # Jobs that can start right away do not count against the queue bound
+            waiting = gate.queued - max(0, gate.concurrency - gate.running)
+            if waiting >= gate.max_queue:
+                gate.stats["rejected"] += 1
+                raise AdmissionRejected(
+                    model_name, gate.retry_after(tokens), "admission queue is full"
+                )
+
+            gate.queued += 1
+            gate.stats["admitted"] += 1
+
+        return AdmissionTicket(gate, tokens, self.queue_timeout if timeout is None else timeout)
+
+    def check(self, model_name):
+        """
+        Validate the model's limits without reserving anything, for jobs admitted later.
+        Args:
+            model_name (str): The name of the model.
+        Returns:
+            None
+        Raises:
+            ValueError: The model's concurrency limit is below 1.
+        """
+        self._gate(model_name)
+
+    def stats(self):
+        """
+        Report running and queued jobs and counters per model.
+        Returns:
+            dict: Per-model limits, load and admitted/rejected/timed out counts.
+        """
+        with self._lock:
+            gates = list(self._gates.values())
+
+        report = {}
+        for gate in gates:
+            with gate.condition:
+                report[gate.model_name] = {
+                    "concurrency": gate.concurrency,
+                    "rpm": gate.requests.capacity,
+                    "tpm": gate.tokens.capacity,
+                    "max_queue": gate.max_queue,
+                    "running": gate.running,
+                    "queued": gate.queued,
+                    **gate.stats,
+                }
+        return report
+
+    def _gate(self, model_name):
+        with self._lock:
+            gate = self._gates.get(model_name)
+            if gate is None:
+                limits = self.model_limits.get(model_name, {})
+                concurrency = int(limits.get("concurrency", self.concurrency))
+                # A gate without slots could never admit a job
+                if concurrency < 1:
+                    raise ValueError(f"Concurrency limit of model '{model_name}' must be at least 1")
+                gate = ModelGate(
+                    model_name,
+                    concurrency=concurrency,
+                    rpm=limits.get("rpm", self.rpm),
+                    tpm=limits.get("tpm", self.tpm),
+                    max_queue=int(limits.get("max_queue", self.max_queue)),
+                )
+                self._gates[model_name] = gate
+            return gate
+
+
+# Utility method to estimate the tokens a request will use
+def estimate_tokens(payload):
+    """
+    Estimate the tokens of a request from the text it sends (about 4 characters
+    per token), including its reference files, plus the expected output of a generation.
+    Args:
+        payload (dict): The request payload.
+    Returns:
+        int: Estimated tokens.
+    """
+    payload = payload or {}
+    chars = sum(len(value) for value in payload.values() if isinstance(value, str))
+    return (chars + _reference_bytes(payload)) // 4 + Config.ADMISSION_OUTPUT_TOKENS
+
+
+# Size of the reference files of a request, stored files by id or paths in its directory.
+# Files that cannot be found are left out, the generation reports them.
+def _reference_bytes(payload):
+    file_ids = payload.get("file_ids")
+    if file_ids:
+        size = 0
+        for file_id in file_ids:
+            try:
+                meta = file_store.get(file_id)
+            except (OSError, ValueError):
+                meta = None
+            size += meta["size"] if meta else 0
+        return size
+
+    files = payload.get("files")
+    if not isinstance(files, list):
+        return 0
+    directory = os.path.abspath(payload.get("directory") or os.getcwd())
+    size = 0
+    for path in files:
+        try:
+            size += os.path.getsize(os.path.join(directory, path))
+        except (OSError, TypeError):
+            pass
+    return size
+
+
+# Utility method to recognise provider rate limit errors
+def is_rate_limit_error(error):
+    """
+    Check whether an exception is a provider rate limit error (litellm's RateLimitError,
+    or ProviderRateLimited), also when it is the cause of the raised exception,
+    without importing litellm.
+    Args:
+        error (Exception): The raised exception.
+    Returns:
+        bool: True for rate limit errors.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, ProviderRateLimited) or any(
+            cls.__name__ == "RateLimitError" for cls in type(error).__mro__
+        ):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# Shared admission controller used by all generation jobs
+admission_controller = AdmissionController()
@@ -1,11 +1,260 @@
-from aider.coders import Coder, ArchitectCoder
-from aider.models import Model
-from aider.io import InputOutput
+import os
+import time
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from utils.common_utils import EDIT_RULES, GENERATION_RULES
+from utils.context_utils import GenerationCancelled, ProviderRateLimited
+from utils.editor_utils import split_plan
 
+# Aider modules, imported on first use by load_aider
+_aider = None
+_aider_lock = threading.Lock()
 
-def create_coder(model_name, auto_commits, dirty_commits, dry_run, files=None):
+# Runs the per-file editors of architect runs in parallel editor mode
+_editor_executor = ThreadPoolExecutor(
+    max_workers=Config.EDITOR_WORKERS, thread_name_prefix="aider-editor"
+)
+
+
+# Utility method to import aider on first use
+def load_aider():
+    """
+    Import aider (and with it litellm) and install the job hooks on first use.
+    The import takes about a second, so it is kept out of the server startup;
+    concurrent callers wait for the first import instead of repeating it.
+    Returns:
+        SimpleNamespace: Coder, ArchitectCoder, Model and InputOutput classes.
+    """
+    global _aider
+    with _aider_lock:
+        if _aider is None:
+            from aider.coders import Coder, ArchitectCoder
+            from aider.models import Model
+            from aider.io import InputOutput
+            from aider.llm import litellm
+            from utils.stream_utils import install_stream_hook
+
+            litellm._load_litellm()
+            _install_stream_usage(litellm._lazy_module)
+            install_stream_hook(Coder)
+            _install_cancel_check(Coder)
+            _install_usage_recorder(Coder)
+            _install_editor_split(ArchitectCoder)
+            _install_editor_timer(ArchitectCoder)
+            _install_generation_rules(Coder)
+            _aider = SimpleNamespace(
+                Coder=Coder,
+                ArchitectCoder=ArchitectCoder,
+                Model=Model,
+                InputOutput=InputOutput,
+            )
+        return _aider
+
+
+# Record how long the editor phase of each architect run takes, see execute_instruction
+def _install_editor_timer(ArchitectCoder):
+    original = ArchitectCoder.reply_completed
+    if getattr(original, "times_editor", False):
+        return
+
+    def reply_completed(self):
+        started = time.perf_counter()
+        try:
+            return original(self)
+        finally:
+            self.editor_seconds = getattr(self, "editor_seconds", 0.0) + (
+                time.perf_counter() - started
+            )
+
+    reply_completed.times_editor = True
+    ArchitectCoder.reply_completed = reply_completed
+
+
+# Run the editor phase on the job's editor model, one editor per file of the plan in
+# parallel editor mode, see execute_instruction. Without either it is aider's own editor pass.
+def _install_editor_split(ArchitectCoder):
+    original = ArchitectCoder.reply_completed
+    if getattr(original, "splits_editor", False):
+        return
+
+    def reply_completed(self):
+        editor_model_name = getattr(self, "editor_model_name", None)
+        parallel = getattr(self, "parallel_editor", False)
+        if not editor_model_name and not parallel:
+            return original(self)
+
+        content = self.partial_response_content
+        if not content or not content.strip():
+            return
+        if not self.auto_accept_architect and not self.io.confirm_ask("Edit the files?"):
+            return
+
+        tasks = split_plan(content) if parallel else None
+        run_editors(self, tasks or [(None, content)], editor_model_name)
+        self.move_back_cur_messages("I made those changes to the files.")
+
+    reply_completed.splits_editor = True
+    ArchitectCoder.reply_completed = reply_completed
+
+
+# Utility method to run the editor phase of an architect run
+def run_editors(architect, tasks, editor_model_name=None):
+    """
+    Apply the architect's plan with one editor coder per task, like aider's own
+    editor pass. Several tasks run at the same time on the editor pool and all
+    write through the architect's IO, so their files land in the job's output
+    folder and manifest.
+    Args:
+        architect (ArchitectCoder): The coder whose plan is applied.
+        tasks (list): (file or None, message) tuples, one editor each.
+        editor_model_name (str, optional): Model of the editors. Defaults to the
+            architect model's editor model.
+    Returns:
+        None
+    """
+    main_model = architect.main_model
+    if editor_model_name:
+        editor_model = coder_pool.get_model(editor_model_name)
+        edit_format = editor_model.editor_edit_format or main_model.editor_edit_format
+    else:
+        editor_model = main_model.editor_model or main_model
+        edit_format = main_model.editor_edit_format
+
+    def run_editor(path, message):
+        editor = load_aider().Coder.create(
+            io=architect.io,
+            from_coder=architect,
+            main_model=editor_model,
+            edit_format=edit_format,
+            suggest_shell_commands=False,
+            map_tokens=0,
+            total_cost=0.0,
+            cache_prompts=False,
+            num_cache_warming_pings=0,
+            summarize_from_coder=False,
+        )
+        editor.cur_messages = []
+        editor.done_messages = []
+        editor.editor_task = path
+        editor.run(with_message=message, preproc=False)
+        return editor
+
+    if len(tasks) == 1:
+        editors = [run_editor(*tasks[0])]
+    else:
+        print(f"Running {len(tasks)} editors on {editor_model.name}")
+        futures = [_editor_executor.submit(run_editor, *task) for task in tasks]
+        editors = [future.result() for future in futures]
+
+    for editor in editors:
+        architect.total_cost += editor.total_cost
+        architect.aider_commit_hashes.update(editor.aider_commit_hashes)
+
+
+# Append the fixed generation rules to the job coder's system prompt, see GENERATION_RULES.
+# The system prompt comes first in every request, so it stays a cacheable prefix.
+# Installed on Coder, create_coder builds the coder class of the model's edit format.
+def _install_generation_rules(Coder):
+    original = Coder.fmt_system_prompt
+    if getattr(original, "adds_generation_rules", False):
+        return
+
+    def fmt_system_prompt(self, prompt):
+        text = original(self, prompt)
+        rules = getattr(self, "generation_rules", None)
+        # Only the main system prompt, not the reminder repeated at the end
+        if rules and prompt is self.gpt_prompts.main_system:
+            text = f"{text}\n\n{rules}"
+        return text
+
+    fmt_system_prompt.adds_generation_rules = True
+    Coder.fmt_system_prompt = fmt_system_prompt
+
+
+# Stop a cancelled job before each model call, see JobIO.check_cancelled.
+# Aider reports errors raised while sending and ends the run, execute_instruction then raises.
+def _install_cancel_check(Coder):
+    original = Coder.send
+    if getattr(original, "checks_cancel", False):
+        return
+
+    def send(self, messages, model=None, functions=None):
+        check_cancelled = getattr(self.io, "check_cancelled", None)
+        if check_cancelled:
+            check_cancelled()
+        yield from original(self, messages, model=model, functions=functions)
+
+    send.checks_cancel = True
+    Coder.send = send
+
+
+# Ask for token usage on streamed completions too, providers only send it on request
+def _install_stream_usage(litellm):
+    original = litellm.completion
+    if getattr(original, "requests_stream_usage", False):
+        return
+
+    def completion(*args, **kwargs):
+        if kwargs.get("stream") and "stream_options" not in kwargs:
+            kwargs["stream_options"] = {"include_usage": True}
+        return original(*args, **kwargs)
+
+    completion.requests_stream_usage = True
+    litellm.completion = completion
+
+
+# Report the tokens of every completion to the coder's IO (see JobIO.record_usage),
+# split into cached and uncached input tokens
+def _install_usage_recorder(Coder):
+    original = Coder.calculate_and_show_tokens_and_cost
+    if getattr(original, "records_usage", False):
+        return
+
+    def calculate_and_show_tokens_and_cost(self, messages, completion=None):
+        sent, received = self.message_tokens_sent, self.message_tokens_received
+        result = original(self, messages, completion)
+
+        record_usage = getattr(self.io, "record_usage", None)
+        if record_usage:
+            usage = getattr(completion, "usage", None) or getattr(self, "stream_usage", None)
+            cached = 0
+            cache_write = 0
+            if usage is not None:
+                # DeepSeek, Anthropic and OpenAI report cache hits in different fields
+                details = getattr(usage, "prompt_tokens_details", None)
+                cached = (
+                    getattr(usage, "prompt_cache_hit_tokens", 0)
+                    or getattr(usage, "cache_read_input_tokens", 0)
+                    or getattr(details, "cached_tokens", 0)
+                )
+                cache_write = getattr(usage, "cache_creation_input_tokens", 0)
+            record_usage(
+                input_tokens=self.message_tokens_sent - sent,
+                output_tokens=self.message_tokens_received - received,
+                cached_input_tokens=cached or 0,
+                cache_write_tokens=cache_write or 0,
+            )
+        return result
+
+    calculate_and_show_tokens_and_cost.records_usage = True
+    Coder.calculate_and_show_tokens_and_cost = calculate_and_show_tokens_and_cost
+
+
+def create_coder(
+    model_name,
+    auto_commits,
+    dirty_commits,
+    dry_run,
+    files=None,
+    execution=None,
+    edit_format=None,
+    edit_files=None,
+):
     """
     Create and return an ArchitectCoder instance with the specified configuration.
+    Aider builds the coder class of the edit format, by default the model's own.
 
     Args:
         model_name (str): The name of the model to use.
@@ -13,17 +262,30 @@ def create_coder(model_name, auto_commits, dirty_commits, dry_run, files=None):
         auto_commits (bool): Whether to enable automatic commits.
         dirty_commits (bool): Whether to allow commits with uncommitted changes.
         dry_run (bool): Whether to run in dry-run mode.
+        execution (ExecutionContext, optional): Job context the coder is rooted at.
+            Relative read-only files are resolved against its root. Defaults to None.
+        edit_format (str, optional): Edit format of the coder, "architect" for a plan
+            applied by editor coders. Defaults to the model's edit format.
+        edit_files (list, optional): Absolute paths of existing files open for editing.
+            When given, the coder edits an earlier job's project and gets EDIT_RULES
+            instead of GENERATION_RULES.
 
     Returns:
         ArchitectCoder: Configured ArchitectCoder instance.
     """
 
     try:
+        aider = load_aider()
+
         # Create InputOutput for non-interactive mode with all confirmations disabled
-        io = InputOutput(yes=True, pretty=True)
+        if execution:
+            io = execution.create_io()
+            files = [execution.resolve(f) for f in files or []]
+        else:
+            io = aider.InputOutput(yes=True, pretty=True)
 
-        # Create model instance
-        model = Model(model=model_name)
+        # Reuse the cached model instance
+        model = coder_pool.get_model(model_name)
 
         # Create ArchitectCoder instance
         # coder = ArchitectCoder.create(
@@ -37,15 +299,23 @@ def create_coder(model_name, auto_commits, dirty_commits, dry_run, files=None):
         # )
 
         # Create Coder instance
-        coder = ArchitectCoder.create(
+        coder = aider.ArchitectCoder.create(
             main_model=model,
+            edit_format=edit_format,
             read_only_fnames=files if files else None,
             io=io,
             auto_commits=auto_commits,
             dirty_commits=dirty_commits,
             dry_run=dry_run,
             use_git=False,  # Disable git integration
+            cache_prompts=Config.PROMPT_CACHE_ENABLED,  # Mark the stable prefix for providers that support it
         )
+        coder.generation_rules = GENERATION_RULES if edit_files is None else EDIT_RULES
+
+        # Root the coder at the job directory instead of the process cwd
+        if execution:
+            execution.bind(coder)
+        coder.abs_fnames = set(edit_files or [])
 
         return coder
 
@@ -53,20 +323,245 @@ def create_coder(model_name, auto_commits, dirty_commits, dry_run, files=None):
         raise RuntimeError(f"Failed to initialize model/coder: {str(e)}")
 
 
-def execute_instruction(coder, instruction):
+def execute_instruction(coder, instruction, editor_model=None, parallel_editor=False):
     """
     Execute the given instruction using the provided coder instance.
 
     Args:
         coder (ArchitectCoder): The coder instance to use for execution.
         instruction (str): The instruction to execute.
+        editor_model (str, optional): Model applying the architect's plan. Defaults to
+            the architect model's editor model.
+        parallel_editor (bool): Split the plan into one editor task per file and run them
+            at the same time. Plans naming fewer than two files get a single editor.
 
     Returns:
-        str: The result of the execution.
+        str: The result of the execution. Afterwards `coder.editor_seconds` holds
+        the time spent in the editor phase of the run.
+    Raises:
+        GenerationCancelled: The coder's job was cancelled during the run.
+        ProviderRateLimited: The provider kept rate limiting the model calls.
     """
 
     try:
+        coder.editor_seconds = 0.0
+        coder.editor_model_name = editor_model
+        coder.parallel_editor = parallel_editor
+        coder.io.architect_run = coder.edit_format == "architect"
         result = coder.run(instruction)
-        return result
     except Exception as e:
-        raise RuntimeError(f"Failed to execute instruction: {str(e)}")
+        raise RuntimeError(f"Failed to execute instruction: {str(e)}") from e
+
+    # Aider ends the run quietly when a cancelled job stops it
+    cancelled = getattr(coder.io, "cancelled", None)
+    if cancelled is not None and cancelled.is_set():
+        raise GenerationCancelled("Generation cancelled")
+
+    # and when it gives up retrying a rate limited model call
+    rate_limited = getattr(coder.io, "rate_limited", None)
+    if rate_limited:
+        raise ProviderRateLimited(rate_limited)
+    return result
+
+
+class CoderPool:
+    """
+    Keeps warm Model instances per model name and idle coders per
+    (model, auto_commits, dirty_commits, dry_run, edit_format), so a job does not pay for
+    model metadata lookups, litellm setup and tokenizer loading every time.
+    Coders are reset before they are handed out again.
+    """
+
+    def __init__(self, max_idle=None):
+        self.max_idle = max_idle or Config.CODER_POOL_SIZE
+        self._models = {}
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "model_hits": 0,
+            "model_misses": 0,
+            "coder_hits": 0,
+            "coder_misses": 0,
+            "coder_discarded": 0,
+        }
+
+    def get_model(self, model_name):
+        """
+        Return the cached Model instance for a model name, creating it on first use.
+        Args:
+            model_name (str): The name of the model to use.
+        Returns:
+            Model: The shared model instance.
+        """
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is not None:
+                self._stats["model_hits"] += 1
+                return model
+            self._stats["model_misses"] += 1
+
+        # Build outside the lock, model setup can take seconds
+        model = load_aider().Model(model=model_name)
+
+        with self._lock:
+            return self._models.setdefault(model_name, model)
+
+    def acquire(
+        self,
+        model_name,
+        auto_commits,
+        dirty_commits,
+        dry_run,
+        files=None,
+        execution=None,
+        edit_format=None,
+        edit_files=None,
+    ):
+        """
+        Hand out a coder for one job, reusing an idle one when available.
+        Takes the same arguments as create_coder.
+        Returns:
+            ArchitectCoder: A coder reset for the given files and execution context.
+        """
+        key = (model_name, bool(auto_commits), bool(dirty_commits), bool(dry_run), edit_format)
+
+        with self._lock:
+            idle = self._idle.get(key)
+            coder = idle.pop() if idle else None
+            self._stats["coder_hits" if coder else "coder_misses"] += 1
+
+        if coder is None:
+            coder = create_coder(
+                model_name=model_name,
+                auto_commits=auto_commits,
+                dirty_commits=dirty_commits,
+                dry_run=dry_run,
+                files=files,
+                execution=execution,
+                edit_format=edit_format,
+                edit_files=edit_files,
+            )
+        else:
+            reset_coder(coder, files=files, execution=execution, edit_files=edit_files)
+
+        coder.pool_key = key
+        return coder
+
+    def release(self, coder):
+        """
+        Return a coder to the pool once its job has finished successfully.
+        Args:
+            coder (ArchitectCoder): The coder handed out by acquire.
+        Returns:
+            None
+        """
+        key = getattr(coder, "pool_key", None)
+        if key is None:
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(coder)
+            else:
+                self._stats["coder_discarded"] += 1
+
+    def prewarm(self, model_name, count=1, **options):
+        """
+        Create idle coders ahead of time for a model.
+        Args:
+            model_name (str): The name of the model to use.
+            count (int): Number of idle coders to create.
+            **options: auto_commits, dirty_commits and dry_run flags and edit_format.
+        Returns:
+            None
+        """
+        for _ in range(count):
+            coder = create_coder(
+                model_name=model_name,
+                auto_commits=options.get("auto_commits", False),
+                dirty_commits=options.get("dirty_commits", False),
+                dry_run=options.get("dry_run", False),
+                edit_format=options.get("edit_format"),
+            )
+            coder.pool_key = (
+                model_name,
+                bool(options.get("auto_commits", False)),
+                bool(options.get("dirty_commits", False)),
+                bool(options.get("dry_run", False)),
+                options.get("edit_format"),
+            )
+            self.release(coder)
+
+    def stats(self):
+        """
+        Report pool hit/miss counters and the number of cached instances.
+        Returns:
+            dict: Hit/miss counters, cached models and idle coders per key.
+        """
+        with self._lock:
+            total = self._stats["coder_hits"] + self._stats["coder_misses"]
+            return {
+                **self._stats,
+                "coder_hit_rate": self._stats["coder_hits"] / total if total else 0.0,
+                "models": sorted(self._models),
+                "idle_coders": sum(len(idle) for idle in self._idle.values()),
+            }
+
+
+# Utility method to reset a pooled coder for a new job
+def reset_coder(coder, files=None, execution=None, edit_files=None):
+    """
+    Clear the chat state left by the previous job and attach the coder
+    to the new job's IO, root, read-only and editable files.
+    Args:
+        coder (ArchitectCoder): The pooled coder.
+        files (list, optional): List of filenames to be read-only. Defaults to None.
+        execution (ExecutionContext, optional): Job context the coder is rooted at.
+        edit_files (list, optional): Absolute paths of existing files open for editing,
+            see create_coder.
+    Returns:
+        ArchitectCoder: The reset coder.
+    """
+    if execution:
+        io = execution.create_io()
+        files = [execution.resolve(f) for f in files or []]
+    else:
+        io = load_aider().InputOutput(yes=True, pretty=True)
+
+    coder.io = io
+    coder.commands.io = io
+    coder.pretty = io.pretty
+
+    # Forget the previous conversation and its bookkeeping
+    coder.done_messages = []
+    coder.cur_messages = []
+    coder.abs_fnames = set(edit_files or [])
+    coder.generation_rules = GENERATION_RULES if edit_files is None else EDIT_RULES
+    coder.abs_read_only_fnames = set(f for f in files or [] if os.path.exists(f))
+    coder.aider_edited_files = set()
+    coder.aider_commit_hashes = set()
+    coder.shell_commands = []
+    coder.chat_completion_call_hashes = []
+    coder.chat_completion_response_hashes = []
+    coder.partial_response_content = ""
+    coder.total_cost = 0.0
+    coder.message_cost = 0.0
+    coder.message_tokens_sent = 0
+    coder.message_tokens_received = 0
+    coder.usage_report = None
+    coder.lint_outcome = None
+    coder.test_outcome = None
+    coder.reflected_message = None
+    coder.num_reflections = 0
+
+    if execution:
+        execution.bind(coder)
+    else:
+        coder.abs_root_path_cache = {}
+
+    return coder
+
+
+# Shared coder pool used by all generation jobs
+coder_pool = CoderPool()
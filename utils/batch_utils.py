@@ -0,0 +1,232 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from config import Config
+from utils.admission_utils import AdmissionRejected, admission_controller, estimate_tokens
+from utils.common_utils import combine_archives
+from utils.context_utils import ExecutionContext, GenerationCancelled
+from utils.generation_utils import is_cached, run_generation
+from utils.job_utils import current_job, recoverable, rejected_body
+
+
+class BatchRunner:
+    """
+    Fans batch items out over a shared pool of worker processes while capping
+    how many items of the same model run at once. Each item is admitted by the
+    server's admission controller before it is handed to a worker process, so
+    batches and single requests share the model's limits. Worker processes are
+    spawned once and keep their own warm coder pool between batches.
+    """
+
+    def __init__(self, max_processes=None, model_limits=None, default_model_limit=None):
+        self.max_processes = max_processes or Config.BATCH_PROCESSES
+        self.model_limits = model_limits or Config.BATCH_MODEL_LIMITS
+        self.default_model_limit = default_model_limit or Config.BATCH_MODEL_CONCURRENCY
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def model_limit(self, model_name):
+        """
+        Return the number of items of a model allowed to run at the same time.
+        Args:
+            model_name (str): The name of the model.
+        Returns:
+            int: The concurrency cap of the model.
+        """
+        return int(self.model_limits.get(model_name, self.default_model_limit))
+
+    def run(self, items, cancelled=None, poll=None):
+        """
+        Run batch items on the process pool and collect their results in order.
+        Args:
+            items (list): Keyword arguments for run_generation, one dict per item.
+            cancelled (threading.Event, optional): Stops the batch once set.
+            poll (callable, optional): Called every second, it may set `cancelled`.
+        Returns:
+            list: One (response body, http status) tuple per item. Items of a model with a
+            batch or concurrency limit below 1 fail with a 400, items the admission controller
+            rejects with a 429.
+        Raises:
+            GenerationCancelled: The batch was cancelled. Items already running in a worker
+                process finish there, the others never start.
+        """
+        results = [None] * len(items)
+        pending = []
+        running = {}
+        active = {}
+        tickets = {}
+        executor = self._get_executor()
+
+        # Items of a model without batch or admission capacity could never start
+        for index, item in enumerate(items):
+            limit = self.model_limit(item["model_name"])
+            if limit < 1:
+                message = f"Batch limit of model '{item['model_name']}' must be at least 1"
+                results[index] = ({"ValueError": message}, 400)
+                continue
+            try:
+                admission_controller.check(item["model_name"])
+            except ValueError as e:
+                results[index] = ({"ValueError": str(e)}, 400)
+                continue
+            pending.append(index)
+
+        try:
+            while pending or running:
+                # Admit pending items while their model has batch capacity, start the admitted ones
+                for index in list(pending):
+                    model_name = items[index]["model_name"]
+                    try:
+                        if index not in tickets and self._cached(items[index]):
+                            # Answered from the result cache, the item never calls the model.
+                            # Should the entry expire meanwhile it runs without admission.
+                            pending.remove(index)
+                            running[executor.submit(run_batch_item, items[index])] = index
+                            continue
+                        if index not in tickets:
+                            if active.get(model_name, 0) >= self.model_limit(model_name):
+                                continue
+                            tickets[index] = admission_controller.admit(
+                                model_name, estimate_tokens(items[index])
+                            )
+                            active[model_name] = active.get(model_name, 0) + 1
+                        if not tickets[index].try_acquire():
+                            continue
+                    except AdmissionRejected as e:
+                        pending.remove(index)
+                        if tickets.pop(index, None) is not None:
+                            active[model_name] -= 1
+                        results[index] = (rejected_body(e), 429)
+                        continue
+
+                    pending.remove(index)
+                    running[executor.submit(run_batch_item, items[index])] = index
+
+                # Wake up regularly to notice a cancel request and budgets that refilled
+                if running:
+                    done, _ = wait(list(running), timeout=1, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    if pending:
+                        time.sleep(1)
+                if poll is not None:
+                    poll()
+                if cancelled is not None and cancelled.is_set():
+                    for future, index in running.items():
+                        # Running items keep their slot until their worker process is done
+                        if not future.cancel() and index in tickets:
+                            ticket = tickets.pop(index)
+                            future.add_done_callback(lambda _, ticket=ticket: ticket.release())
+                    raise GenerationCancelled("Batch cancelled")
+
+                for future in done:
+                    index = running.pop(future)
+                    if index in tickets:
+                        tickets.pop(index).release()
+                        active[items[index]["model_name"]] -= 1
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        # The worker process died or the result could not be transferred
+                        results[index] = ({"error": str(e), "status": "error"}, 500)
+
+        finally:
+            # Leave the admission queues, and free the slots of items that never started
+            for ticket in tickets.values():
+                ticket.release()
+
+        return results
+
+    def _cached(self, item):
+        return is_cached(
+            item["model_name"],
+            item.get("directory"),
+            context=item.get("context"),
+            instruction=item.get("instruction"),
+            code_template=item.get("code_template"),
+            options=item.get("options"),
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawn instead of fork, the server process runs many threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+
+# Process pool entry point for one batch item
+def run_batch_item(kwargs):
+    """
+    Run a single batch item inside a worker process.
+    Errors are returned instead of raised so every item gets a result.
+    Args:
+        kwargs (dict): Keyword arguments for run_generation.
+    Returns:
+        tuple: (response body (dict), http status (int))
+    """
+    try:
+        return run_generation(**kwargs), 200
+    except ValueError as e:
+        return {"ValueError": str(e)}, 400
+    except Exception as e:
+        print(f"Error in batch item: {str(e)}")
+        return {"error": str(e), "status": "error"}, 500
+
+
+# Shared batch runner used by the batch endpoint
+batch_runner = BatchRunner()
+
+
+# Job entry point for batch generations
+@recoverable
+def run_batch(items, directory=None):
+    """
+    Run a batch of generations and bundle their outputs into one archive.
+    Args:
+        items (list): Keyword arguments for run_generation, one dict per item.
+        directory (str, optional): Directory receiving the combined archive.
+    Returns:
+        dict: Per item results, counts and the combined archive path.
+    """
+    job = current_job()
+    with ExecutionContext(
+        directory, job_id=job.id if job else None, poll=job.poll_cancel if job else None
+    ) as execution:
+        if job:
+            job.on_cancel(execution.cancel)
+        results = batch_runner.run(items, cancelled=execution.cancelled, poll=execution.poll)
+
+        # Combine the archives of the successful items, one folder per item
+        archives = []
+        for index, (body, http_status) in enumerate(results):
+            zip_path = body.get("zip_path") if http_status == 200 else None
+            if zip_path and os.path.exists(zip_path):
+                name = os.path.splitext(os.path.basename(zip_path))[0]
+                archives.append((f"{index:04d}-{name}", zip_path))
+
+        combined = None
+        if archives:
+            combined = combine_archives(
+                archives, os.path.join(execution.output_dir, "batch.zip")
+            )
+
+    succeeded = sum(1 for _, http_status in results if http_status == 200)
+    return {
+        "status": 201,
+        "items": [
+            {"index": index, "http_status": http_status, "result": body}
+            for index, (body, http_status) in enumerate(results)
+        ],
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "output_directory": execution.output_dir,
+        "zip_path": combined["zip_path"] if combined else None,
+        "zip_size": combined["size"] if combined else None,
+        "zip_sha256": combined["sha256"] if combined else None,
+    }
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import threading
+from config import Config
+
+# Stand-in for the per-job output directory when building cache keys
+OUTPUT_DIR_PLACEHOLDER = "<output_dir>"
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of finished generations.
+
+    Each entry is a folder named after the request key holding the produced
+    zip and the response body. Entries expire after `max_age` seconds and the
+    least recently used ones are evicted once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None, max_age=None):
+        self.cache_dir = os.path.abspath(cache_dir or Config.RESULT_CACHE_DIR)
+        self.max_bytes = max_bytes or Config.RESULT_CACHE_MAX_BYTES
+        self.max_age = max_age or Config.RESULT_CACHE_MAX_AGE
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, model_name, instruction, files=None, options=None):
+        """
+        Build the cache key of a generation request.
+        Args:
+            model_name (str): The name of the model to use.
+            instruction (str): The final instruction built with OUTPUT_DIR_PLACEHOLDER.
+            files (list, optional): Absolute paths of the read-only reference files.
+            options (dict, optional): Aider options that change the produced files.
+        Returns:
+            str: Hex digest identifying the request.
+        """
+        options = options or {}
+        digest = hashlib.sha256()
+        digest.update(model_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(instruction.encode("utf-8"))
+
+        for flag in ("auto_commits", "dirty_commits", "dry_run"):
+            digest.update(f"\0{flag}={bool(options.get(flag, False))}".encode("utf-8"))
+
+        # An editor model or parallel editors switch to an architect coder, see run_attempt
+        editor_model = options.get("editor_model", Config.EDITOR_MODEL)
+        parallel_editor = bool(options.get("parallel_editor", Config.PARALLEL_EDITOR_ENABLED))
+        edit_format = "architect" if editor_model or parallel_editor else "default"
+        digest.update(
+            f"\0editor_model={editor_model or ''}\0parallel_editor={parallel_editor}"
+            f"\0edit_format={edit_format}".encode("utf-8")
+        )
+
+        for file_digest in sorted(file_sha256(f) for f in files or []):
+            digest.update(b"\0")
+            digest.update(file_digest.encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def contains(self, key):
+        """
+        Check for an unexpired entry without restoring it or counting a lookup.
+        Args:
+            key (str): The cache key.
+        Returns:
+            bool: True when restore would hit right now.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        with self._lock:
+            try:
+                return not self._expired(entry)
+            except OSError:
+                return False
+
+    def restore(self, key, output_dir):
+        """
+        Copy a cached result into a job output folder.
+        Args:
+            key (str): The cache key.
+            output_dir (str): The job output folder to restore into.
+        Returns:
+            dict or None: The cached response body and a create_zip_file style
+            result pointing at the restored files, or None on a miss.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        response_path = os.path.join(entry, "response.json")
+
+        with self._lock:
+            if not os.path.exists(response_path) or self._expired(entry):
+                self._stats["misses"] += 1
+                return None
+
+            with open(response_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+
+            zip_name = cached["zip_name"]
+            zip_path = os.path.join(output_dir, zip_name)
+            shutil.copyfile(os.path.join(entry, zip_name), zip_path)
+
+            # Touch the entry so eviction treats it as recently used
+            os.utime(response_path)
+            self._stats["hits"] += 1
+
+        # Unpack next to the zip, like a fresh run would have left it
+        new_output_dir = os.path.join(output_dir, os.path.splitext(zip_name)[0])
+        with zipfile.ZipFile(zip_path) as zipf:
+            zipf.extractall(new_output_dir)
+            names = zipf.namelist()
+
+        return {
+            "response": cached["response"],
+            "zip_result": {
+                "output_dir": new_output_dir,
+                "zip_path": zip_path,
+                "files": names,
+                "size": os.path.getsize(zip_path),
+                "sha256": file_sha256(zip_path),
+                "status": True,
+            },
+        }
+
+    def store(self, key, response, zip_path):
+        """
+        Save a finished generation and evict old entries.
+        Args:
+            key (str): The cache key.
+            response (str): The coder response text.
+            zip_path (str): Path of the produced zip file.
+        Returns:
+            None
+        """
+        entry = os.path.join(self.cache_dir, key)
+        staging = f"{entry}.{threading.get_ident()}.tmp"
+        zip_name = os.path.basename(zip_path)
+
+        # Write into a staging folder and rename it, readers never see partial entries
+        os.makedirs(staging, exist_ok=True)
+        shutil.copyfile(zip_path, os.path.join(staging, zip_name))
+        with open(os.path.join(staging, "response.json"), "w", encoding="utf-8") as f:
+            json.dump({"response": response, "zip_name": zip_name}, f)
+
+        with self._lock:
+            if os.path.exists(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            os.replace(staging, entry)
+            self._stats["stores"] += 1
+            self._evict()
+
+    def stats(self):
+        """
+        Report cache counters and current size.
+        Returns:
+            dict: Hits, misses, stores, evictions, entry count and size in bytes.
+        """
+        with self._lock:
+            entries = self._entries()
+            return {
+                **self._stats,
+                "entries": len(entries),
+                "bytes": sum(size for _, _, size in entries),
+            }
+
+    def _expired(self, entry):
+        response_path = os.path.join(entry, "response.json")
+        return time.time() - os.path.getmtime(response_path) > self.max_age
+
+    def _entries(self):
+        # (path, last used, size) of every complete entry
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            response_path = os.path.join(entry, "response.json")
+            if name.endswith(".tmp") or not os.path.exists(response_path):
+                continue
+
+            size = sum(
+                os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry)
+            )
+            entries.append((entry, os.path.getmtime(response_path), size))
+
+        return entries
+
+    def _evict(self):
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+
+        for entry, last_used, size in entries:
+            if now - last_used <= self.max_age and total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self._stats["evictions"] += 1
+
+
+# Utility method to hash a file's content
+def file_sha256(path):
+    """
+    Compute the SHA-256 digest of a file, reading it in chunks.
+    Missing files are identified by their path instead.
+    Args:
+        path (str): Path of the file.
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    if not os.path.isfile(path):
+        digest.update(f"missing:{path}".encode("utf-8"))
+        return digest.hexdigest()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Shared result cache used by all generation jobs
+result_cache = ResultCache()
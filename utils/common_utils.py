@@ -1,12 +1,57 @@
 import os
-import io
 import zipfile
 import json
-import requests
-import json
+import shutil
+import hashlib
 from typing import Optional
 
 
+# Fixed generation rules. They never contain per-request values, so they are sent
+# as part of the coder's system prompt (see load_aider) and form a stable prefix
+# that providers can cache across requests.
+GENERATION_RULES = (
+    "## CRITICAL EXECUTION RULES\n"
+    "- **Do NOT wait** for any files, confirmations, or uploads — start generation immediately.\n"
+    "- **Do NOT list or predict** which files might be created. Directly generate them.\n"
+    "- **Do NOT include** placeholders, TODOs, or partially implemented logic.\n"
+    "- **Do NOT request** user confirmation or approval — assume all answers are YES.\n"
+    "- **Always produce complete, correct, production-ready code.**\n"
+    "- **Validate** syntax, identifiers, imports, and internal references before outputting.\n"
+    "- **Ensure coherence** across all modules, functions, and types.\n"
+    "- If something is ambiguous, **make a reasonable design decision** and continue.\n"
+    "- If something cannot be implemented due to missing context, explain clearly **why** instead of returning stubs.\n"
+    "\n## OUTPUT GUIDELINES\n"
+    "- All generated files must be placed inside a **new subfolder** within the OUTPUT DIRECTORY given in the request.\n"
+    "- Even if generating a single file, still create a dedicated subfolder.\n"
+    "- The output should be **ready to use**, not a plan or outline.\n"
+    "\n## EXECUTION MODE\n"
+    "- Work in **autonomous generation mode** — no interaction or confirmation required.\n"
+    "- **Directly output complete files** with real implementations.\n"
+    "- **Do not** use *SEARCH/REPLACE*, *diffs*, or *patch formats*.\n"
+    "- Start **now** — no analysis, no explanations, just generate the project files.\n"
+)
+
+# Fixed rules of a regeneration on top of an earlier job's output, used instead of
+# GENERATION_RULES. The earlier project is open for editing, so edits use the
+# coder's own edit format and stay in the existing files.
+EDIT_RULES = (
+    "## CRITICAL EXECUTION RULES\n"
+    "- **Do NOT wait** for any files, confirmations, or uploads — start editing immediately.\n"
+    "- **Do NOT request** user confirmation or approval — assume all answers are YES.\n"
+    "- **Do NOT include** placeholders, TODOs, or partially implemented logic.\n"
+    "- **Validate** syntax, identifiers, imports, and internal references of every edit.\n"
+    "- **Ensure coherence** between the edited and the unchanged files.\n"
+    "\n## OUTPUT GUIDELINES\n"
+    "- The files open for editing are the existing project, **edit them in place**.\n"
+    "- **Do NOT create** a new subfolder or a second copy of the project.\n"
+    "- Only change what the requested changes require, leave everything else as it is.\n"
+    "\n## EXECUTION MODE\n"
+    "- Work in **autonomous editing mode** — no interaction or confirmation required.\n"
+    "- Use the **edit format described above** for changes to existing files.\n"
+    "- Start **now** — no analysis, no explanations, just apply the changes.\n"
+)
+
+
 # Utility method to build instruction
 def build_instruction(
     context: Optional[str],
@@ -15,8 +60,9 @@ def build_instruction(
     output_dir: Optional[str],
 ):
     """
-    Build a comprehensive instruction string for the coder.
-    Ensures critical rules are included and formats the instruction properly.
+    Build the per-request instruction string for the coder.
+    The fixed rules live in GENERATION_RULES and reach the model through the
+    system prompt, so only the request specific parts are built here.
     Args:
         context (str): The context for the code generation.
         instruction (str): The main instruction for the coder.
@@ -31,44 +77,45 @@ def build_instruction(
         final_instruction.append(f"## CONTEXT\n{context}\n")
 
     if instruction:
-        final_instruction.append(
-            f"## INSTRUCTION\n"
-            f"{instruction}\n\n"
-            f"### **CRITICAL EXECUTION RULES:**\n"
-            f"- **Do NOT wait** for any files, confirmations, or uploads — start generation immediately.\n"
-            f"- **Do NOT list or predict** which files might be created. Directly generate them.\n"
-            f"- **Do NOT include** placeholders, TODOs, or partially implemented logic.\n"
-            f"- **Do NOT request** user confirmation or approval — assume all answers are YES.\n"
-            f"- **Always produce complete, correct, production-ready code.**\n"
-            f"- **Validate** syntax, identifiers, imports, and internal references before outputting.\n"
-            f"- **Ensure coherence** across all modules, functions, and types.\n"
-            f"- If something is ambiguous, **make a reasonable design decision** and continue.\n"
-            f"- If something cannot be implemented due to missing context, explain clearly **why** instead of returning stubs.\n"
-        )
+        final_instruction.append(f"## INSTRUCTION\n{instruction}\n")
 
     if code_template:
-        final_instruction.append(f"\n## CODE TEMPLATE (if relevant)\n{code_template}\n")
+        final_instruction.append(f"## CODE TEMPLATE (if relevant)\n{code_template}\n")
 
-    final_instruction.append(
-        f"\n## OUTPUT GUIDELINES\n"
-        f"- All generated files must be placed inside a **new subfolder** within the directory:\n"
-        f"  `{output_dir}`\n"
-        f"- Even if generating a single file, still create a dedicated subfolder.\n"
-        f"- The output should be **ready to use**, not a plan or outline.\n"
-    )
+    final_instruction.append(f"## OUTPUT DIRECTORY\n`{output_dir}`\n")
 
     final_instruction.append(
-        "\n## EXECUTION MODE\n"
-        "- Work in **autonomous generation mode** — no interaction or confirmation required.\n"
-        "- **Directly output complete files** with real implementations.\n"
-        "- **Do not** use *SEARCH/REPLACE*, *diffs*, or *patch formats*.\n"
-        "- Start **now** — no analysis, no explanations, just generate the project files.\n"
-        "\n# ✅ BEGIN NOW: Generate the full implementation immediately.\n"
+        "# ✅ BEGIN NOW: Follow the generation rules and generate the full implementation immediately.\n"
     )
 
     return "\n".join(final_instruction).strip()
 
 
+# Utility method to build the instruction of an incremental regeneration
+def build_edit_instruction(change: str, output_dir: Optional[str]):
+    """
+    Build the instruction of a regeneration on top of an earlier job's output.
+    The earlier project was copied into the output directory and its files are
+    open for editing, so only the change is sent.
+    Args:
+        change (str): What changed since the earlier job, see prepare_incremental.
+        output_dir (str): The directory holding the copied project.
+    Returns:
+        str: The final instruction string.
+    """
+    final_instruction = [
+        "## EXISTING PROJECT\n"
+        f"The files generated for the previous version of this request are in `{output_dir}` "
+        "and open for editing. Edit them in place, do not create a new subfolder, "
+        "and only change what the changes below require.\n",
+        change,
+        f"## OUTPUT DIRECTORY\n`{output_dir}`\n",
+        "# ✅ BEGIN NOW: Apply the changes to the existing files immediately.\n",
+    ]
+
+    return "\n".join(final_instruction).strip()
+
+
 # Utility method to validate JSON input
 def validate_json(data, required_fields):
     """
@@ -99,204 +146,164 @@ def validate_json(data, required_fields):
     return True, {**data, "options": options}
 
 
-# Utility method to setup directory
-def setup_directory(directory, original_dir):
+class HashingWriter:
     """
-    Ensure the specified directory exists and change to it.
-    Args:
-        directory (str): The target directory to change to.
-        original_dir (str): The original directory to return to if needed.
-    Returns:
-        base_output_dir (str): The base output directory inside the specified directory.
+    Write-only file wrapper that hashes every byte on its way to disk.
+    It reports itself as unseekable, so zipfile streams entries with data
+    descriptors instead of seeking back, and the digest covers the final file.
     """
 
-    # Change to specified directory if provided
-    if directory and directory != original_dir:
-        abs_directory = os.path.abspath(directory)
-        os.makedirs(abs_directory, exist_ok=True)
-        os.chdir(abs_directory)
-        print(f"Changed to directory: {abs_directory}")
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
 
-        # Ensure output directory exists
-        base_output_dir = os.path.join(abs_directory, "output")
-        os.makedirs(base_output_dir, exist_ok=True)
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
 
-        return base_output_dir
-    else:
-        return os.path.join(original_dir, "output")
+    def tell(self):
+        return self.size
+
+    def seek(self, *args):
+        raise OSError("HashingWriter is not seekable")
+
+    def flush(self):
+        self.fileobj.flush()
 
 
 # Utility method to zip a directory
-def zip_directory(directory_path: str):
+def zip_directory(directory_path: str, zip_path: str, files=None):
     """
-    Zip the contents of a directory and return as an in-memory file.
+    Zip the contents of a directory straight into a file on disk, in a single pass.
+    File contents are streamed entry by entry and the archive checksum is computed
+    while writing, so memory use does not grow with the size of the output.
     Args:
         directory_path (str): The path to the directory to be zipped.
+        zip_path (str): The path of the zip file to create.
+        files (list, optional): Absolute paths to include. Defaults to every file in the directory.
     Returns:
-        io.BytesIO: An in-memory bytes buffer containing the zip file.
+        dict: zip_path, size (bytes), sha256 of the archive and the entries with their CRC32.
     """
 
-    memory_file = io.BytesIO()
-
-    # Create a zip file in memory
-    with zipfile.ZipFile(memory_file, "w", zipfile.ZIP_DEFLATED) as zipf:
-        # Walk the directory
-        for root, _, files in os.walk(directory_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-
+    if files is None:
+        files = []
+        for root, _, names in os.walk(directory_path):
+            for name in names:
+                files.append(os.path.join(root, name))
+
+    entries = []
+    with open(zip_path, "wb") as f:
+        writer = HashingWriter(f)
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for file_path in sorted(files):
                 # Add file to the zip file with relative path
                 arcname = os.path.relpath(file_path, directory_path)
-                zipf.write(file_path, arcname)
-
-    memory_file.seek(0)
+                info = zipfile.ZipInfo.from_file(file_path, arcname)
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+                with open(file_path, "rb") as src, zipf.open(info, "w") as dest:
+                    shutil.copyfileobj(src, dest, 1024 * 1024)
+
+                entries.append(
+                    {
+                        "name": info.filename,
+                        "size": info.file_size,
+                        "crc32": format(info.CRC, "08x"),
+                    }
+                )
+
+    return {
+        "zip_path": zip_path,
+        "size": writer.size,
+        "sha256": writer.sha256.hexdigest(),
+        "entries": entries,
+    }
+
+
+# Utility method to combine several zip files into one
+def combine_archives(archives, zip_path):
+    """
+    Copy the entries of several zip files into one archive, each under its own folder.
+    Entries are streamed from archive to archive without extracting them to disk.
+    Args:
+        archives (list): (folder name, zip path) tuples.
+        zip_path (str): The path of the combined zip file to create.
+    Returns:
+        dict: zip_path, size (bytes) and sha256 of the combined archive.
+    """
 
-    return memory_file
+    with open(zip_path, "wb") as f:
+        writer = HashingWriter(f)
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for folder, source_path in archives:
+                with zipfile.ZipFile(source_path) as source:
+                    for info in source.infolist():
+                        entry = zipfile.ZipInfo(f"{folder}/{info.filename}", info.date_time)
+                        entry.compress_type = zipfile.ZIP_DEFLATED
+                        entry.file_size = info.file_size
+                        with source.open(info) as src, zipf.open(entry, "w") as dest:
+                            shutil.copyfileobj(src, dest, 1024 * 1024)
+
+    return {
+        "zip_path": zip_path,
+        "size": writer.size,
+        "sha256": writer.sha256.hexdigest(),
+    }
 
 
 # Utility method to create zip file of output directory
-def create_zip_file(base_output_dir, existing_dirs):
+def create_zip_file(base_output_dir, files):
     """
-    Create a zip file of the newly created output directory inside base_output_dir.
-    Only creates zip if there are actually new files created.
+    Create a zip file of the files a job wrote inside base_output_dir.
+    The files come from the job's write manifest, so no directory listing is
+    needed to find the new output. Only creates zip if files were actually written.
     Args:
-        base_output_dir (str): The base output directory containing the new output folder.
-        existing_dirs (set): Set of directory names that existed before the new output was created.
+        base_output_dir (str): The job output directory containing the new output folder.
+        files (list): Absolute paths of the files written by the job.
     Returns:
         output_dir (str): The path to the new output directory.
-        zipfile (io.BytesIO or None): The in-memory zip file if created, else None.
         zip_path (str or None): The path where the zip file is stored, else None.
+        files (list): Paths of the generated files, relative to output_dir.
+        size (int): Size of the zip file in bytes, when created.
+        sha256 (str): SHA-256 digest of the zip file, when created.
+        status (bool): Whether a zip file was created.
     """
 
-    # Detect the newly created directory inside 'output'
-    current_dirs = set()
-    if os.path.exists(base_output_dir):
-        current_dirs = set(os.listdir(base_output_dir))
+    prefix = os.path.join(base_output_dir, "")
+    files = sorted(f for f in files if f.startswith(prefix) and os.path.isfile(f))
 
-    new_dirs = current_dirs - existing_dirs
-
-    zipfile = None
-    if new_dirs:
-        # Use the first new directory found (there should typically be only one)
-        new_dir_name = next(iter(new_dirs))
-        output_dir = os.path.join(base_output_dir, new_dir_name)
-        print(f"New output directory: {output_dir}")
-
-        # Check if the new directory actually contains files
-        if directory_has_files(output_dir):
-            # Create a zip of the output directory
-            zipfile = zip_directory(output_dir)
-
-            # Store the zipfile in output dir
-            zip_path = get_unique_filename(base_output_dir, new_dir_name, ".zip")
-            with open(zip_path, "wb") as f:
-                f.write(zipfile.read())
-
-            print(f"Created zip file: {zip_path}")
-            return {
-                "output_dir": output_dir,
-                "zipfile": zipfile,
-                "zip_path": zip_path,
-                "status": True,
-            }
-        else:
-            print(f"New directory created but contains no files, skipping zip creation")
-            return {
-                "output_dir": output_dir,
-                "zipfile": None,
-                "zip_path": None,
-                "status": False,
-            }
-    else:
-        print(f"No new directory created, no zip file needed")
+    if not files:
+        print("No new files written, no zip file needed")
         return {
             "output_dir": base_output_dir,
-            "zipfile": None,
             "zip_path": None,
+            "files": [],
             "status": False,
         }
 
-
-# Utility method to check if directory has files
-def directory_has_files(directory_path):
-    """
-    Check if a directory contains any files (recursively).
-    Args:
-        directory_path (str): Path to the directory to check.
-    Returns:
-        bool: True if directory contains files, False otherwise.
-    """
-    if not os.path.exists(directory_path):
-        return False
-
-    for root, dirs, files in os.walk(directory_path):
-        if files:  # If any files are found
-            return True
-
-    return False
-
-
-# Utility method to get a unique filename
-def get_unique_filename(directory, base_name, extension):
-    """
-    Generate a unique filename by adding incremental numbers if duplicates exist.
-    Args:
-        directory (str): The directory where the file will be created.
-        base_name (str): The base name for the file (without extension).
-        extension (str): The file extension (including the dot).
-    Returns:
-        str: A unique file path.
-    """
-    original_path = os.path.join(directory, f"{base_name}{extension}")
-
-    # If the file doesn't exist, return the original path
-    if not os.path.exists(original_path):
-        return original_path
-
-    # Find the next available number
-    counter = 1
-    while True:
-        new_name = f"{base_name}({counter}){extension}"
-        new_path = os.path.join(directory, new_name)
-
-        if not os.path.exists(new_path):
-            return new_path
-
-        counter += 1
-
-        # Safety check to prevent infinite loop
-        if counter > 9999:
-            raise RuntimeError(f"Too many duplicate files for base name: {base_name}")
-
-
-# Utility to upload zip file to cloud storage
-def upload_to_cloud(zipFile, zipName):
-    """
-    Upload the zip to backend endpoint using POST request.
-    Args:
-        zipFile (io.BytesIO): The in-memory zip file to upload.
-        zipName (str): The name of the zip file.
-    Returns:
-        None
-    """
-
-    try:
-        zipFile.seek(0)
-
-        files = {"file": (zipName, zipFile, "application/zip")}
-
-        base_url = os.getenv("BACKEND_URL")
-        backend_url = f"{base_url}/api/v1/files/zip/upload"
-
-        response = requests.post(backend_url, files=files, verify=False)
-
-        if response.status_code == 201:
-            print(f"Successfully uploaded {zipName} to cloud storage.")
-            print(f"Response: {json.dumps(response.json(), indent=4)}")
-        else:
-            print(
-                f"Failed to upload {zipName}. Status code: {response.status_code}, Response: {response.text}"
-            )
-
-    except Exception as e:
-        print(f"Error uploading {zipName} to cloud storage: {str(e)}")
+    # The new output directory is the top level folder the files were written to
+    top_level = {os.path.relpath(f, base_output_dir).split(os.sep)[0] for f in files}
+    new_dir_name = top_level.pop() if len(top_level) == 1 else None
+    if new_dir_name and os.path.isdir(os.path.join(base_output_dir, new_dir_name)):
+        output_dir = os.path.join(base_output_dir, new_dir_name)
+    else:
+        output_dir = base_output_dir
+        new_dir_name = os.path.basename(base_output_dir)
+    print(f"New output directory: {output_dir}")
+
+    # Stream the written files into the zip file next to the output directory.
+    # The job folder belongs to this job alone, so the name is free without probing.
+    zip_path = os.path.join(base_output_dir, f"{new_dir_name}.zip")
+    archive = zip_directory(output_dir, zip_path, files=files)
+
+    print(f"Created zip file: {zip_path} ({archive['size']} bytes)")
+    return {
+        "output_dir": output_dir,
+        "zip_path": zip_path,
+        "files": [entry["name"] for entry in archive["entries"]],
+        "size": archive["size"],
+        "sha256": archive["sha256"],
+        "status": True,
+    }
@@ -0,0 +1,265 @@
+import os
+import re
+import uuid
+import shutil
+import threading
+from functools import lru_cache
+from utils.retention_utils import retention_manager
+
+
+# Aider's messages about provider rate limits, e.g. "litellm.RateLimitError: ..."
+RATE_LIMIT_MESSAGE = re.compile(r"rate.?limit", re.IGNORECASE)
+
+
+class GenerationCancelled(Exception):
+    """
+    Raised when a generation stops because its execution context was cancelled.
+    """
+
+
+class ProviderRateLimited(Exception):
+    """
+    Raised when aider gave up retrying a model call the provider rate limited.
+    """
+
+
+# Utility method to build the JobIO class once aider is imported
+@lru_cache(maxsize=None)
+def job_io_class():
+    """
+    Build the JobIO class on first use, so importing this module does not import aider.
+    Returns:
+        type: The JobIO class, an aider InputOutput subclass.
+    """
+    from aider.io import InputOutput
+
+    class JobIO(InputOutput):
+        """
+        InputOutput used by generation jobs. It records every file Aider writes
+        into the job's write manifest and, when the job streams its output,
+        forwards Aider's messages and streamed LLM tokens to an event callback.
+        Editor coders share the architect IO, so their writes and tokens are seen too.
+        Once the job is cancelled, model calls and file writes raise GenerationCancelled.
+        Rate limit errors aider gave up retrying are kept in `rate_limited`.
+        """
+
+        def __init__(
+            self, written_files, on_event=None, usage=None, cancelled=None, poll=None, **kwargs
+        ):
+            super().__init__(**kwargs)
+            self.written_files = written_files
+            self.on_event = on_event
+            self.usage = usage if usage is not None else new_token_usage()
+            self.cancelled = cancelled
+            self.poll = poll
+            self.usage_lock = threading.Lock()
+            # Set by execute_instruction, other coders of an architect run are its editors
+            self.architect_run = False
+            self.rate_limited = None
+
+        def check_cancelled(self):
+            # Called before every model call, for every streamed chunk and before every write.
+            # `poll` picks up cancel requests made in other processes, see Job.poll_cancel
+            if self.poll is not None:
+                self.poll()
+            if self.cancelled is not None and self.cancelled.is_set():
+                raise GenerationCancelled("Generation cancelled")
+
+        def write_text(self, filename, content, max_retries=5, initial_delay=0.1):
+            self.check_cancelled()
+            super().write_text(
+                filename, content, max_retries=max_retries, initial_delay=initial_delay
+            )
+            if not self.dry_run:
+                self.written_files.add(os.path.abspath(str(filename)))
+
+        def record_usage(
+            self, input_tokens, output_tokens, cached_input_tokens=0, cache_write_tokens=0
+        ):
+            # Called once per completion of the architect and editor coders,
+            # parallel editors report from several threads
+            with self.usage_lock:
+                self.usage["input_tokens"] += input_tokens
+                self.usage["cached_input_tokens"] += cached_input_tokens
+                self.usage["uncached_input_tokens"] += max(0, input_tokens - cached_input_tokens)
+                self.usage["cache_write_tokens"] += cache_write_tokens
+                self.usage["output_tokens"] += output_tokens
+
+        def emit_token(self, coder, text):
+            if self.on_event:
+                if coder.edit_format == "architect":
+                    phase = "architect"
+                else:
+                    phase = "editor" if self.architect_run else "generate"
+                data = {"phase": phase, "text": text}
+                # Parallel editors tag their tokens with the file they write
+                task = getattr(coder, "editor_task", None)
+                if task:
+                    data["file"] = task
+                self.on_event("token", data)
+
+        def assistant_output(self, message, pretty=None):
+            # Only called for non-streamed replies, streamed ones arrive via emit_token
+            if self.on_event:
+                self.on_event("message", {"text": message})
+            super().assistant_output(message, pretty=pretty)
+
+        def tool_output(self, *messages, log_only=False, bold=False):
+            # Aider retries the call after reporting the error, only the last error counts
+            if messages and str(messages[0]).startswith("Retrying in"):
+                self.rate_limited = None
+            if self.on_event and messages and not log_only:
+                self.on_event("log", {"level": "info", "text": " ".join(map(str, messages))})
+            super().tool_output(*messages, log_only=log_only, bold=bold)
+
+        def tool_warning(self, message="", strip=True):
+            if self.on_event and message:
+                self.on_event("log", {"level": "warning", "text": str(message)})
+            super().tool_warning(message, strip=strip)
+
+        def tool_error(self, message="", strip=True):
+            if message and RATE_LIMIT_MESSAGE.search(str(message)):
+                self.rate_limited = str(message)
+            if self.on_event and message:
+                self.on_event("log", {"level": "error", "text": str(message)})
+            super().tool_error(message, strip=strip)
+
+    return JobIO
+
+
+# Utility method to create an empty token usage report
+def new_token_usage():
+    """
+    Create the token counters of one job.
+    Returns:
+        dict: Input tokens split into cached and uncached, cache writes and output tokens.
+    """
+    return {
+        "input_tokens": 0,
+        "cached_input_tokens": 0,
+        "uncached_input_tokens": 0,
+        "cache_write_tokens": 0,
+        "output_tokens": 0,
+    }
+
+
+class ExecutionContext:
+    """
+    Filesystem context of a single generation job.
+
+    Every path handed to Aider is resolved against an absolute root instead of
+    the process working directory, so concurrent jobs never have to `os.chdir`.
+    Each job writes into its own folder `<root>/output/<job_id>`. Used as a
+    context manager, the folder is kept from retention until the job is over.
+    cancel() stops the coders of the context at their next model call, streamed
+    chunk or file write; the partial output of a cancelled context is removed
+    when its block exits with the error. `poll` is called at the same points
+    and may cancel the context.
+    """
+
+    def __init__(self, directory=None, job_id=None, on_event=None, poll=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.on_event = on_event
+        self.poll = poll
+        self.written_files = set()
+        self.usage = new_token_usage()
+        self.cancelled = threading.Event()
+        self.root = os.path.abspath(directory or os.getcwd())
+        self.base_output_dir = os.path.join(self.root, "output")
+        self.output_dir = os.path.join(self.base_output_dir, self.job_id)
+
+        # Ensure the job output directory exists
+        os.makedirs(self.output_dir, exist_ok=True)
+        retention_manager.track(self.base_output_dir)
+
+    def __enter__(self):
+        retention_manager.pin(self.output_dir)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        retention_manager.unpin(self.output_dir)
+        if exc_type is not None and self.cancelled.is_set():
+            self.discard()
+        return False
+
+    def cancel(self):
+        """
+        Ask the coders of this context to stop.
+        Returns:
+            None
+        """
+        self.cancelled.set()
+
+    def discard(self):
+        """
+        Remove the output folder with everything the job left in it: partial
+        files, reference excerpts and the zip file if it got that far.
+        Returns:
+            None
+        """
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def resolve(self, path):
+        """
+        Resolve a path relative to the job root.
+        Args:
+            path (str): Absolute path, or path relative to the job root.
+        Returns:
+            str: The absolute path.
+        """
+        return os.path.normpath(os.path.join(self.root, path))
+
+    def create_io(self, pretty=False):
+        """
+        Create an InputOutput for non-interactive mode rooted at the job root.
+        Pretty output is off by default: rich only allows one live display per
+        process, which breaks as soon as two jobs stream at the same time.
+        Files written through the IO are recorded in the job's write manifest
+        and, when the job streams its output, the IO also reports to `on_event`.
+        Token usage of every completion is added to the job's `usage`.
+        Args:
+            pretty (bool): Whether to use colored, formatted output.
+        Returns:
+            JobIO: The Aider IO instance for this job.
+        """
+        return job_io_class()(
+            self.written_files,
+            on_event=self.on_event,
+            usage=self.usage,
+            cancelled=self.cancelled,
+            poll=self.poll,
+            yes=True,
+            pretty=pretty,
+            root=self.root,
+        )
+
+    def manifest(self):
+        """
+        List the files written by this job inside its output folder.
+        Args:
+            None
+        Returns:
+            list: Sorted absolute paths of the written files that still exist.
+        """
+        prefix = self.output_dir + os.sep
+        return sorted(
+            path
+            for path in self.written_files
+            if path.startswith(prefix) and os.path.isfile(path)
+        )
+
+    def bind(self, coder):
+        """
+        Point an existing coder at the job root. Aider derives the root from
+        the process working directory, so it is overridden after creation.
+        Args:
+            coder (Coder): The coder to bind.
+        Returns:
+            Coder: The same coder, rooted at the job root.
+        """
+        coder.root = self.root
+        coder.abs_root_path_cache = {}
+        if getattr(coder, "linter", None) is not None:
+            coder.linter.root = self.root
+
+        return coder
@@ -0,0 +1,119 @@
+import re
+
+# A file path with an extension, e.g. `src/app.py` or `/abs/output/job/README.md`
+PATH = r"/?(?:[\w.-]+/)*[\w-][\w.-]*\.[A-Za-z][A-Za-z0-9]{0,7}"
+
+# File paths the architect names in code spans, bold text, headings or on a line of their own
+FILE_MENTION = re.compile(
+    rf"`({PATH})`|\*\*({PATH})\*\*|^#+\s+(?:File:\s*)?({PATH})\s*$|^({PATH}):?\s*$",
+    re.MULTILINE,
+)
+
+# Lines that start a new section of the plan: headings, top level list items
+# and file names on a line of their own, as before a fenced file listing
+SECTION_START = re.compile(rf"^(?:#+\s|\d+[.)]\s|[-*]\s|{PATH}:?\s*$)")
+
+# A list item or line that starts with a file path, e.g. "1. **`src/app.py`**: ..."
+LEADING_FILE = re.compile(rf"^(?:\d+[.)]\s+|[-*]\s+)?(?:File:\s*)?[`*]*({PATH})[`*]*(?::|\s|$)")
+
+FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+# Utility method to split an architect plan into sections
+def split_sections(plan):
+    """
+    Split a markdown plan at its headings, top level list items and file name lines, keeping
+    fenced code blocks inside the section they belong to.
+    Args:
+        plan (str): The architect's reply.
+    Returns:
+        list: The sections, in order.
+    """
+    sections = []
+    current = []
+    in_fence = False
+
+    for line in plan.splitlines():
+        if FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and SECTION_START.match(line) and current:
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+
+# Utility method to list the files mentioned in a text
+def mentioned_files(text):
+    """
+    Find the file paths named in code spans, bold text, headings or on a line of their own.
+    Args:
+        text (str): Part of a plan.
+    Returns:
+        list: Distinct paths, in order of first mention.
+    """
+    files = []
+    for match in FILE_MENTION.finditer(text):
+        path = next(group for group in match.groups() if group)
+        if path not in files:
+            files.append(path)
+    return files
+
+
+# Utility method to split an architect plan into one editor task per file
+def split_plan(plan):
+    """
+    Split the architect's plan into per-file editor tasks.
+
+    A section belongs to the files named in its heading, or to the file its
+    first line starts with. Otherwise list items belong to the files of the
+    heading above them, and other sections to the single file named in their
+    body. Sections that belong to no file are shared: they are part of every
+    task, so each editor sees the overall design and the interfaces of the
+    other files.
+    Args:
+        plan (str): The architect's reply.
+    Returns:
+        list or None: (file, task text) tuples, or None when the plan names fewer than two files.
+    """
+    sections = []
+    heading_owners = []
+    for section in split_sections(plan):
+        section = section.strip()
+        if not section:
+            continue
+
+        first_line = section.split("\n", 1)[0]
+        is_heading = first_line.startswith("#")
+        if is_heading:
+            owners = mentioned_files(first_line)
+        else:
+            leading = LEADING_FILE.match(first_line)
+            owners = [leading.group(1)] if leading else []
+        if not owners and heading_owners and not is_heading:
+            owners = heading_owners
+        if not owners:
+            body_files = mentioned_files(section)
+            owners = body_files if len(body_files) == 1 else []
+        if is_heading:
+            heading_owners = owners
+        sections.append((section, owners))
+
+    files = []
+    for _, owners in sections:
+        files.extend(f for f in owners if f not in files)
+    if len(files) < 2:
+        return None
+
+    tasks = []
+    for path in files:
+        parts = [section for section, owners in sections if not owners or path in owners]
+        parts.append(
+            f"Only create or change `{path}` now. "
+            "The other files of this plan are written at the same time by other editors."
+        )
+        tasks.append((path, "\n\n".join(parts)))
+    return tasks
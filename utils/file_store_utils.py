@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from werkzeug.utils import secure_filename
+from config import Config
+
+# Uploads are copied to disk and hashed in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+
+# A file named PIN_PREFIX + pid in an entry keeps it from being evicted while that process uses it
+PIN_PREFIX = ".in_use."
+
+
+class FileTooLarge(ValueError):
+    """
+    Raised when an upload exceeds the per-file size limit of the store.
+    """
+
+    def __init__(self, filename, max_bytes):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        super().__init__(f"File {filename} exceeds the limit of {max_bytes} bytes")
+
+
+class FileStore:
+    """
+    Content-addressed on-disk store of uploaded reference files.
+
+    Uploads are streamed to disk in chunks and hashed while they are written,
+    the SHA-256 digest of the content is the file id. Uploading the same
+    content again keeps the stored blob. Each entry is a folder named after
+    the file id holding the file under its original name and its metadata.
+    Files used by a running job are never evicted, the least recently used
+    other ones are removed once the store exceeds `max_bytes`. A job pins its
+    files with a pin file per process in the entry, so the store can be shared
+    by several worker processes.
+    """
+
+    def __init__(self, store_dir=None, max_bytes=None, max_file_bytes=None):
+        self.store_dir = os.path.abspath(store_dir or Config.FILE_STORE_DIR)
+        self.max_bytes = max_bytes or Config.FILE_STORE_MAX_BYTES
+        self.max_file_bytes = max_file_bytes or Config.FILE_STORE_MAX_FILE_BYTES
+        self.staging_dir = os.path.join(self.store_dir, ".staging")
+        self._lock = threading.Lock()
+        self._in_use = {}
+        self._stats = {"uploads": 0, "deduplicated": 0, "rejected": 0, "evictions": 0}
+
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def save(self, stream, filename):
+        """
+        Stream an upload into the store.
+        Args:
+            stream (file-like): Readable binary stream of the upload.
+            filename (str): Original name of the upload.
+        Returns:
+            dict: File id, name, size and whether the content was already stored.
+        Raises:
+            FileTooLarge: The upload exceeds `max_file_bytes`.
+        """
+        filename = secure_filename(filename) or "upload"
+        digest = hashlib.sha256()
+        size = 0
+
+        # Copy and hash in one pass, stop as soon as the limit is crossed
+        fd, staging_path = tempfile.mkstemp(dir=self.staging_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise FileTooLarge(filename, self.max_file_bytes)
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            file_id = digest.hexdigest()
+            entry = os.path.join(self.store_dir, file_id)
+
+            with self._lock:
+                self._stats["uploads"] += 1
+                deduplicated = os.path.exists(self._meta_path(entry))
+
+                if deduplicated:
+                    self._stats["deduplicated"] += 1
+                    os.utime(self._meta_path(entry))
+                else:
+                    os.makedirs(entry, exist_ok=True)
+                    os.replace(staging_path, os.path.join(entry, filename))
+                    with open(self._meta_path(entry), "w", encoding="utf-8") as f:
+                        json.dump(
+                            {"filename": filename, "size": size, "created_at": time.time()}, f
+                        )
+                    self._evict()
+
+            meta = self.get(file_id)
+            return {**meta, "deduplicated": deduplicated}
+
+        except FileTooLarge:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise
+
+        finally:
+            if os.path.exists(staging_path):
+                os.unlink(staging_path)
+
+    def get(self, file_id):
+        """
+        Return the metadata of a stored file.
+        Args:
+            file_id (str): The file id returned by save.
+        Returns:
+            dict or None: File id, name, size and creation time, None when unknown.
+        """
+        entry = self._entry(file_id)
+        if entry is None:
+            return None
+
+        with open(self._meta_path(entry), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return {"file_id": file_id, **meta}
+
+    def acquire(self, file_ids):
+        """
+        Resolve file ids to paths and keep the files from being evicted
+        until they are released.
+        Args:
+            file_ids (list): File ids returned by save.
+        Returns:
+            list: Absolute paths of the files, in the order of the ids.
+        Raises:
+            KeyError: One of the ids is not in the store.
+        """
+        with self._lock:
+            paths = []
+            for file_id in file_ids:
+                entry = self._entry(file_id)
+                if entry is None:
+                    raise KeyError(file_id)
+                with open(self._meta_path(entry), "r", encoding="utf-8") as f:
+                    paths.append(os.path.join(entry, json.load(f)["filename"]))
+
+            # Pin the entries, then touch them so eviction treats them as recently used
+            for file_id in file_ids:
+                entry = os.path.join(self.store_dir, file_id)
+                if file_id not in self._in_use:
+                    open(self._pin_path(entry), "a").close()
+                self._in_use[file_id] = self._in_use.get(file_id, 0) + 1
+                try:
+                    os.utime(self._meta_path(entry))
+                except FileNotFoundError:
+                    # Evicted by another process before the pin was written
+                    self._unpin(file_id)
+                    raise KeyError(file_id)
+
+            return paths
+
+    def release(self, file_ids):
+        """
+        Let files taken with acquire be evicted again.
+        Args:
+            file_ids (list): The ids passed to acquire.
+        Returns:
+            None
+        """
+        with self._lock:
+            for file_id in file_ids:
+                self._unpin(file_id)
+            self._evict()
+
+    def stats(self):
+        """
+        Report store counters and current size.
+        Returns:
+            dict: Uploads, deduplicated uploads, rejected uploads, evictions,
+            file count, files in use by any process and size in bytes.
+        """
+        with self._lock:
+            entries = self._entries()
+            return {
+                **self._stats,
+                "files": len(entries),
+                "in_use": sum(1 for entry, _, _ in entries if self._pinned(entry)),
+                "bytes": sum(size for _, _, size in entries),
+            }
+
+    def _entry(self, file_id):
+        # Ids are hex digests, anything else never names an entry
+        if not file_id or len(file_id) != 64 or not all(c in "0123456789abcdef" for c in file_id):
+            return None
+        entry = os.path.join(self.store_dir, file_id)
+        return entry if os.path.exists(self._meta_path(entry)) else None
+
+    def _meta_path(self, entry):
+        return os.path.join(entry, "meta.json")
+
+    def _pin_path(self, entry):
+        return os.path.join(entry, f"{PIN_PREFIX}{os.getpid()}")
+
+    def _unpin(self, file_id):
+        # Drop one use of the calling process, the pin file goes with the last one
+        count = self._in_use.get(file_id, 0) - 1
+        if count > 0:
+            self._in_use[file_id] = count
+            return
+
+        self._in_use.pop(file_id, None)
+        try:
+            os.unlink(self._pin_path(os.path.join(self.store_dir, file_id)))
+        except OSError:
+            pass
+
+    def _pinned(self, entry):
+        # Whether a live process pinned the entry, pins of exited processes are removed
+        pinned = False
+        for name in os.listdir(entry):
+            if not name.startswith(PIN_PREFIX):
+                continue
+            try:
+                pid = int(name[len(PIN_PREFIX):])
+                os.kill(pid, 0)
+                pinned = True
+            except PermissionError:
+                pinned = True
+            except (ValueError, ProcessLookupError):
+                try:
+                    os.unlink(os.path.join(entry, name))
+                except OSError:
+                    pass
+        return pinned
+
+    def _entries(self):
+        # (path, last used, size) of every complete entry
+        entries = []
+        for name in os.listdir(self.store_dir):
+            entry = os.path.join(self.store_dir, name)
+            if name.startswith(".") or not os.path.exists(self._meta_path(entry)):
+                continue
+
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((entry, os.path.getmtime(self._meta_path(entry)), size))
+
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+
+        for entry, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if self._pinned(entry):
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self._stats["evictions"] += 1
+
+
+# Utility method to store the files of a multipart request
+def store_uploads(uploaded_files):
+    """
+    Stream every uploaded file into the shared store.
+    Args:
+        uploaded_files (list): Werkzeug FileStorage objects of the request.
+    Returns:
+        list: Metadata of the stored files, see FileStore.save.
+    Raises:
+        FileTooLarge: One of the files exceeds the per-file limit.
+    """
+    return [
+        file_store.save(file.stream, file.filename)
+        for file in uploaded_files
+        if file.filename
+    ]
+
+
+# Utility method to read a list of file ids from a request field
+def parse_file_ids(value):
+    """
+    Accept file ids as a JSON list, a comma separated string or a list.
+    Args:
+        value (str or list or None): The raw field value.
+    Returns:
+        list: The file ids, without blanks and duplicates.
+    Raises:
+        ValueError: The value is neither a list of ids nor a string.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        raw = value
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = raw.split(",")
+        # A single id, an id of digits only also parses as a JSON number
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = [raw]
+        elif isinstance(value, str):
+            value = [value]
+
+    if not isinstance(value, list) or not all(isinstance(file_id, str) for file_id in value):
+        raise ValueError("file_ids must be a list of file ids or a comma separated string")
+
+    file_ids = []
+    for file_id in value:
+        file_id = file_id.strip().lower()
+        if file_id and file_id not in file_ids:
+            file_ids.append(file_id)
+    return file_ids
+
+
+# Shared store of uploaded reference files
+file_store = FileStore()
@@ -0,0 +1,569 @@
+import os
+import json
+import time
+import hashlib
+from contextlib import ExitStack
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config import Config
+from utils.common_utils import build_edit_instruction, build_instruction, create_zip_file
+from utils.aider_utils import coder_pool, execute_instruction
+from utils.cache_utils import result_cache, OUTPUT_DIR_PLACEHOLDER
+from utils.admission_utils import AdmissionRejected, admission_controller, estimate_tokens
+from utils.context_utils import ExecutionContext
+from utils.incremental_utils import (
+    changed_files,
+    find_base_output,
+    prepare_incremental,
+    seed_output,
+)
+from utils.job_utils import current_job, recoverable
+from utils.metrics_utils import (
+    CACHE_LOOKUPS_TOTAL,
+    CONTEXT_TOKENS_TOTAL,
+    HEDGES_TOTAL,
+    ZIP_BYTES_TOTAL,
+    collect_stages,
+    job_labels,
+    observe_stage,
+    record_tokens,
+    stage_target,
+    stage_timer,
+)
+from utils.relevance_utils import select_context
+from utils.upload_utils import upload_to_cloud
+
+# Runs the attempts of hedged generations, a hedged job uses up to two threads
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=2 * Config.JOB_WORKERS, thread_name_prefix="aider-hedge"
+)
+
+
+# Utility method to build the key of identical generation requests
+def coalesce_key(
+    model_name,
+    directory=None,
+    context=None,
+    instruction=None,
+    code_template=None,
+    files=None,
+    options=None,
+    base_job_id=None,
+):
+    """
+    Build the key under which identical requests share one in-flight job: the
+    model, the built instruction and the reference file digests (as in the
+    result cache key), all options, the base job of an incremental request and
+    the working directory, since the job's output lands below it.
+    Args:
+        model_name (str): The name of the model to use.
+        directory (str, optional): The working directory of the request.
+        context (str, optional): The context for the code generation.
+        instruction (str, optional): The main instruction for the coder.
+        code_template (str, optional): Code template to guide the generation.
+        files (list, optional): Read-only reference files, relative to the directory or absolute.
+        options (dict, optional): The request options.
+        base_job_id (str, optional): The job an incremental request builds on.
+    Returns:
+        str or None: Hex digest identifying the request, None when coalescing is disabled.
+    """
+    if not Config.COALESCE_ENABLED:
+        return None
+
+    root = os.path.abspath(directory or os.getcwd())
+    digest = hashlib.sha256()
+    digest.update(
+        result_cache.make_key(
+            model_name,
+            build_instruction(context, instruction, code_template, OUTPUT_DIR_PLACEHOLDER),
+            files=[os.path.normpath(os.path.join(root, f)) for f in files or []],
+            options=options,
+        ).encode("utf-8")
+    )
+    digest.update(f"\0{root}\0{base_job_id or ''}\0".encode("utf-8"))
+    digest.update(json.dumps(options or {}, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Utility method to check whether a request will be answered from the result cache
+def is_cached(
+    model_name,
+    directory=None,
+    context=None,
+    instruction=None,
+    code_template=None,
+    files=None,
+    options=None,
+    base_job_id=None,
+):
+    """
+    Look the request up in the result cache before it is submitted, so a job
+    served from the cache skips admission control. Uses the key run_generation
+    looks up; requests whose key is only known while the job runs (context
+    selection over reference files) count as misses.
+    Args:
+        model_name (str): The name of the model to use.
+        directory (str, optional): The working directory of the request.
+        context (str, optional): The context for the code generation.
+        instruction (str, optional): The main instruction for the coder.
+        code_template (str, optional): Code template to guide the generation.
+        files (list, optional): Read-only reference files, relative to the directory or absolute.
+        options (dict, optional): The request options.
+        base_job_id (str, optional): The job an incremental request builds on.
+    Returns:
+        bool: True when the result cache holds the request's result.
+    """
+    options = options or {}
+    if not Config.RESULT_CACHE_ENABLED or options.get("no_cache", False) or base_job_id:
+        return False
+    if files and options.get("context_selection", Config.CONTEXT_SELECTION_ENABLED):
+        return False
+
+    root = os.path.abspath(directory or os.getcwd())
+    try:
+        key = result_cache.make_key(
+            model_name,
+            build_instruction(context, instruction, code_template, OUTPUT_DIR_PLACEHOLDER),
+            files=[os.path.normpath(os.path.join(root, f)) for f in files or []],
+            options=options,
+        )
+    except OSError:
+        # A missing reference file fails the job itself
+        return False
+    return result_cache.contains(key)
+
+
+# Utility method to run one generation attempt on a model
+def run_attempt(model_name, execution, files, options, build, labels, base_dir=None):
+    """
+    Take a coder for the model from the pool, execute the instruction in the
+    execution's output folder and zip the files the attempt wrote.
+    Args:
+        model_name (str): The name of the model to use.
+        execution (ExecutionContext): The context the attempt writes into.
+        files (list): Absolute paths of the read-only reference files.
+        options (dict): The request options.
+        build (callable): Builds the instruction for the attempt's output folder.
+        labels (dict): Metrics labels of the attempt.
+        base_dir (str, optional): Folder of an earlier job. Its project is copied into the
+            output folder and opened for editing, and only new or changed files are zipped.
+    Returns:
+        tuple: (result of the execution, zip result)
+    Raises:
+        GenerationCancelled: The execution was cancelled during the run.
+    """
+    # A separate editor model or parallel editors need an architect coder planning the edits
+    editor_model = options.get("editor_model", Config.EDITOR_MODEL)
+    parallel_editor = options.get("parallel_editor", Config.PARALLEL_EDITOR_ENABLED)
+
+    # Start from a copy of the earlier job's project
+    snapshot = None
+    if base_dir:
+        with stage_timer("load_base", labels):
+            snapshot = seed_output(base_dir, execution.output_dir)
+
+    # Take a warm coder from the pool, or create one on a miss
+    with stage_timer("create_coder", labels):
+        coder = coder_pool.acquire(
+            model_name=model_name,
+            files=files,
+            auto_commits=options.get("auto_commits", False),
+            dirty_commits=options.get("dirty_commits", False),
+            dry_run=options.get("dry_run", False),
+            execution=execution,
+            edit_format="architect" if editor_model or parallel_editor else None,
+            edit_files=sorted(snapshot) if snapshot is not None else None,
+        )
+
+    # Build complete instruction
+    full_instruction = build(execution.output_dir)
+
+    # Execute the instruction, the coder only goes back to the pool after a clean run
+    started = time.perf_counter()
+    try:
+        result = execute_instruction(
+            coder,
+            full_instruction,
+            editor_model=editor_model,
+            parallel_editor=parallel_editor,
+        )
+    finally:
+        record_tokens(execution.usage, labels)
+    run_seconds = time.perf_counter() - started
+    observe_stage("architect", run_seconds - coder.editor_seconds, labels)
+    observe_stage("editor", coder.editor_seconds, labels)
+    coder_pool.release(coder)
+
+    # Zip exactly the files this job wrote, as recorded by its IO, without the unchanged copies
+    written = execution.manifest()
+    if snapshot is not None:
+        written = changed_files(snapshot, written)
+    with stage_timer("create_zip_file", labels):
+        zip_result = create_zip_file(execution.output_dir, written)
+    if zip_result.get("size"):
+        ZIP_BYTES_TOTAL.labels(**labels).inc(zip_result["size"])
+
+    return result, zip_result
+
+
+# Utility method to run a generation on a second model when the first one is slow
+def run_hedged(
+    model_name,
+    hedge_model,
+    hedge_delay,
+    execution,
+    files,
+    options,
+    build,
+    labels,
+    base_dir=None,
+    on_event=None,
+):
+    """
+    Run the generation on the primary model and, if it has not finished after
+    `hedge_delay` seconds, also on the hedge model in a job folder of its own.
+    The first attempt to succeed wins, the other one is cancelled and its
+    folder removed. The hedge only starts when the hedge model can admit it
+    right away, so hedging never queues behind a busy model.
+    Args:
+        model_name (str): The primary model, already admitted by the job.
+        hedge_model (str): The model the request is hedged on.
+        hedge_delay (float): Seconds to wait for the primary model before hedging.
+        execution (ExecutionContext): The job's context, used by the primary attempt.
+        files (list): Absolute paths of the read-only reference files.
+        options (dict): The request options.
+        build (callable): Builds the instruction for an attempt's output folder.
+        labels (dict): Metrics labels of the job.
+        base_dir (str, optional): Folder of the earlier job of an incremental request.
+        on_event (callable, optional): Receives (event, data) for streamed output. The primary
+            attempt streams as it runs, the hedge attempt's output follows once it wins.
+    Returns:
+        tuple: (result, zip result, winning model, winning execution, hedge report)
+    """
+    # The attempts add their stage timings to the job's
+    stages = stage_target()
+    attempts = [
+        {
+            "model": model_name,
+            "execution": execution,
+            "future": _hedge_executor.submit(
+                _run_collecting,
+                stages,
+                run_attempt,
+                model_name,
+                execution,
+                files,
+                options,
+                build,
+                labels,
+                base_dir,
+            ),
+        }
+    ]
+    report = {"model": hedge_model, "delay": hedge_delay, "started": False, "winner": model_name}
+
+    done, _ = wait([attempts[0]["future"]], timeout=hedge_delay)
+    if done:
+        HEDGES_TOTAL.labels(outcome="not_needed", **labels).inc()
+    else:
+        hedge_labels = {**labels, "model": hedge_model}
+        try:
+            ticket = admission_controller.admit(
+                hedge_model,
+                estimate_tokens({"instruction": build(execution.output_dir)}),
+                timeout=0,
+            )
+            ticket.acquire()
+        except (AdmissionRejected, ValueError) as e:
+            print(f"Hedge on {hedge_model} skipped: {str(e)}")
+            HEDGES_TOTAL.labels(outcome="skipped", **labels).inc()
+        else:
+            print(f"Model {model_name} slower than {hedge_delay:g}s, hedging on {hedge_model}")
+            report["started"] = True
+            if on_event:
+                on_event("log", {"level": "info", "text": f"Hedging on {hedge_model}"})
+            # The primary attempt streams live, the hedge attempt's events are kept
+            # and only sent once it wins
+            events = []
+            hedge_execution = ExecutionContext(
+                execution.root,
+                job_id=f"{execution.job_id}-hedge",
+                on_event=(lambda event, data: events.append((event, data))) if on_event else None,
+                poll=execution.poll,
+            )
+            future = _hedge_executor.submit(
+                _run_hedge_attempt,
+                stages,
+                ticket,
+                hedge_model,
+                hedge_execution,
+                files,
+                options,
+                build,
+                hedge_labels,
+                base_dir,
+            )
+
+            # Cancelling the job stops the hedge too
+            job = current_job()
+            if job:
+                job.on_cancel(hedge_execution.cancel)
+            attempts.append(
+                {"model": hedge_model, "execution": hedge_execution, "future": future, "events": events}
+            )
+
+    # The first attempt to succeed wins, a failed attempt leaves the race to the other one
+    winner = None
+    pending = {attempt["future"]: attempt for attempt in attempts}
+    while pending and winner is None:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            attempt = pending.pop(future)
+            if winner is None and future.exception() is None:
+                winner = attempt
+
+    if winner is None:
+        raise attempts[0]["future"].exception()
+
+    # Stop the loser at its next model call, streamed chunk or write and drop its folder
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt["execution"].cancel()
+            attempt["future"].add_done_callback(
+                lambda _, execution=attempt["execution"]: execution.discard()
+            )
+
+    if report["started"]:
+        report["winner"] = winner["model"]
+        outcome = "primary" if winner is attempts[0] else "fallback"
+        HEDGES_TOTAL.labels(outcome=outcome, **labels).inc()
+        print(f"Hedged generation won by {winner['model']}")
+
+    # The hedge attempt is over, hand its output to the stream
+    if on_event and "events" in winner:
+        on_event("log", {"level": "info", "text": f"Hedge on {winner['model']} won, its output follows"})
+        for event, data in winner["events"]:
+            on_event(event, data)
+
+    result, zip_result = winner["future"].result()
+    return result, zip_result, winner["model"], winner["execution"], report
+
+
+def _run_collecting(stages, func, *args):
+    # Run an attempt on a hedge thread, recording its stages into the job's timings
+    with collect_stages(stages):
+        return func(*args)
+
+
+def _run_hedge_attempt(stages, ticket, model_name, execution, *args):
+    # The hedge attempt holds the hedge model's slot and pins its folder while it runs,
+    # a cancelled hedge also removes its folder on the way out
+    with ExitStack() as stack:
+        stack.callback(ticket.release)
+        stack.enter_context(execution)
+        return _run_collecting(stages, run_attempt, model_name, execution, *args)
+
+
+# Utility method to run a full generation pipeline
+@recoverable
+def run_generation(
+    model_name,
+    context=None,
+    instruction=None,
+    code_template=None,
+    directory=None,
+    options=None,
+    files=None,
+    require_output=False,
+    upload=False,
+    on_event=None,
+    base_job_id=None,
+):
+    """
+    Run one generation end to end: create the job context, take a coder from the pool,
+    execute the instruction and zip the files the job wrote. Identical
+    requests are answered from the result cache.
+    This is the unit of work executed by the job workers.
+    Args:
+        model_name (str): The name of the model to use.
+        context (str, optional): The context for the code generation.
+        instruction (str, optional): The main instruction for the coder.
+        code_template (str, optional): Code template to guide the generation.
+        directory (str, optional): The working directory for code generation.
+        options (dict, optional): Additional options like auto_commits, dirty_commits, dry_run,
+            no_cache (skip the result cache), context_selection, context_budget,
+            hedge_model and hedge_delay (see run_hedged), editor_model and parallel_editor.
+        files (list, optional): List of filenames to be read-only.
+        require_output (bool): Raise a ValueError when no new files were generated.
+        upload (bool): Queue the created zip file for upload to cloud storage.
+        on_event (callable, optional): Receives (event, data) for streamed output.
+        base_job_id (str, optional): Regenerate on top of this earlier job's output: its
+            project is opened for editing, only the change is sent and only new or
+            changed files are zipped.
+    Returns:
+        dict: Response containing execution result, status, and output directory info.
+    """
+
+    options = options or {}
+
+    # Give the job its own absolute root and output folder, the process cwd is never changed
+    job = current_job()
+    labels = job_labels(job, model_name)
+    with stage_timer("setup_directory", labels):
+        execution = ExecutionContext(
+            directory,
+            job_id=job.id if job else None,
+            on_event=on_event,
+            poll=job.poll_cancel if job else None,
+        )
+
+    # A cancel request or the job's deadline stops the run at its next model call or chunk
+    if job:
+        job.on_cancel(execution.cancel)
+
+    # Keep the job folder from retention until the job is over
+    with execution:
+        files = [execution.resolve(f) for f in files or []]
+        files_processed = [os.path.basename(f) for f in files]
+
+        # Send only what changed since the base job, its project is edited in place
+        base_dir = None
+        incremental = None
+        if base_job_id:
+            base_dir = find_base_output(execution.base_output_dir, base_job_id)
+            incremental = prepare_incremental(
+                base_job_id, files, context, instruction, code_template
+            )
+            files = incremental.pop("files")
+            change = incremental.pop("change")
+
+            def build(output_dir):
+                return build_edit_instruction(change, output_dir)
+
+        else:
+
+            def build(output_dir):
+                return build_instruction(context, instruction, code_template, output_dir)
+
+        # Pass only the reference chunks relevant to the request when selection is on
+        context_selection = None
+        if files and options.get("context_selection", Config.CONTEXT_SELECTION_ENABLED):
+            with stage_timer("select_context", labels):
+                context_selection = select_context(
+                    files,
+                    "\n".join(part for part in (context, instruction, code_template) if part),
+                    int(options.get("context_budget", Config.CONTEXT_TOKEN_BUDGET)),
+                    Config.CONTEXT_CHUNK_TOKENS,
+                    os.path.join(execution.output_dir, ".references"),
+                )
+            CONTEXT_TOKENS_TOTAL.labels(kind="original", **labels).inc(
+                context_selection["original_tokens"]
+            )
+            CONTEXT_TOKENS_TOTAL.labels(kind="selected", **labels).inc(
+                context_selection["selected_tokens"]
+            )
+            print(
+                f"Context selection kept {context_selection['chunks_selected']}/{context_selection['chunks']} chunks, "
+                f"{context_selection['selected_tokens']}/{context_selection['original_tokens']} tokens "
+                f"(saved {context_selection['saved_tokens']})"
+            )
+            files = context_selection.pop("files")
+
+        # Serve identical requests from the result cache unless the client opted out
+        cache_key = None
+        cached = None
+        model_used = model_name
+        hedge = None
+        # Incremental results depend on the base job's output and are not cached
+        if Config.RESULT_CACHE_ENABLED and not options.get("no_cache", False) and not base_job_id:
+            cache_key = result_cache.make_key(
+                model_name,
+                build_instruction(
+                    context, instruction, code_template, OUTPUT_DIR_PLACEHOLDER
+                ),
+                files=files,
+                options=options,
+            )
+            cached = result_cache.restore(cache_key, execution.output_dir)
+            CACHE_LOOKUPS_TOTAL.labels(result="hit" if cached else "miss", **labels).inc()
+
+        if cached:
+            print(f"Result cache hit: {cache_key}")
+            result = cached["response"]
+            zip_result = cached["zip_result"]
+        else:
+            # Submitted as a cache hit without admission, but the entry is gone by now
+            if job is not None and job.deferred_admission:
+                job.admit_deferred()
+
+            # Hedge on a second model when the primary one is slow, unless it is the same model
+            hedge_model = options.get("hedge_model", Config.HEDGE_MODEL)
+            if hedge_model and hedge_model != model_name:
+                # The winning attempt's context holds the usage and files reported below
+                result, zip_result, model_used, execution, hedge = run_hedged(
+                    model_name,
+                    hedge_model,
+                    float(options.get("hedge_delay", Config.HEDGE_DELAY)),
+                    execution,
+                    files,
+                    options,
+                    build,
+                    labels,
+                    base_dir=base_dir,
+                    on_event=on_event,
+                )
+            else:
+                result, zip_result = run_attempt(
+                    model_name, execution, files, options, build, labels, base_dir
+                )
+
+            if incremental is not None:
+                incremental["files_changed"] = len(zip_result.get("files", []))
+
+            # Only results of the requested model are cached under its key
+            if cache_key and model_used == model_name and zip_result.get("status", False):
+                result_cache.store(cache_key, result, zip_result["zip_path"])
+
+        if on_event:
+            on_event(
+                "archive",
+                {
+                    "output_directory": zip_result.get("output_dir"),
+                    "zip_path": zip_result.get("zip_path"),
+                    "files_generated": zip_result.get("files", []),
+                    "zip_size": zip_result.get("size"),
+                    "zip_sha256": zip_result.get("sha256"),
+                    "created": zip_result.get("status", False),
+                    "cached": bool(cached),
+                },
+            )
+
+        # Return error if zip creation failed
+        if require_output and not zip_result.get("status", False):
+            raise ValueError("No new files were generated, zip file not created.")
+
+        # Upload zip file to cloud storage in the background, the response does not wait for it
+        upload_task = None
+        zip_path = zip_result.get("zip_path")
+        if upload and zip_path:
+            upload_task = upload_to_cloud(zip_path, labels=labels)
+            if job:
+                job.upload = upload_task
+
+        return {
+            "response": result,
+            "status": 201,
+            "directory": directory,
+            "files_processed": files_processed,
+            "model_used": model_used,
+            "output_directory": zip_result.get("output_dir"),
+            "zip_path": zip_result.get("zip_path"),
+            "files_generated": zip_result.get("files", []),
+            "zip_size": zip_result.get("size"),
+            "zip_sha256": zip_result.get("sha256"),
+            "cached": bool(cached),
+            "token_usage": execution.usage,
+            "context_selection": context_selection,
+            "hedge": hedge,
+            "incremental": incremental,
+            "upload": upload_task.to_dict() if upload_task else None,
+        }
@@ -0,0 +1,253 @@
+import os
+import re
+import shutil
+import difflib
+import hashlib
+from utils.file_store_utils import file_store
+from utils.job_utils import job_manager
+from utils.retention_utils import retention_manager
+
+# Job ids are uuid4 hex strings, see Job
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# Request fields compared with the base job's request
+SPEC_FIELDS = ("context", "instruction", "code_template")
+
+
+# Utility method to hash a file
+def file_digest(path):
+    """
+    Compute the SHA-256 digest of a file, in chunks.
+    Args:
+        path (str): Path of the file.
+    Returns:
+        str: Hex digest, the file id of the same content in the file store.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Utility method to find the job folder of an earlier job
+def find_base_output(base_output_dir, base_job_id):
+    """
+    Locate the output of the job an incremental regeneration builds on.
+    Args:
+        base_output_dir (str): The `output` folder of the request's directory.
+        base_job_id (str): Id of the earlier job.
+    Returns:
+        str: Absolute path of the earlier job's folder.
+    Raises:
+        ValueError: The id is invalid, the job did not succeed or its output is gone.
+    """
+    if not isinstance(base_job_id, str) or not JOB_ID_PATTERN.fullmatch(base_job_id):
+        raise ValueError(f"Invalid base_job_id: {base_job_id}")
+
+    job = job_manager.get(base_job_id)
+    if job is not None and job.status != "succeeded":
+        raise ValueError(f"Base job {base_job_id} is {job.status}, only succeeded jobs can be extended")
+
+    # The output of a hedged job may be in the folder of its hedge attempt, see run_hedged
+    for name in (base_job_id, f"{base_job_id}-hedge"):
+        path = os.path.join(base_output_dir, name)
+        if os.path.isdir(path):
+            return path
+
+    raise ValueError(
+        f"Output of base job {base_job_id} not found in {base_output_dir}, "
+        "it may have been removed by retention"
+    )
+
+
+# Utility method to describe how a request differs from the base job's request
+def prepare_incremental(base_job_id, files, context=None, instruction=None, code_template=None):
+    """
+    Work out what changed since the base job. Request fields the base job also
+    sent are reduced to a unified diff, or left out when unchanged; fields of
+    an unknown base request are sent whole. Reference files with the same
+    content as a reference of the base job (see its `file_ids`) are dropped,
+    the project already reflects them; a changed reference whose previous
+    version is still in the file store is sent as a diff.
+    Args:
+        base_job_id (str): Id of the earlier job.
+        files (list): Absolute paths of the request's read-only reference files.
+        context (str, optional): The context of the request.
+        instruction (str, optional): The instruction of the request.
+        code_template (str, optional): The code template of the request.
+    Returns:
+        dict: change (markdown text), files (references still passed whole) and
+        counts of the fields and references that were left out or diffed.
+    Raises:
+        ValueError: Nothing changed compared to the base job.
+    """
+    job = job_manager.get(base_job_id)
+    base = job.payload if job is not None else None
+
+    parts = []
+    unchanged_fields = 0
+    values = {"context": context, "instruction": instruction, "code_template": code_template}
+    for field in SPEC_FIELDS:
+        new = values[field] or ""
+        old = base.get(field) if base is not None else None
+        title = field.replace("_", " ").upper()
+        if old is None:
+            if new:
+                parts.append(f"## {title}\n{new}\n")
+        elif (old or "") == new:
+            unchanged_fields += 1
+        else:
+            parts.append(f"## {title} CHANGES\n```diff\n{text_diff(old or '', new, field)}\n```\n")
+
+    references = reference_changes(base, files)
+    parts.extend(references["diffs"])
+    if not parts and not references["files"]:
+        raise ValueError(f"The request does not change anything compared to base job {base_job_id}")
+
+    return {
+        "base_job_id": base_job_id,
+        "base_request_known": base is not None,
+        "change": "\n".join(parts),
+        "files": references["files"],
+        "unchanged_fields": unchanged_fields,
+        "references_unchanged": references["unchanged"],
+        "references_diffed": len(references["diffs"]),
+    }
+
+
+# Utility method to compare the reference files with the base job's
+def reference_changes(base, files):
+    """
+    Split reference files into unchanged ones, changed ones with a diff against
+    the base job's version and ones that are passed whole.
+    Args:
+        base (dict or None): Payload of the base job.
+        files (list): Absolute paths of the reference files.
+    Returns:
+        dict: files (passed whole), diffs (markdown sections) and unchanged (count).
+    """
+    base_ids = set((base or {}).get("file_ids") or [])
+    if not base_ids:
+        return {"files": list(files), "diffs": [], "unchanged": 0}
+
+    # Previous versions by name, as long as the store still has them
+    previous = {}
+    for file_id in base_ids:
+        meta = file_store.get(file_id)
+        if meta:
+            previous[meta["filename"]] = file_id
+
+    remaining = []
+    diffs = []
+    unchanged = 0
+    for path in files:
+        if file_digest(path) in base_ids:
+            unchanged += 1
+            continue
+
+        name = os.path.basename(path)
+        diff = None
+        if name in previous:
+            diff = stored_file_diff(previous[name], path, name)
+        if diff is None:
+            remaining.append(path)
+        else:
+            diffs.append(f"## REFERENCE FILE CHANGES: {name}\n```diff\n{diff}\n```\n")
+
+    return {"files": remaining, "diffs": diffs, "unchanged": unchanged}
+
+
+# Utility method to diff a stored file against its new version
+def stored_file_diff(file_id, path, name):
+    """
+    Diff the previous version of a reference file, kept in the file store, with its new version.
+    Args:
+        file_id (str): Id of the previous version in the file store.
+        path (str): Path of the new version.
+        name (str): Name of the file shown in the diff.
+    Returns:
+        str or None: The unified diff, None when the previous version is gone or not text.
+    """
+    try:
+        old_path = file_store.acquire([file_id])[0]
+    except KeyError:
+        return None
+
+    try:
+        with open(old_path, "r", encoding="utf-8") as f:
+            old = f.read()
+        with open(path, "r", encoding="utf-8") as f:
+            new = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+    finally:
+        file_store.release([file_id])
+
+    return text_diff(old, new, name)
+
+
+# Utility method to diff two texts
+def text_diff(old, new, name):
+    """
+    Build a unified diff of two texts.
+    Args:
+        old (str): The previous text.
+        new (str): The new text.
+        name (str): Name shown in the diff header.
+    Returns:
+        str: The unified diff.
+    """
+    return "\n".join(
+        difflib.unified_diff(
+            old.splitlines(), new.splitlines(), f"previous/{name}", f"new/{name}", lineterm=""
+        )
+    )
+
+
+# Utility method to copy an earlier job's project into a new job folder
+def seed_output(base_dir, output_dir):
+    """
+    Copy the project files of an earlier job folder into the new job's folder,
+    leaving out its zip files and selected reference excerpts.
+    Args:
+        base_dir (str): Folder of the earlier job.
+        output_dir (str): Folder of the new job.
+    Returns:
+        dict: SHA-256 digest of every copied file, by its path in the new folder.
+    """
+    snapshot = {}
+
+    # Keep the base folder from retention while it is copied
+    retention_manager.pin(base_dir)
+    try:
+        for root, dirs, names in os.walk(base_dir):
+            if root == base_dir:
+                dirs[:] = [d for d in dirs if d != ".references"]
+                names = [n for n in names if not n.endswith(".zip")]
+
+            for name in names:
+                source = os.path.join(root, name)
+                target = os.path.join(output_dir, os.path.relpath(source, base_dir))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(source, target)
+                snapshot[target] = file_digest(target)
+    finally:
+        retention_manager.unpin(base_dir)
+
+    return snapshot
+
+
+# Utility method to find the files a regeneration changed
+def changed_files(snapshot, files):
+    """
+    Keep the written files that are new or differ from the copied base project.
+    Args:
+        snapshot (dict): Digests of the copied files, from seed_output.
+        files (list): Absolute paths of the files the job wrote.
+    Returns:
+        list: The new and changed files.
+    """
+    return [
+        f for f in files if not os.path.isfile(f) or snapshot.get(f) != file_digest(f)
+    ]
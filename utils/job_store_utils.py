@@ -0,0 +1,339 @@
+import os
+import json
+import uuid
+import socket
+import sqlite3
+import threading
+from config import Config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    model TEXT,
+    status TEXT NOT NULL,
+    owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    payload TEXT,
+    call TEXT,
+    http_status INTEGER,
+    result TEXT,
+    error TEXT,
+    retry_after INTEGER,
+    cancel_requested TEXT,
+    stages TEXT,
+    output_dir TEXT,
+    zip_path TEXT,
+    manifest TEXT,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_unfinished ON jobs (status) WHERE status IN ('queued', 'running');
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id);
+CREATE TABLE IF NOT EXISTS output_roots (
+    path TEXT PRIMARY KEY
+);
+"""
+
+# Columns stored as JSON text
+JSON_COLUMNS = ("payload", "call", "result", "stages", "manifest")
+
+# Columns added after the first version of the schema, with their type
+ADDED_COLUMNS = {"cancel_requested": "TEXT"}
+
+
+class JobStore:
+    """
+    Durable record of the generation jobs in SQLite, in WAL mode so status
+    lookups never wait for the writers. Every state transition of a job is
+    written with its payload, stage timings, result, output manifest and
+    archive path, so jobs can be looked up after a restart and by the other
+    worker processes of the server. Each job row names its owner process;
+    jobs left queued or running by a process that is gone are recovered on
+    startup, see JobManager.recover. Any process can ask for a job to be
+    cancelled, the owner polls for the request while the job runs.
+    """
+
+    def __init__(self, path=None, enabled=None):
+        self.enabled = enabled if enabled is not None else Config.JOB_STORE_ENABLED
+        self.path = os.path.abspath(path or Config.JOB_STORE_PATH)
+        self._tokens = {}
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def insert(self, job, call=None):
+        """
+        Record a new job, or a recovered job queued again under its id.
+        Args:
+            job (Job): The queued job.
+            call (dict, optional): Function and arguments to run the job again, see JobManager.
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+
+        row = self._row(job)
+        row.update(owner=self._owner(), call=_dump(call))
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{name}" for name in row)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in row if name != "id")
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT INTO jobs ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                row,
+            )
+            conn.execute(
+                "INSERT INTO job_events (job_id, status, at) VALUES (?, ?, ?)",
+                (job.id, job.status, job.created_at),
+            )
+
+    def update(self, job, at):
+        """
+        Record a state transition of a job.
+        Args:
+            job (Job): The job in its new state.
+            at (float): Time of the transition.
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+
+        row = self._row(job)
+        for name in ("kind", "model", "payload", "created_at"):
+            del row[name]
+        assignments = ", ".join(f"{name} = :{name}" for name in row if name != "id")
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = :id", row)
+            conn.execute(
+                "INSERT INTO job_events (job_id, status, at) VALUES (?, ?, ?)",
+                (job.id, job.status, at),
+            )
+
+    def get(self, job_id):
+        """
+        Look up a job by id, through the primary key index.
+        Args:
+            job_id (str): The job id.
+        Returns:
+            dict or None: The stored job with its state transitions, None when unknown.
+        """
+        if not self.enabled:
+            return None
+
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        for name in JSON_COLUMNS:
+            job[name] = _load(job[name])
+        job["events"] = [
+            {"status": status, "at": at}
+            for status, at in conn.execute(
+                "SELECT status, at FROM job_events WHERE job_id = ? ORDER BY rowid", (job_id,)
+            )
+        ]
+        return job
+
+    def request_cancel(self, job_id, reason="cancelled"):
+        """
+        Ask the process running a job to cancel it.
+        Args:
+            job_id (str): The job id.
+            reason (str): `cancelled` or `timed_out`.
+        Returns:
+            bool: True when the job is queued or running, False when it is unknown or finished.
+        """
+        if not self.enabled:
+            return False
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (reason, job_id),
+            )
+        return cursor.rowcount == 1
+
+    def cancel_requested(self, job_id):
+        """
+        Check whether another process asked for a job to be cancelled.
+        Args:
+            job_id (str): The job id.
+        Returns:
+            str or None: The reason of the cancel request, None when there is none.
+        """
+        if not self.enabled:
+            return None
+
+        row = self._connect().execute(
+            "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_output_root(self, path):
+        """
+        Remember an `output` folder jobs wrote into, so retention still sweeps it after a restart.
+        Args:
+            path (str): Absolute path of the folder.
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO output_roots (path) VALUES (?)", (path,))
+
+    def output_roots(self):
+        """
+        List the `output` folders recorded with add_output_root.
+        Returns:
+            list: Absolute paths.
+        """
+        if not self.enabled:
+            return []
+
+        return [row[0] for row in self._connect().execute("SELECT path FROM output_roots")]
+
+    def orphans(self):
+        """
+        List the queued and running jobs of processes that are gone.
+        Returns:
+            list: Stored jobs, oldest first.
+        """
+        if not self.enabled:
+            return []
+
+        rows = self._connect().execute(
+            "SELECT id, owner FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        return [self.get(job_id) for job_id, owner in rows if not self._owner_alive(owner)]
+
+    def claim(self, job):
+        """
+        Take over an orphaned job, unless another process claimed it first.
+        Args:
+            job (dict): The stored job, as returned by orphans.
+        Returns:
+            bool: True when this process now owns the job.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET owner = ?, attempts = attempts + 1 "
+                "WHERE id = ? AND owner IS ? AND status IN ('queued', 'running')",
+                (self._owner(), job["id"], job["owner"]),
+            )
+        return cursor.rowcount == 1
+
+    def stats(self):
+        """
+        Report the location and size of the store.
+        Returns:
+            dict: Enabled flag, path and size of the database and its write-ahead log.
+        """
+        size = 0
+        for suffix in ("", "-wal"):
+            try:
+                size += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return {"enabled": self.enabled, "path": self.path, "bytes": size}
+
+    def _connect(self):
+        # One connection per thread and process, connections must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.executescript(SCHEMA)
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for name, kind in ADDED_COLUMNS.items():
+                    if name not in columns:
+                        try:
+                            conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+                        except sqlite3.OperationalError:
+                            # Added by another process meanwhile
+                            pass
+                self._schema_ready = True
+
+        # Statements run in autocommit mode, `with conn` groups them in a transaction
+        conn.isolation_level = "DEFERRED"
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _owner(self):
+        # "<host>:<pid>:<token>", the token tells a restarted process from its predecessor
+        # with the same pid, as in a container. Each forked worker gets its own.
+        pid = os.getpid()
+        token = self._tokens.setdefault(pid, uuid.uuid4().hex[:8])
+        return f"{socket.gethostname()}:{pid}:{token}"
+
+    def _owner_alive(self, owner):
+        # Processes on other hosts are assumed to be alive
+        host, pid, _ = (owner or "::").rsplit(":", 2)
+        if host != socket.gethostname():
+            return bool(host)
+        if not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            return owner == self._owner()
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _row(self, job):
+        result = job.result if isinstance(job.result, dict) else {}
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "model": job.model,
+            "status": job.status,
+            "payload": _dump(job.payload),
+            "http_status": job.http_status,
+            "result": _dump(job.result),
+            "error": job.error,
+            "retry_after": job.retry_after,
+            "stages": _dump(job.stages),
+            "output_dir": result.get("output_directory"),
+            "zip_path": result.get("zip_path"),
+            "manifest": _dump(result.get("files_generated")),
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+
+def _dump(value):
+    return json.dumps(value, default=str) if value is not None else None
+
+
+def _load(value):
+    return json.loads(value) if value is not None else None
+
+
+# Shared job store used by the job manager
+job_store = JobStore()
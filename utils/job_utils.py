@@ -0,0 +1,955 @@
+import json
+import math
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from utils.admission_utils import (
+    AdmissionRejected,
+    admission_controller,
+    estimate_tokens,
+    is_rate_limit_error,
+)
+from utils.context_utils import GenerationCancelled
+from utils.job_store_utils import job_store
+from utils.metrics_utils import (
+    COALESCED_TOTAL,
+    ERRORS_TOTAL,
+    collect_stages,
+    job_labels,
+    observe_stage,
+    record_job,
+)
+from utils.stream_utils import sse_response
+
+# Seconds clients are asked to wait after a provider rate limit error
+RATE_LIMIT_RETRY_AFTER = 60
+
+# Job currently executed by the calling worker thread
+_current = threading.local()
+
+# Job functions that can run again after a restart, by qualified name, see recoverable
+_recoverable = {}
+
+# Error of jobs that were interrupted by a restart and not queued again
+INTERRUPTED_ERROR = "Interrupted by a server restart"
+
+# HTTP status of jobs stopped by a cancel request or by their deadline
+CANCEL_STATUSES = {"cancelled": 409, "timed_out": 504}
+
+# Seconds between checks for cancel requests made by other worker processes
+CANCEL_POLL_INTERVAL = 1.0
+
+
+class Job:
+    """
+    A single unit of generation work executed by the JobManager.
+    Holds the job state and the (body, http_status) result of the run,
+    its state transitions (events) and the seconds spent in each stage.
+    cancel() asks the running work to stop, see on_cancel; poll_cancel() picks
+    up cancel requests other processes recorded in the job store. on_done()
+    callbacks run once the job has finished, however it ended.
+    """
+
+    def __init__(self, kind, payload=None, model=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.model = model
+        self.payload = payload or {}
+        self.status = "queued"
+        self.result = None
+        self.http_status = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.upload = None
+        self.admission = None
+        self.admission_error = None
+        self.deferred_admission = None
+        self.retry_after = None
+        self.coalesce_key = None
+        self.followers = 0
+        self.deadline = None
+        self.cancel_reason = None
+        self.stages = {}
+        self.events = [{"status": "queued", "at": self.created_at}]
+        self._done = threading.Event()
+        self._cancel_callbacks = []
+        self._done_callbacks = []
+        self._cancel_lock = threading.Lock()
+        self._cancel_source = None
+        self._polled_at = 0.0
+
+    @classmethod
+    def from_stored(cls, stored):
+        """
+        Rebuild a job from its record in the job store, e.g. a job run before a
+        restart or by another worker process.
+        Args:
+            stored (dict): The stored job, as returned by JobStore.get.
+        Returns:
+            Job: The job, marked done when it has finished.
+        """
+        job = cls(stored["kind"], stored["payload"], stored["model"], job_id=stored["id"])
+        for name in (
+            "status",
+            "result",
+            "http_status",
+            "error",
+            "retry_after",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ):
+            setattr(job, name, stored[name])
+        job.stages = stored["stages"] or {}
+        job.events = stored["events"]
+        job.cancel_reason = stored.get("cancel_requested")
+        if job.status not in ("queued", "running"):
+            job._done.set()
+        return job
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the job has finished.
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (wait forever).
+        Returns:
+            bool: True if the job finished, False if the timeout expired.
+        """
+        return self._done.wait(timeout)
+
+    def on_cancel(self, callback):
+        """
+        Register a callback stopping part of the job's work, e.g. ExecutionContext.cancel.
+        It is called right away when the job is already cancelled.
+        Args:
+            callback (callable): Called without arguments, from the cancelling thread.
+        Returns:
+            None
+        """
+        with self._cancel_lock:
+            if self.cancel_reason is None:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def admit_deferred(self):
+        """
+        Take the admission a job skipped because it was expected to be answered from
+        the result cache, when it has to call the model after all. Blocks the worker
+        until the model admits the job.
+        Returns:
+            None
+        Raises:
+            AdmissionRejected: The model's queue is full or the job waited too long.
+            GenerationCancelled: The job was cancelled while it waited.
+        """
+        model_name, tokens = self.deferred_admission
+        self.deferred_admission = None
+        started = time.perf_counter()
+        self.admission = admission_controller.admit(model_name, tokens)
+        if self.cancel_reason:
+            raise GenerationCancelled("Generation cancelled")
+        try:
+            self.admission.acquire(poll=self.poll_cancel)
+        finally:
+            observe_stage("admission", time.perf_counter() - started, job_labels(self))
+
+    def on_done(self, callback):
+        """
+        Register a callback run once the job has finished, also when it failed before
+        its function was called (admission rejected, cancelled while queued).
+        It is called right away when the job has already finished.
+        Args:
+            callback (callable): Called without arguments, from the worker thread.
+        Returns:
+            None
+        """
+        with self._cancel_lock:
+            if not self.done:
+                self._done_callbacks.append(callback)
+                return
+        callback()
+
+    def poll_cancel(self, force=False):
+        """
+        Cancel the job when another process asked for it, checking the job store
+        at most every CANCEL_POLL_INTERVAL seconds. Called where the job checks
+        for cancellation: model calls, streamed chunks, writes, admission waits.
+        Args:
+            force (bool): Check now, regardless of the last check.
+        Returns:
+            None
+        """
+        if self._cancel_source is None or self.cancel_reason is not None:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._polled_at < CANCEL_POLL_INTERVAL:
+            return
+        self._polled_at = now
+
+        try:
+            reason = self._cancel_source(self.id)
+        except sqlite3.Error as e:
+            print(f"Error reading cancel request of job {self.id}: {str(e)}")
+            return
+        if reason:
+            self.cancel(reason)
+
+    def cancel(self, reason="cancelled"):
+        """
+        Ask the job to stop. A queued job leaves its admission queue, a running job
+        stops at its next model call, streamed chunk or file write.
+        Args:
+            reason (str): `cancelled` or `timed_out`, the status the job ends with.
+        Returns:
+            bool: False when the job had already finished or was cancelled before.
+        """
+        with self._cancel_lock:
+            if self.done or self.cancel_reason is not None:
+                return False
+            self.cancel_reason = reason
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+
+        print(f"Cancelling job {self.id} ({reason})")
+        if self.admission:
+            self.admission.withdraw()
+        for callback in callbacks:
+            callback()
+        return True
+
+    def to_dict(self):
+        """
+        Serialize the job into a JSON friendly dictionary.
+        Returns:
+            dict: Job id, kind, status, timings, result (once finished) and upload status.
+        """
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "http_status": self.http_status,
+            "result": self.result,
+            "error": self.error,
+            "retry_after": self.retry_after,
+            "deadline": self.deadline,
+            "cancel_requested": self.cancel_reason,
+            "coalesced_requests": self.followers,
+            "stages": self.stages,
+            "events": self.events,
+            "upload": self.upload.to_dict() if self.upload else None,
+        }
+
+    def _finish(self):
+        # Mark the job done, then run the on_done callbacks
+        with self._cancel_lock:
+            self._done.set()
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in done callback of job {self.id}: {str(e)}")
+
+
+class JobManager:
+    """
+    Runs generation jobs on a bounded pool of worker threads and keeps
+    track of recent jobs so clients can poll for their results. Jobs with an
+    admission ticket first wait for their model's admission on a thread of
+    that model, so a throttled model never holds the shared workers. Every job is
+    also recorded in the job store, so it can still be looked up once it left
+    the history, after a restart or from another worker process.
+    """
+
+    def __init__(self, max_workers=None, history_limit=None, store=None):
+        self.max_workers = max_workers or Config.JOB_WORKERS
+        self.history_limit = history_limit or Config.JOB_HISTORY_LIMIT
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="aider-job"
+        )
+        self.store = store or job_store
+        self._jobs = OrderedDict()
+        self._inflight = {}
+        self._coalesced = 0
+        self._stopped = {reason: 0 for reason in CANCEL_STATUSES}
+        self._admitters = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        kind,
+        func,
+        *args,
+        payload=None,
+        model=None,
+        admission=None,
+        deferred_admission=None,
+        coalesce_key=None,
+        job_id=None,
+        deadline=None,
+        **kwargs,
+    ):
+        """
+        Queue a job for execution on the worker pool.
+        Args:
+            kind (str): Name of the endpoint or task that created the job.
+            func (callable): Function returning the response body for the job.
+            payload (dict, optional): Request payload, kept for inspection.
+            model (str, optional): Model the job calls, used as metrics label.
+            admission (AdmissionTicket, optional): The job's place in its model's admission queue,
+                acquired before the job takes a worker and released when it finishes.
+            deferred_admission (tuple, optional): (model, estimated tokens) of a job expected to
+                be answered from the result cache, admitted only if it calls the model, see
+                Job.admit_deferred.
+            coalesce_key (str, optional): Identifies the work, identical requests can attach
+                to the job with attach() while it is queued or running.
+            job_id (str, optional): Id of a stored job queued again after a restart.
+            deadline (float, optional): Seconds after which the job is cancelled as timed out,
+                defaults to JOB_DEADLINE.
+            *args, **kwargs: Arguments forwarded to func.
+        Returns:
+            Job: The queued job.
+        """
+        job = Job(kind, payload, model, job_id=job_id)
+        job.admission = admission
+        job.deferred_admission = deferred_admission
+        job.coalesce_key = coalesce_key
+        if self.store.enabled:
+            job._cancel_source = self.store.cancel_requested
+
+        # Cancel the job once its deadline passes, the timer is stopped when it finishes
+        deadline = deadline or Config.JOB_DEADLINE
+        timer = None
+        if deadline:
+            job.deadline = job.created_at + deadline
+            timer = threading.Timer(deadline, job.cancel, ("timed_out",))
+            timer.daemon = True
+            timer.start()
+
+        with self._lock:
+            self._jobs[job.id] = job
+            if coalesce_key:
+                self._inflight.setdefault(coalesce_key, job)
+            self._prune()
+
+        self._persist(self.store.insert, job, stored_call(func, args, kwargs))
+        if admission:
+            self._admitter(admission.gate.model_name).submit(
+                self._admit, job, func, args, kwargs, timer
+            )
+        else:
+            self._executor.submit(self._run, job, func, args, kwargs, timer)
+        return job
+
+    def attach(self, coalesce_key):
+        """
+        Find the queued or running job submitted with the same coalesce key,
+        so an identical request shares its result instead of running again.
+        Args:
+            coalesce_key (str): The key the job was submitted with.
+        Returns:
+            Job or None: The in-flight job, counted as having one more follower, or None.
+        """
+        with self._lock:
+            job = self._inflight.get(coalesce_key)
+            if job is None or job.done:
+                return None
+            job.followers += 1
+            self._coalesced += 1
+            return job
+
+    def cancel(self, job_id, reason="cancelled"):
+        """
+        Cancel a queued or running job. A job of another worker process is cancelled
+        through the job store, by its owner at its next cancellation check.
+        Args:
+            job_id (str): The job id returned on submission.
+            reason (str): `cancelled` or `timed_out`.
+        Returns:
+            tuple: (Job or None, bool) the job and whether it runs in this process.
+            The job is None when it is unknown or already finished.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancel(reason)
+            return job, True
+
+        try:
+            if not self.store.request_cancel(job_id, reason):
+                return None, False
+            stored = self.store.get(job_id)
+        except sqlite3.Error as e:
+            print(f"Error requesting cancellation of job {job_id}: {str(e)}")
+            return None, False
+        return (Job.from_stored(stored) if stored else None), False
+
+    def get(self, job_id):
+        """
+        Look up a job by id, in the recent jobs of this process or else in the job store.
+        Args:
+            job_id (str): The job id returned on submission.
+        Returns:
+            Job or None: The job if it is still known, else None.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+
+        try:
+            stored = self.store.get(job_id)
+        except sqlite3.Error as e:
+            print(f"Error reading job {job_id} from the job store: {str(e)}")
+            return None
+        return Job.from_stored(stored) if stored else None
+
+    def recover(self):
+        """
+        Take over the jobs left queued or running by a process that is gone, at startup.
+        With JOB_RECOVERY=requeue a job runs again under its id when its function is
+        recoverable and it has run fewer than JOB_MAX_ATTEMPTS times, other jobs are
+        marked failed so clients polling them get an answer.
+        Returns:
+            dict: Number of requeued and failed jobs.
+        """
+        counts = {"requeued": 0, "failed": 0}
+        try:
+            orphans = self.store.orphans()
+        except sqlite3.Error as e:
+            print(f"Error reading unfinished jobs from the job store: {str(e)}")
+            return counts
+
+        for stored in orphans:
+            # Another worker process may be recovering the same job
+            if not self.store.claim(stored):
+                continue
+
+            job = None
+            # Jobs a client cancelled meanwhile are not run again
+            if (
+                Config.JOB_RECOVERY == "requeue"
+                and stored["attempts"] < Config.JOB_MAX_ATTEMPTS
+                and not stored["cancel_requested"]
+            ):
+                job = self._requeue(stored)
+            if job is None:
+                self._fail_interrupted(stored)
+                counts["failed"] += 1
+            else:
+                counts["requeued"] += 1
+
+        if orphans:
+            print(f"Recovered interrupted jobs: {counts['requeued']} requeued, {counts['failed']} failed")
+        return counts
+
+    def stats(self):
+        """
+        Summarize the jobs currently tracked by the manager.
+        Returns:
+            dict: Worker count, number of jobs per status, requests attached to in-flight
+            jobs and jobs stopped by a cancel request or by their deadline since startup.
+        """
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            coalesced = self._coalesced
+            stopped = dict(self._stopped)
+
+        return {
+            "workers": self.max_workers,
+            "jobs": counts,
+            "coalesced": coalesced,
+            "cancelled": stopped["cancelled"],
+            "timed_out": stopped["timed_out"],
+            "store": self.store.stats(),
+        }
+
+    def drain(self, timeout=None):
+        """
+        Wait for the queued and running jobs to finish, used before the process exits.
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (wait forever).
+        Returns:
+            int: Number of jobs still unfinished when the timeout expired.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            pending = [job for job in self._jobs.values() if not job.done]
+
+        for job in pending:
+            remaining = max(0, deadline - time.time()) if deadline is not None else None
+            job.wait(remaining)
+
+        return sum(1 for job in pending if not job.done)
+
+    def _admitter(self, model_name):
+        # One thread per model takes its jobs through admission in order
+        with self._lock:
+            admitter = self._admitters.get(model_name)
+            if admitter is None:
+                admitter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aider-admit")
+                self._admitters[model_name] = admitter
+            return admitter
+
+    def _admit(self, job, func, args, kwargs, timer):
+        # Wait for the model's slot and budgets, then hand the job to the workers. A rejected
+        # or cancelled job still goes to a worker, which finishes it right away.
+        started = time.perf_counter()
+        try:
+            job.admission.acquire(poll=job.poll_cancel)
+        except Exception as e:
+            job.admission_error = e
+        with collect_stages(job.stages):
+            observe_stage("admission", time.perf_counter() - started, job_labels(job))
+        self._executor.submit(self._run, job, func, args, kwargs, timer)
+
+    def _run(self, job, func, args, kwargs, timer=None):
+        with collect_stages(job.stages):
+            self._execute(job, func, args, kwargs, timer)
+
+    def _execute(self, job, func, args, kwargs, timer):
+        job.status = "running"
+        job.started_at = time.time()
+        self._transition(job, job.started_at)
+        _current.job = job
+        try:
+            # A job cancelled while it was queued never starts
+            job.poll_cancel(force=True)
+            if job.cancel_reason:
+                raise GenerationCancelled("Generation cancelled")
+            if job.admission_error:
+                raise job.admission_error
+            job.result = func(*args, **kwargs)
+            job.http_status = 200
+            job.status = "succeeded"
+
+        except Exception as e:
+            # Whatever a cancelled job raised while stopping, it ends as cancelled
+            if job.cancel_reason:
+                self._record_cancel(job)
+            else:
+                self._record_error(job, e)
+
+        finally:
+            if timer:
+                timer.cancel()
+            if job.admission:
+                job.admission.release()
+            if job.coalesce_key:
+                with self._lock:
+                    if self._inflight.get(job.coalesce_key) is job:
+                        del self._inflight[job.coalesce_key]
+            _current.job = None
+            job.finished_at = time.time()
+            record_job(job)
+            self._transition(job, job.finished_at)
+            job._finish()
+
+    def _record_cancel(self, job):
+        reason = job.cancel_reason
+        if reason == "timed_out":
+            job.error = f"Job exceeded its deadline of {job.deadline - job.created_at:g}s"
+        else:
+            job.error = "Job cancelled"
+        job.result = {"error": job.error, "status": reason}
+        job.http_status = CANCEL_STATUSES[reason]
+        job.status = reason
+        with self._lock:
+            self._stopped[reason] += 1
+
+    def _record_error(self, job, error):
+        if isinstance(error, ValueError):
+            job.error = str(error)
+            job.result = {"ValueError": str(error)}
+            job.http_status = 400
+            job.status = "failed"
+
+        elif isinstance(error, AdmissionRejected):
+            job.error = str(error)
+            job.retry_after = error.retry_after
+            job.result = rejected_body(error)
+            job.http_status = 429
+            job.status = "failed"
+
+        else:
+            print(f"Error in job {job.id} ({job.kind}): {str(error)}")
+            job.error = str(error)
+            job.status = "failed"
+
+            # Provider rate limits are backpressure, not server errors
+            if is_rate_limit_error(error):
+                job.retry_after = RATE_LIMIT_RETRY_AFTER
+                job.result = {"error": str(error), "status": "rate_limited", "retry_after": job.retry_after}
+                job.http_status = 429
+            else:
+                job.result = {"error": str(error), "status": "error"}
+                job.http_status = 500
+
+    def _transition(self, job, at):
+        # Record the job's new status in memory and in the store
+        job.events.append({"status": job.status, "at": at})
+        self._persist(self.store.update, job, at)
+
+    def _persist(self, write, job, *args):
+        # A failing store must not fail the job, it stays available in memory
+        try:
+            write(job, *args)
+        except sqlite3.Error as e:
+            print(f"Error writing job {job.id} to the job store: {str(e)}")
+
+    def _requeue(self, stored):
+        # Queue an interrupted job again under its id, None when it cannot run again
+        call = stored["call"]
+        entry = _recoverable.get(call["func"]) if call else None
+        if entry is None:
+            return None
+
+        func, resume = entry
+        args, kwargs = call["args"], call["kwargs"]
+        admission = None
+        try:
+            if resume:
+                args, kwargs = resume(args, kwargs)
+            if stored["model"]:
+                admission = admission_controller.admit(
+                    stored["model"], estimate_tokens(stored["payload"])
+                )
+        except Exception as e:
+            print(f"Job {stored['id']} cannot run again: {str(e)}")
+            return None
+
+        print(f"Requeuing job {stored['id']} ({stored['kind']}) interrupted by a restart")
+        job = self.submit(
+            stored["kind"],
+            func,
+            *args,
+            payload=stored["payload"],
+            model=stored["model"],
+            admission=admission,
+            job_id=stored["id"],
+            **kwargs,
+        )
+        return job
+
+    def _fail_interrupted(self, stored):
+        job = Job.from_stored(stored)
+        if job.cancel_reason:
+            job.status = job.cancel_reason
+            job.error = "Job cancelled"
+            job.http_status = CANCEL_STATUSES[job.cancel_reason]
+        else:
+            job.status = "failed"
+            job.error = INTERRUPTED_ERROR
+            job.http_status = 500
+        job.result = {"error": job.error, "status": "error" if job.status == "failed" else job.status}
+        job.finished_at = time.time()
+        self._transition(job, job.finished_at)
+
+    def _prune(self):
+        # Drop the oldest finished jobs once the history limit is exceeded
+        excess = len(self._jobs) - self.history_limit
+        if excess <= 0:
+            return
+
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+                excess -= 1
+
+
+# Shared job manager used by all API endpoints
+job_manager = JobManager()
+
+
+# Utility method to register a job function that can run again after a restart
+def recoverable(func=None, resume=None):
+    """
+    Register a job function so jobs running it are queued again when a restart
+    interrupted them. Its arguments must be JSON serializable, they are stored with the job.
+    Use as `@recoverable` or `@recoverable(resume=...)`.
+    Args:
+        func (callable): The job function.
+        resume (callable, optional): Takes the stored (args, kwargs) and returns the ones to
+            run the job with, e.g. to take again what the request had prepared for the job.
+            The job is marked failed when it raises.
+    Returns:
+        callable: The function, unchanged.
+    """
+    if func is None:
+        return lambda f: recoverable(f, resume)
+
+    _recoverable[_qualified_name(func)] = (func, resume)
+    return func
+
+
+# Utility method to describe a job's function call for the job store
+def stored_call(func, args, kwargs):
+    """
+    Build the record that lets a job run again after a restart.
+    Args:
+        func (callable): The job function.
+        args (tuple): Its positional arguments.
+        kwargs (dict): Its keyword arguments.
+    Returns:
+        dict or None: Function name and arguments, None when the function is not
+        recoverable or its arguments cannot be stored.
+    """
+    name = _qualified_name(func)
+    if name not in _recoverable:
+        return None
+
+    call = {"func": name, "args": list(args), "kwargs": kwargs}
+    try:
+        json.dumps(call)
+    except (TypeError, ValueError):
+        return None
+    return call
+
+
+def _qualified_name(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+# Utility method to get the job run by the current worker thread
+def current_job():
+    """
+    Return the job executed by the calling thread.
+    Returns:
+        Job or None: The running job, or None outside of a job worker.
+    """
+    return getattr(_current, "job", None)
+
+
+# Utility method to run a job synchronously or hand back its id
+def dispatch_job(
+    kind,
+    func,
+    *args,
+    run_async=False,
+    stream=False,
+    payload=None,
+    admit=None,
+    coalesce_key=None,
+    on_attach=None,
+    deadline=None,
+    cached=None,
+    **kwargs,
+):
+    """
+    Submit a job and either wait for its result, return its id immediately
+    or stream its progress as Server-Sent Events.
+    Args:
+        kind (str): Name of the endpoint that created the job.
+        func (callable): Function returning the response body for the job.
+            Streamed jobs must accept an `on_event(event, data)` callback.
+        run_async (bool): Return a 202 with the job id instead of waiting.
+        stream (bool): Return a `text/event-stream` response for the job.
+        payload (dict, optional): Request payload, kept for inspection.
+        admit (str, optional): Model the job calls. The job takes a place in the model's
+            admission queue and is rejected with a 429 when the queue is full.
+        coalesce_key (str, optional): Identifies the work. While a job with the same key is
+            queued or running, the request attaches to it and gets its result instead of
+            submitting a new job. Streamed requests always run their own job.
+        on_attach (callable, optional): Called when the request attached to an in-flight job,
+            to release what was prepared for a job that will not run.
+        deadline (float, optional): Seconds after which the job is cancelled as timed out,
+            see request_deadline. Defaults to JOB_DEADLINE.
+        cached (callable, optional): Returns True when the result cache already holds the
+            job's result (see is_cached). Such a job does not call the model and skips admission.
+    Returns:
+        tuple or flask.Response: (response body (dict), http status (int)[, headers (dict)]),
+        or the SSE response when streaming.
+    """
+    # An identical job is already queued or running, share its result
+    if coalesce_key:
+        coalesce_key = f"{kind}:{coalesce_key}"
+    if coalesce_key and not stream:
+        job = job_manager.attach(coalesce_key)
+        if job is not None:
+            print(f"Request attached to in-flight job {job.id}")
+            COALESCED_TOTAL.labels(endpoint=kind, model=admit or job.model or "unknown").inc()
+            if on_attach:
+                on_attach()
+            return job_response(job, run_async, coalesced=True)
+
+    admission = None
+    deferred_admission = None
+    if admit and cached is not None and cached():
+        admission_controller.check(admit)
+        deferred_admission = (admit, estimate_tokens(payload))
+    elif admit:
+        try:
+            admission = admission_controller.admit(admit, estimate_tokens(payload))
+        except AdmissionRejected as e:
+            ERRORS_TOTAL.labels(endpoint=kind, model=admit, kind="rejected").inc()
+            return rejected_body(e), 429, {"Retry-After": str(e.retry_after)}
+
+    if stream:
+        events = queue.Queue()
+
+        def run_streaming(*args, **kwargs):
+            return func(*args, on_event=lambda event, data: events.put((event, data)), **kwargs)
+
+        job = job_manager.submit(
+            kind,
+            run_streaming,
+            *args,
+            payload=payload,
+            model=admit,
+            admission=admission,
+            deferred_admission=deferred_admission,
+            deadline=deadline,
+            **kwargs,
+        )
+        # Close the stream however the job ends, also when func never ran, sse_response
+        # then sends the final `done` or `error` event
+        job.on_done(lambda: events.put(None))
+        return sse_response(job, events)
+
+    job = job_manager.submit(
+        kind,
+        func,
+        *args,
+        payload=payload,
+        model=admit,
+        admission=admission,
+        deferred_admission=deferred_admission,
+        coalesce_key=None if stream else coalesce_key,
+        deadline=deadline,
+        **kwargs,
+    )
+    return job_response(job, run_async)
+
+
+# Utility method to answer a request with a job
+def job_response(job, run_async, coalesced=False):
+    """
+    Hand back the job id right away, or wait for the job and return its result.
+    Args:
+        job (Job): The job serving the request.
+        run_async (bool): Return a 202 with the job id instead of waiting.
+        coalesced (bool): The request attached to a job submitted by another request.
+    Returns:
+        tuple: (response body (dict), http status (int)[, headers (dict)])
+    """
+    if run_async:
+        body = {
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.id}",
+        }
+        if coalesced:
+            body["coalesced"] = True
+        return body, 202
+
+    job.wait()
+    if job.retry_after is not None:
+        return job.result, job.http_status, {"Retry-After": str(job.retry_after)}
+    return job.result, job.http_status
+
+
+# Utility method to build the body of a rejected request
+def rejected_body(error):
+    """
+    Build the 429 response body for an admission rejection.
+    Args:
+        error (AdmissionRejected): The rejection.
+    Returns:
+        dict: Error message, model and seconds to wait before retrying.
+    """
+    return {
+        "error": str(error),
+        "status": "rejected",
+        "model": error.model_name,
+        "retry_after": error.retry_after,
+    }
+
+
+# Utility method to read the async flag from a request
+def is_async_request(req, data=None):
+    """
+    Check whether the job should run asynchronously. It does unless the client opts
+    into waiting for the result, via a `sync` query parameter or payload field, or by
+    setting `async` to false.
+    Args:
+        req (flask.Request): The incoming request.
+        data (dict, optional): Parsed request payload.
+    Returns:
+        bool: True if the job should run asynchronously.
+    """
+    if _request_flag(req, data, "sync"):
+        return False
+    return _request_flag(req, data, "async", default=True)
+
+
+# Utility method to read the stream flag from a request
+def is_stream_request(req, data=None):
+    """
+    Check whether the client asked for Server-Sent Events output,
+    either via the `stream` query parameter or a `stream` field in the payload.
+    Args:
+        req (flask.Request): The incoming request.
+        data (dict, optional): Parsed request payload.
+    Returns:
+        bool: True if the job output should be streamed.
+    """
+    return _request_flag(req, data, "stream")
+
+
+# Utility method to read the deadline of a request
+def request_deadline(req, data=None):
+    """
+    Read the seconds the client allows the job to run, from the `deadline` query
+    parameter or a `deadline` field in the payload, counted from submission.
+    Args:
+        req (flask.Request): The incoming request.
+        data (dict, optional): Parsed request payload.
+    Returns:
+        float or None: The deadline in seconds, None when the request has none.
+    Raises:
+        ValueError: The deadline is not a positive, finite number.
+    """
+    value = req.args.get("deadline")
+    if value is None and data:
+        value = data.get("deadline")
+    if value is None or value == "":
+        return None
+
+    try:
+        deadline = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid deadline: {value}")
+    # nan and inf parse as floats but can never be a timer
+    if not math.isfinite(deadline) or deadline <= 0:
+        raise ValueError(f"Invalid deadline: {value}")
+    return deadline
+
+
+def _request_flag(req, data, name, default=False):
+    value = req.args.get(name)
+    if value is None and data:
+        value = data.get(name)
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "yes")
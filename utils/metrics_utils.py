@@ -0,0 +1,283 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+# Generations range from cached answers (milliseconds) to long architect runs (minutes)
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    "aider_stage_duration_seconds",
+    "Duration of each generation stage.",
+    ["stage", "endpoint", "model"],
+    buckets=STAGE_BUCKETS,
+)
+JOBS_TOTAL = Counter(
+    "aider_jobs_total",
+    "Finished generation jobs by HTTP status.",
+    ["endpoint", "model", "http_status"],
+)
+ERRORS_TOTAL = Counter(
+    "aider_errors_total",
+    "Failed jobs and uploads by kind (invalid, rejected, cancelled, timed_out, error, upload).",
+    ["endpoint", "model", "kind"],
+)
+CACHE_LOOKUPS_TOTAL = Counter(
+    "aider_result_cache_lookups_total",
+    "Result cache lookups by result (hit or miss).",
+    ["endpoint", "model", "result"],
+)
+ZIP_BYTES_TOTAL = Counter(
+    "aider_zip_bytes_total",
+    "Bytes written to generated zip files.",
+    ["endpoint", "model"],
+)
+UPLOAD_BYTES_TOTAL = Counter(
+    "aider_upload_bytes_total",
+    "Bytes of zip files uploaded to the backend.",
+    ["endpoint", "model"],
+)
+TOKENS_TOTAL = Counter(
+    "aider_tokens_total",
+    "Model tokens by kind (cached_input, uncached_input, cache_write, output).",
+    ["endpoint", "model", "kind"],
+)
+CONTEXT_TOKENS_TOTAL = Counter(
+    "aider_context_tokens_total",
+    "Estimated reference file tokens before (original) and after (selected) context selection.",
+    ["endpoint", "model", "kind"],
+)
+COALESCED_TOTAL = Counter(
+    "aider_coalesced_requests_total",
+    "Requests that attached to an identical in-flight job instead of running their own.",
+    ["endpoint", "model"],
+)
+HEDGES_TOTAL = Counter(
+    "aider_hedges_total",
+    "Hedged generations by outcome (primary, fallback, skipped, not_needed).",
+    ["endpoint", "model", "outcome"],
+)
+# Under gunicorn each worker sets its own gauges, a scrape reports the sum over live workers
+QUEUE_DEPTH = Gauge(
+    "aider_queue_depth",
+    "Jobs waiting for a worker and uploads not finished yet.",
+    ["queue"],
+    multiprocess_mode="livesum",
+)
+JOBS_RUNNING = Gauge(
+    "aider_jobs_running",
+    "Jobs currently running on the workers.",
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "aider_admission_queue_depth",
+    "Jobs waiting for admission, per model.",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+
+# Kind of error reported for each failed job status
+ERROR_KINDS = {400: "invalid", 409: "cancelled", 429: "rejected", 504: "timed_out"}
+
+# Stage durations of the job run by the calling thread, see collect_stages
+_stages = threading.local()
+_stages_lock = threading.Lock()
+
+# Thread refreshing the gauges of a gunicorn worker, see start_gauge_refresh
+_refresh_thread = None
+_refresh_lock = threading.Lock()
+
+
+# Utility method to build the labels of a job's metrics
+def job_labels(job, model_name=None):
+    """
+    Return the endpoint and model labels for a job.
+    Args:
+        job (Job or None): The job, None outside of a job worker.
+        model_name (str, optional): The model, defaults to the job's model.
+    Returns:
+        dict: `endpoint` and `model` labels.
+    """
+    return {
+        "endpoint": job.kind if job else "direct",
+        "model": model_name or (job.model if job else None) or "unknown",
+    }
+
+
+# Utility method to record the duration of a stage
+def observe_stage(stage, seconds, labels):
+    """
+    Record a stage duration in the stage histogram.
+    Args:
+        stage (str): The stage name.
+        seconds (float): The stage duration.
+        labels (dict): `endpoint` and `model` labels.
+    Returns:
+        None
+    """
+    STAGE_SECONDS.labels(stage=stage, **labels).observe(seconds)
+
+    # Also add it to the stage timings of the job, when they are collected
+    target = getattr(_stages, "target", None)
+    if target is not None:
+        with _stages_lock:
+            target[stage] = round(target.get(stage, 0) + seconds, 6)
+
+
+# Utility method to collect the stage durations of a job
+@contextmanager
+def collect_stages(target):
+    """
+    Add the stages recorded by the calling thread inside the block to a dict,
+    so the job keeps its own timings next to the histogram.
+    Args:
+        target (dict or None): Seconds by stage, None collects nothing.
+    """
+    previous = getattr(_stages, "target", None)
+    _stages.target = target
+    try:
+        yield
+    finally:
+        _stages.target = previous
+
+
+# Utility method to get the dict stages are collected into
+def stage_target():
+    """
+    Return the dict the calling thread collects stage durations into, to
+    collect the stages of work handed to other threads into it too.
+    Returns:
+        dict or None: The target of collect_stages.
+    """
+    return getattr(_stages, "target", None)
+
+
+# Utility method to time a block as a stage
+@contextmanager
+def stage_timer(stage, labels):
+    """
+    Time the enclosed block and record it as a stage, also when it raises.
+    Args:
+        stage (str): The stage name.
+        labels (dict): `endpoint` and `model` labels.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, labels)
+
+
+# Utility method to count the tokens of a generation
+def record_tokens(usage, labels):
+    """
+    Add a job's token usage to the token counter.
+    Args:
+        usage (dict): Token usage of the job, see new_token_usage.
+        labels (dict): `endpoint` and `model` labels.
+    Returns:
+        None
+    """
+    for kind in ("cached_input", "uncached_input", "cache_write", "output"):
+        count = usage.get(f"{kind}_tokens", 0)
+        if count:
+            TOKENS_TOTAL.labels(kind=kind, **labels).inc(count)
+
+
+# Utility method to count a finished job
+def record_job(job):
+    """
+    Count a finished job and its error kind, and record its queue and total time.
+    Args:
+        job (Job): The finished job.
+    Returns:
+        None
+    """
+    labels = job_labels(job)
+    JOBS_TOTAL.labels(http_status=str(job.http_status), **labels).inc()
+    if job.http_status != 200:
+        ERRORS_TOTAL.labels(kind=ERROR_KINDS.get(job.http_status, "error"), **labels).inc()
+
+    if job.started_at:
+        observe_stage("queue", job.started_at - job.created_at, labels)
+        observe_stage("total", job.finished_at - job.created_at, labels)
+
+
+# Utility method to refresh the gauges before a scrape
+def update_queue_metrics(job_stats, admission_stats, upload_stats):
+    """
+    Set the queue depth gauges from the stats of the job manager,
+    the admission controller and the uploader.
+    Args:
+        job_stats (dict): JobManager.stats() output.
+        admission_stats (dict): AdmissionController.stats() output.
+        upload_stats (dict): CloudUploader.stats() output.
+    Returns:
+        None
+    """
+    QUEUE_DEPTH.labels(queue="jobs").set(job_stats["jobs"].get("queued", 0))
+    JOBS_RUNNING.set(job_stats["jobs"].get("running", 0))
+    QUEUE_DEPTH.labels(queue="uploads").set(
+        upload_stats["queued"] - upload_stats["succeeded"] - upload_stats["failed"]
+    )
+    for model_name, gate in admission_stats.items():
+        ADMISSION_QUEUE_DEPTH.labels(model=model_name).set(gate["queued"])
+
+
+# Utility method to tell whether metrics are shared between worker processes
+def multiprocess_enabled():
+    """
+    Check for prometheus_client's multiprocess mode, set up by gunicorn.conf.py.
+    Returns:
+        bool: True when every worker writes its metrics to PROMETHEUS_MULTIPROC_DIR.
+    """
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+# Utility method to render the metrics for a scrape
+def render_metrics():
+    """
+    Render the metrics in the Prometheus text format, merged over all
+    worker processes in multiprocess mode.
+    Returns:
+        bytes: The exposition.
+    """
+    if not multiprocess_enabled():
+        return generate_latest()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+# Utility method to keep the gauges of a worker current between scrapes
+def start_gauge_refresh(refresh, interval):
+    """
+    Call `refresh` every `interval` seconds on a background thread, once per
+    process. A scrape reaches only one gunicorn worker, the others update
+    their share of the gauges this way. Does nothing outside multiprocess mode,
+    where the scrape itself refreshes the gauges.
+    Args:
+        refresh (callable): Sets the gauges of this process, see update_queue_metrics.
+        interval (float): Seconds between refreshes.
+    Returns:
+        None
+    """
+    global _refresh_thread
+
+    def run():
+        while True:
+            try:
+                refresh()
+            except Exception as e:
+                print(f"Error refreshing metrics: {str(e)}")
+            time.sleep(interval)
+
+    with _refresh_lock:
+        if not multiprocess_enabled() or _refresh_thread is not None:
+            return
+        _refresh_thread = threading.Thread(target=run, name="metrics-refresh", daemon=True)
+        _refresh_thread.start()
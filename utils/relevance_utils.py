@@ -0,0 +1,247 @@
+import os
+import re
+import math
+from collections import Counter
+
+# BM25 parameters, the usual defaults
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words too common to tell chunks apart
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this "
+    "to was were will with should must shall can may not no all any each into".split()
+)
+
+TERM_PATTERN = re.compile(r"[a-z0-9_]+")
+HEADING_PATTERN = re.compile(r"^#{1,6}\s")
+
+# Marks the places where chunks were left out of an excerpt
+GAP_MARKER = "[...]"
+
+
+# Utility method to estimate the tokens of a text
+def count_tokens(text):
+    """
+    Estimate tokens at about 4 characters per token, like admission control does.
+    """
+    return len(text) // 4
+
+
+# Utility method to split text into search terms
+def tokenize(text):
+    """
+    Lowercase a text and split it into terms, without stopwords and single characters.
+    Args:
+        text (str): The text to split.
+    Returns:
+        list: The terms, in order.
+    """
+    return [
+        term
+        for term in TERM_PATTERN.findall(text.lower())
+        if len(term) > 1 and term not in STOPWORDS
+    ]
+
+
+# Utility method to split a reference file into chunks
+def chunk_text(text, chunk_tokens):
+    """
+    Split a text into chunks of about `chunk_tokens` tokens along paragraph
+    boundaries. A markdown heading always starts a new chunk, and every chunk
+    remembers the heading of its section so an excerpt keeps its structure.
+    Args:
+        text (str): The file content.
+        chunk_tokens (int): Target size of a chunk in tokens.
+    Returns:
+        list: Dicts with the chunk `text`, its section `heading` and `tokens`.
+    """
+    chunks = []
+    heading = None
+    current = []
+    current_tokens = 0
+
+    def flush():
+        if current:
+            body = "\n\n".join(current)
+            chunks.append({"text": body, "heading": heading, "tokens": count_tokens(body)})
+
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip("\n")
+        if not paragraph.strip():
+            continue
+
+        tokens = count_tokens(paragraph)
+        starts_section = bool(HEADING_PATTERN.match(paragraph))
+        if current and (starts_section or current_tokens + tokens > chunk_tokens):
+            flush()
+            current, current_tokens = [], 0
+
+        if starts_section:
+            heading = paragraph.splitlines()[0]
+
+        current.append(paragraph)
+        current_tokens += tokens
+
+    flush()
+    return chunks
+
+
+class BM25Index:
+    """
+    In-memory BM25 index over a list of text chunks.
+    """
+
+    def __init__(self, documents):
+        self.terms = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(terms.values()) for terms in self.terms]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+
+        document_frequency = Counter()
+        for terms in self.terms:
+            document_frequency.update(terms.keys())
+
+        count = len(documents)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def scores(self, query):
+        """
+        Score every chunk against a query.
+        Args:
+            query (str): The query text.
+        Returns:
+            list: One BM25 score per chunk, in index order.
+        """
+        query_terms = set(tokenize(query))
+        scores = []
+
+        for terms, length in zip(self.terms, self.lengths):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.average_length or 1))
+            for term in query_terms:
+                frequency = terms.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+            scores.append(score)
+
+        return scores
+
+
+# Utility method to keep only the relevant parts of the reference files
+def select_context(files, query, token_budget, chunk_tokens, excerpt_dir):
+    """
+    Chunk the reference files, rank the chunks against the query with BM25 and
+    keep the best ones within the token budget. Files that lose chunks are
+    replaced by an excerpt written below `excerpt_dir` under the same name, with
+    the kept chunks in their original order. Files that are not readable as
+    text are passed through whole.
+    Args:
+        files (list): Absolute paths of the reference files.
+        query (str): Text the chunks are ranked against, usually context and instruction.
+        token_budget (int): Maximum tokens of the selected chunks.
+        chunk_tokens (int): Target size of a chunk in tokens.
+        excerpt_dir (str): Folder receiving the excerpts.
+    Returns:
+        dict: `files` to pass to the coder, and the original, selected and saved token counts.
+    """
+    chunks = []
+    passthrough = []
+
+    for path in files:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            passthrough.append(path)
+            continue
+
+        for index, chunk in enumerate(chunk_text(text, chunk_tokens)):
+            chunks.append({**chunk, "path": path, "index": index})
+
+    original_tokens = sum(chunk["tokens"] for chunk in chunks)
+    report = {
+        "files": list(files),
+        "original_tokens": original_tokens,
+        "selected_tokens": original_tokens,
+        "saved_tokens": 0,
+        "chunks": len(chunks),
+        "chunks_selected": len(chunks),
+    }
+    if original_tokens <= token_budget:
+        return report
+
+    # Nothing in the references matches the query, leave them alone
+    scores = BM25Index([chunk["text"] for chunk in chunks]).scores(query)
+    if not any(scores):
+        return report
+
+    # Best chunks first, skipping repeated text and the chunks that no longer fit the budget
+    selected = set()
+    seen = set()
+    used = 0
+    for position in sorted(range(len(chunks)), key=lambda i: -scores[i]):
+        if scores[position] <= 0:
+            break
+        if chunks[position]["text"] in seen:
+            continue
+        if used + chunks[position]["tokens"] <= token_budget:
+            seen.add(chunks[position]["text"])
+            selected.add(position)
+            used += chunks[position]["tokens"]
+
+    selected_files = []
+    for position, path in enumerate(files):
+        if path in passthrough:
+            selected_files.append(path)
+            continue
+
+        positions = [i for i, chunk in enumerate(chunks) if chunk["path"] == path]
+        kept = [i for i in positions if i in selected]
+        if len(kept) == len(positions):
+            selected_files.append(path)
+            continue
+        if not kept:
+            continue
+
+        # One folder per file, so references with the same name do not collide
+        excerpt_path = os.path.join(excerpt_dir, str(position), os.path.basename(path))
+        os.makedirs(os.path.dirname(excerpt_path), exist_ok=True)
+        with open(excerpt_path, "w", encoding="utf-8") as f:
+            f.write(build_excerpt([chunks[i] for i in kept]))
+        selected_files.append(excerpt_path)
+
+    report.update(
+        files=selected_files,
+        selected_tokens=used,
+        saved_tokens=original_tokens - used,
+        chunks_selected=len(selected),
+    )
+    return report
+
+
+# Utility method to join the kept chunks of a file
+def build_excerpt(chunks):
+    """
+    Join chunks in their original order, marking left out parts and
+    repeating the section heading where a chunk does not start with it.
+    Args:
+        chunks (list): Kept chunks of one file, in order.
+    Returns:
+        str: The excerpt text.
+    """
+    parts = []
+    previous = None
+    for chunk in chunks:
+        text = chunk["text"]
+        follows = previous is not None and chunk["index"] == previous + 1
+        if not follows and chunk["index"] != 0:
+            parts.append(GAP_MARKER)
+            if chunk["heading"] and not text.startswith(chunk["heading"]):
+                text = f"{chunk['heading']}\n\n{text}"
+        parts.append(text)
+        previous = chunk["index"]
+
+    return "\n\n".join(parts) + "\n"
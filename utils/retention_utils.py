@@ -0,0 +1,242 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import threading
+from config import Config
+from utils.job_store_utils import job_store
+
+# Entries this server creates in an output folder: job folders named after the job id
+# (uuid4 hex, `-hedge` for a hedge attempt) and their zip files
+OUTPUT_ENTRY_PATTERN = re.compile(r"[0-9a-f]{32}(?:-hedge)?(?:\.zip)?")
+
+
+class RetentionManager:
+    """
+    Background garbage collection of job outputs.
+
+    Every output folder used by a job (`<directory>/output`) is tracked, and
+    recorded in the job store so it is still swept after a restart. Each job
+    folder or job zip file in it is removed once it is older than `max_age`
+    seconds, and the oldest ones are removed while all tracked folders together
+    exceed `max_bytes`. Other files the client keeps in the folder are never
+    touched. Folders of running jobs are pinned, and nothing younger than
+    `min_age` is removed, which also protects jobs of other processes such as
+    batch workers.
+    """
+
+    def __init__(
+        self, enabled=None, max_age=None, max_bytes=None, interval=None, min_age=None, store=None
+    ):
+        self.enabled = enabled if enabled is not None else Config.RETENTION_ENABLED
+        self.max_age = max_age or Config.RETENTION_MAX_AGE
+        self.max_bytes = max_bytes or Config.RETENTION_MAX_BYTES
+        self.interval = interval or Config.RETENTION_INTERVAL
+        self.min_age = min_age if min_age is not None else Config.RETENTION_MIN_AGE
+        self.store = store or job_store
+        self._lock = threading.Lock()
+        self._roots = {os.path.abspath(os.path.join(os.getcwd(), "output"))}
+        self._pinned = {}
+        self._stats = {"sweeps": 0, "evictions": 0, "freed_bytes": 0, "last_sweep": None}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, base_output_dir):
+        """
+        Add an output folder to the folders swept by the manager.
+        Args:
+            base_output_dir (str): Absolute path of an `output` folder.
+        Returns:
+            None
+        """
+        with self._lock:
+            if base_output_dir in self._roots:
+                return
+            self._roots.add(base_output_dir)
+
+        try:
+            self.store.add_output_root(base_output_dir)
+        except sqlite3.Error as e:
+            print(f"Error recording output folder {base_output_dir}: {str(e)}")
+
+    def pin(self, path):
+        """
+        Keep a job folder from being removed until it is unpinned.
+        Args:
+            path (str): Absolute path of the job folder.
+        Returns:
+            None
+        """
+        with self._lock:
+            self._pinned[path] = self._pinned.get(path, 0) + 1
+
+    def unpin(self, path):
+        """
+        Let a job folder pinned with pin be removed again.
+        Args:
+            path (str): The path passed to pin.
+        Returns:
+            None
+        """
+        with self._lock:
+            count = self._pinned.get(path, 0) - 1
+            if count > 0:
+                self._pinned[path] = count
+            else:
+                self._pinned.pop(path, None)
+
+    def start(self):
+        """
+        Start sweeping on a background thread every `interval` seconds, once,
+        including the output folders recorded before a restart.
+        Returns:
+            None
+        """
+        try:
+            roots = self.store.output_roots()
+        except sqlite3.Error as e:
+            print(f"Error reading recorded output folders: {str(e)}")
+            roots = []
+
+        with self._lock:
+            self._roots.update(roots)
+            if not self.enabled or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background sweeps.
+        Returns:
+            None
+        """
+        self._stop.set()
+
+    def sweep(self):
+        """
+        Remove expired entries, then the oldest ones while over the size budget.
+        Returns:
+            dict: Entries removed and bytes freed by this sweep.
+        """
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        freed = 0
+
+        for path, modified, size in entries:
+            age = now - modified
+            if age <= self.max_age and total <= self.max_bytes:
+                continue
+            with self._lock:
+                if age < self.min_age or path in self._pinned:
+                    continue
+
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+            total -= size
+            removed += 1
+            freed += size
+
+        with self._lock:
+            self._stats["sweeps"] += 1
+            self._stats["evictions"] += removed
+            self._stats["freed_bytes"] += freed
+            self._stats["last_sweep"] = now
+
+        if removed:
+            print(f"Retention removed {removed} outputs, freed {freed} bytes")
+        return {"removed": removed, "freed_bytes": freed}
+
+    def usage(self):
+        """
+        Report the disk usage of the tracked output folders.
+        Returns:
+            dict: Bytes and entries per folder, totals, free disk space, limits and sweep counters.
+        """
+        roots = {}
+        for path, _, size in self._entries():
+            root = roots.setdefault(os.path.dirname(path), {"entries": 0, "bytes": 0})
+            root["entries"] += 1
+            root["bytes"] += size
+
+        for root in list(roots):
+            try:
+                roots[root]["disk_free_bytes"] = shutil.disk_usage(root).free
+            except OSError:
+                pass
+
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "bytes": sum(root["bytes"] for root in roots.values()),
+                "entries": sum(root["entries"] for root in roots.values()),
+                "max_bytes": self.max_bytes,
+                "max_age": self.max_age,
+                "pinned": len(self._pinned),
+                "roots": roots,
+                **self._stats,
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Retention sweep failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def _entries(self):
+        # (path, last modified, size) of every job folder and zip of the tracked output folders
+        with self._lock:
+            roots = list(self._roots)
+
+        entries = []
+        for root in roots:
+            try:
+                names = os.listdir(root)
+            except OSError:
+                continue
+            for name in names:
+                if not OUTPUT_ENTRY_PATTERN.fullmatch(name):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    entries.append((path, os.path.getmtime(path), disk_size(path)))
+                except OSError:
+                    continue
+
+        return entries
+
+
+# Utility method to measure a file or folder
+def disk_size(path):
+    """
+    Sum the sizes of a file or of every file below a folder.
+    Args:
+        path (str): Path of the file or folder.
+    Returns:
+        int: Size in bytes.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+# Shared retention manager started by the server
+retention_manager = RetentionManager()
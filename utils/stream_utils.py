@@ -0,0 +1,90 @@
+import json
+import queue
+from flask import Response, stream_with_context
+
+
+# Forward streamed chunks of every coder to its IO (see JobIO), editor coders share the architect IO.
+# Installed by load_aider once aider is imported.
+def install_stream_hook(Coder):
+    original = Coder.show_send_output_stream
+    if getattr(original, "emits_tokens", False):
+        return
+
+    def show_send_output_stream(self, completion):
+        self.stream_usage = None
+
+        # Keep the usage some providers attach to the last chunks, see _install_usage_recorder
+        def chunks():
+            check_cancelled = getattr(self.io, "check_cancelled", None)
+            for chunk in completion:
+                if check_cancelled:
+                    check_cancelled()
+                usage = getattr(chunk, "usage", None)
+                if usage:
+                    self.stream_usage = usage
+                yield chunk
+
+        for text in original(self, chunks()):
+            emit_token = getattr(self.io, "emit_token", None)
+            if emit_token:
+                emit_token(self, text)
+            yield text
+
+    show_send_output_stream.emits_tokens = True
+    Coder.show_send_output_stream = show_send_output_stream
+
+
+# Utility method to format a Server-Sent Event
+def format_sse(event, data):
+    """
+    Format one Server-Sent Event.
+    Args:
+        event (str): The event name.
+        data (dict): The JSON serializable event payload.
+    Returns:
+        str: The encoded event, terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Utility method to stream a job's events as an SSE response
+def sse_response(job, events, keepalive=15):
+    """
+    Build a `text/event-stream` response that relays the job's events and ends
+    with a `done` (or `error`) event carrying the job result.
+    Args:
+        job (Job): The running job.
+        events (queue.Queue): Queue of (event, data) tuples filled by the job, closed by None.
+        keepalive (int): Seconds between keep-alive comments while the job is quiet.
+    Returns:
+        flask.Response: The streaming response.
+    """
+
+    def generate():
+        yield format_sse("job", {"job_id": job.id, "status_url": f"/jobs/{job.id}"})
+
+        while True:
+            try:
+                item = events.get(timeout=keepalive)
+            except queue.Empty:
+                # Comment lines keep proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+
+            # None marks the end of the job's events
+            if item is None:
+                break
+            yield format_sse(*item)
+
+        job.wait()
+        final = "done" if job.status == "succeeded" else "error"
+        yield format_sse(
+            final,
+            {"job_id": job.id, "http_status": job.http_status, "result": job.result},
+        )
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
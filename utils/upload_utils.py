@@ -0,0 +1,261 @@
+import io
+import os
+import time
+import uuid
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from config import Config
+from utils.metrics_utils import ERRORS_TOTAL, UPLOAD_BYTES_TOTAL, observe_stage
+
+
+class MultipartFileStream:
+    """
+    File-like multipart/form-data body with a single file field.
+    The file is read from disk in chunks while requests sends the body,
+    and the known length lets requests send a Content-Length header.
+    """
+
+    def __init__(self, path, field_name, filename, content_type="application/octet-stream"):
+        self.boundary = uuid.uuid4().hex
+        head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+        self._parts = [io.BytesIO(head), open(path, "rb"), io.BytesIO(tail)]
+        self._length = len(head) + os.path.getsize(path) + len(tail)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0).close()
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+
+        return b"".join(chunks)
+
+    def close(self):
+        for part in self._parts:
+            part.close()
+        self._parts = []
+
+
+class UploadTask:
+    """
+    State of one zip upload: queued, uploading, succeeded or failed.
+    """
+
+    def __init__(self, zip_path, zip_name=None, labels=None):
+        self.id = uuid.uuid4().hex
+        self.zip_path = zip_path
+        self.zip_name = zip_name or os.path.basename(zip_path)
+        self.labels = labels or {"endpoint": "direct", "model": "unknown"}
+        self.status = "queued"
+        self.attempts = 0
+        self.http_status = None
+        self.response = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "zip_name": self.zip_name,
+            "status": self.status,
+            "attempts": self.attempts,
+            "http_status": self.http_status,
+            "response": self.response,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class CloudUploader:
+    """
+    Uploads zip files to the backend on a bounded pool of background threads.
+    All uploads share one requests.Session, so connections to the backend are
+    pooled, and failed attempts are retried with exponential backoff.
+    """
+
+    def __init__(self, max_workers=None, max_retries=None, backoff=None, timeout=None):
+        self.max_workers = max_workers or Config.UPLOAD_WORKERS
+        self.max_retries = max_retries if max_retries is not None else Config.UPLOAD_MAX_RETRIES
+        self.backoff = backoff if backoff is not None else Config.UPLOAD_BACKOFF
+        self.timeout = timeout or (Config.UPLOAD_CONNECT_TIMEOUT, Config.UPLOAD_READ_TIMEOUT)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.verify = Config.UPLOAD_VERIFY_TLS
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="cloud-upload"
+        )
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._stats = {"queued": 0, "succeeded": 0, "failed": 0, "retries": 0}
+
+    def submit(self, zip_path, zip_name=None, labels=None):
+        """
+        Queue a zip file for upload and return immediately.
+        Args:
+            zip_path (str): The path of the zip file to upload.
+            zip_name (str, optional): The name of the uploaded zip file. Defaults to the file name.
+            labels (dict, optional): `endpoint` and `model` metrics labels of the upload.
+        Returns:
+            UploadTask: The queued upload, updated as it progresses.
+        """
+        task = UploadTask(zip_path, zip_name, labels)
+        with self._lock:
+            self._stats["queued"] += 1
+            self._pending.add(task)
+
+        self._executor.submit(self.upload, task)
+        return task
+
+    def upload(self, task):
+        """
+        Upload a zip file, retrying connection errors, 429 and 5xx responses.
+        Args:
+            task (UploadTask): The upload to perform.
+        Returns:
+            UploadTask: The finished upload.
+        """
+        backend_url = f"{Config.BACKEND_URL}/api/v1/files/zip/upload"
+        task.status = "uploading"
+        started = time.perf_counter()
+
+        try:
+            while True:
+                task.attempts += 1
+                retry = False
+                body = MultipartFileStream(
+                    task.zip_path, "file", task.zip_name, "application/zip"
+                )
+                try:
+                    response = self.session.post(
+                        backend_url,
+                        data=body,
+                        headers={"Content-Type": body.content_type},
+                        timeout=self.timeout,
+                    )
+                    task.http_status = response.status_code
+
+                    if 200 <= response.status_code < 300:
+                        task.response = _response_body(response)
+                        task.error = None
+                        task.status = "succeeded"
+                        print(f"Successfully uploaded {task.zip_name} to cloud storage.")
+                        break
+
+                    task.error = f"Status code: {response.status_code}, Response: {response.text}"
+                    retry = response.status_code == 429 or response.status_code >= 500
+
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    task.error = str(e)
+                    retry = True
+
+                finally:
+                    body.close()
+
+                if not retry or task.attempts > self.max_retries:
+                    task.status = "failed"
+                    print(f"Failed to upload {task.zip_name}. {task.error}")
+                    break
+
+                with self._lock:
+                    self._stats["retries"] += 1
+                time.sleep(self.backoff * (2 ** (task.attempts - 1)))
+
+        except Exception as e:
+            task.status = "failed"
+            task.error = str(e)
+            print(f"Error uploading {task.zip_name} to cloud storage: {str(e)}")
+
+        finally:
+            task.finished_at = time.time()
+            observe_stage("upload_to_cloud", time.perf_counter() - started, task.labels)
+            if task.status == "succeeded":
+                UPLOAD_BYTES_TOTAL.labels(**task.labels).inc(os.path.getsize(task.zip_path))
+            else:
+                ERRORS_TOTAL.labels(kind="upload", **task.labels).inc()
+
+            with self._lock:
+                self._stats["succeeded" if task.status == "succeeded" else "failed"] += 1
+                self._pending.discard(task)
+            task._done.set()
+
+        return task
+
+    def drain(self, timeout=None):
+        """
+        Wait for the queued and running uploads to finish, used before the process exits.
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (wait forever).
+        Returns:
+            int: Number of uploads still unfinished when the timeout expired.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            pending = list(self._pending)
+
+        for task in pending:
+            task.wait(max(0, deadline - time.time()) if deadline is not None else None)
+
+        return sum(1 for task in pending if not task.wait(0))
+
+    def stats(self):
+        """
+        Report upload counters.
+        Returns:
+            dict: Queued, succeeded, failed and retried uploads.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+def _response_body(response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+# Shared uploader used by all generation jobs
+cloud_uploader = CloudUploader()
+
+
+# Utility to upload zip file to cloud storage
+def upload_to_cloud(zip_path, zipName=None, labels=None):
+    """
+    Queue the zip for upload to the backend endpoint without waiting for it.
+    Args:
+        zip_path (str): The path of the zip file to upload.
+        zipName (str, optional): The name of the uploaded zip file. Defaults to the file name.
+        labels (dict, optional): `endpoint` and `model` metrics labels of the upload.
+    Returns:
+        UploadTask: The queued upload, its status is updated in the background.
+    """
+    return cloud_uploader.submit(zip_path, zipName, labels)
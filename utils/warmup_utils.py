@@ -0,0 +1,131 @@
+import time
+import threading
+from config import Config
+from utils.aider_utils import coder_pool, load_aider
+
+
+class WarmUp:
+    """
+    Background warm-up of the server: imports aider and litellm, loads the
+    configured models and prebuilds idle coders, so the first request does not
+    pay for them. The server answers /health right away and /ready once
+    warm-up has finished.
+    """
+
+    def __init__(self, enabled=None, models=None, coders=None):
+        self.enabled = enabled if enabled is not None else Config.WARMUP_ENABLED
+        self.models = models if models is not None else Config.WARMUP_MODELS
+        self.coders = coders if coders is not None else Config.WARMUP_CODERS
+        self.state = "pending"
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.steps = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state in ("ready", "disabled")
+
+    def start(self):
+        """
+        Start warm-up on a background thread, once. When warm-up is disabled
+        the server is ready right away and loads everything on first use.
+        Returns:
+            None
+        """
+        with self._lock:
+            if not self.enabled:
+                self.state = "disabled"
+                return
+            if self._thread is not None:
+                return
+            self.state = "warming"
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        """
+        Import aider, load every configured model and prebuild its coders.
+        A model that fails to load marks warm-up as failed, the server keeps
+        serving and loads models on demand instead.
+        Returns:
+            None
+        """
+        try:
+            self._step("import_aider", load_aider)
+            for model_name in self.models:
+                self._step(f"model:{model_name}", coder_pool.get_model, model_name)
+                if self.coders:
+                    # Jobs plan with an architect coder when the editor phase is configured
+                    self._step(
+                        f"coders:{model_name}",
+                        coder_pool.prewarm,
+                        model_name,
+                        self.coders,
+                        edit_format=(
+                            "architect"
+                            if Config.EDITOR_MODEL or Config.PARALLEL_EDITOR_ENABLED
+                            else None
+                        ),
+                    )
+            if Config.EDITOR_MODEL:
+                self._step(f"model:{Config.EDITOR_MODEL}", coder_pool.get_model, Config.EDITOR_MODEL)
+            self.state = "ready"
+            print(f"Warm-up finished in {time.time() - self.started_at:.2f}s")
+
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Warm-up failed: {str(e)}")
+
+        finally:
+            self.finished_at = time.time()
+
+    def preload(self):
+        """
+        Import aider and load the configured models in the calling process,
+        without prebuilding coders. The server master calls this before it
+        forks its workers, so they start with the modules and models loaded.
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+
+        try:
+            self._step("import_aider", load_aider)
+            for model_name in self.models:
+                self._step(f"model:{model_name}", coder_pool.get_model, model_name)
+            if Config.EDITOR_MODEL:
+                self._step(f"model:{Config.EDITOR_MODEL}", coder_pool.get_model, Config.EDITOR_MODEL)
+            print(f"Preloaded aider and {len(self.models)} models")
+
+        except Exception as e:
+            print(f"Preload failed, workers load on demand: {str(e)}")
+
+    def status(self):
+        """
+        Report the warm-up state and the duration of each step.
+        Returns:
+            dict: State, error, timings and per-step seconds.
+        """
+        return {
+            "status": self.state,
+            "error": self.error,
+            "models": self.models,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "steps": dict(self.steps),
+        }
+
+    def _step(self, name, func, *args, **kwargs):
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        self.steps[name] = round(time.perf_counter() - started, 3)
+
+
+# Shared warm-up started by the server
+warm_up = WarmUp()